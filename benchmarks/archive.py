@@ -0,0 +1,88 @@
+import os
+import sys
+import cv2
+import time
+import shutil
+import argparse
+import tempfile
+
+import numpy as np
+
+sys.path.insert(0, '..')
+from utils.archive import MaskArchive
+from utils.benchmark import save_results
+from utils.synthetic import make_crop, fence_mask
+
+
+RESULTS = 'results'
+
+SEED = 0
+PANORAMAS = 250
+LOOKUPS = 200
+
+
+def make_predictions(n):
+    """ synthetic fence masks of the left and right crops, with blurred masks as probabilities
+    """
+    for index in range(n):
+        for k, side in enumerate(['l', 'r']):
+            _, fences, _ = make_crop(SEED, index, k, render=False)
+            probs = cv2.GaussianBlur(fence_mask(fences).astype('float32'), (0, 0), 3)
+
+            yield f'SYN{SEED:04d}-{index:07d}', side, probs > .5, probs
+
+
+def per_call(fn, n):
+    """"""
+    start = time.perf_counter()
+    fn()
+
+    return (time.perf_counter() - start) / n
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='size and read speed of the prediction mask archive')
+    parser.add_argument('--panoramas', type=int, default=PANORAMAS)
+    parser.add_argument('--lookups', type=int, default=LOOKUPS)
+    args = parser.parse_args()
+
+    os.makedirs(RESULTS, exist_ok=True)
+    save = tempfile.mkdtemp()
+
+    predictions = list(make_predictions(args.panoramas))
+    n = len(predictions)
+    keys = [(fname, side) for fname, side, _, _ in predictions]
+    lookups = [keys[i] for i in np.random.default_rng(SEED).integers(n, size=args.lookups)]
+
+    results = {}
+
+    try:
+        for probabilities in [False, True]:
+            fpath = os.path.join(save, f'masks-{probabilities}.sqlite')
+            archive = MaskArchive(fpath)
+
+            def write():
+                for fname, side, mask, probs in predictions:
+                    archive.put(fname, side, mask, probs if probabilities else None)
+
+                archive.commit()
+
+            name = 'masks and probabilities' if probabilities else 'masks'
+            results[name] = {
+                'write_ms': per_call(write, n) * 1e3,
+                'bytes_per_mask': os.path.getsize(fpath) / n,
+                'raw_bytes_per_mask': predictions[0][2].size / 8,
+                'get_ms': per_call(lambda: [archive.get(*key, probabilities=probabilities) for key in lookups],
+                                   len(lookups)) * 1e3,
+                'scan_boxes_ms': per_call(lambda: list(archive.scan(masks=False)), n) * 1e3,
+                'scan_masks_ms': per_call(lambda: list(archive.scan(probabilities=probabilities)), n) * 1e3,
+            }
+
+            archive.close()
+    finally:
+        shutil.rmtree(save)
+
+    for name, result in results.items():
+        print(f'{name:<24}  ' + '  '.join(f'{key} {value:>8.3f}' for key, value in result.items()))
+
+    save_results(os.path.join(RESULTS, f'archive-{time.strftime("%Y%m%d-%H%M%S")}.json'), results)
@@ -0,0 +1,152 @@
+import os
+import sys
+import time
+import fnmatch
+import argparse
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, '..')
+from utils.benchmark import timeit, save_results, load_results, compare, format_table
+from utils.synthetic import get_rng, make_mask, make_geometry, make_metadata, make_panorama
+from utils.inference import estimate_height
+from utils import rle
+from utils.augmentation import get_preprocessing
+from utils.metrics import to_blobs, calculate, BlobOverlap
+from loaders.datasets import AmsterdamDataset, PolygonFences
+from loaders.loaders import PanoramaImage
+from scripts.cvat2coco import binary_mask_to_rle, polyline_to_polygon
+from scripts.synthetic import write_dataset
+
+
+# baseline and result files
+BASELINE = 'baseline.json'
+RESULTS = 'results'
+
+# synthetic input details
+SEED = 0
+SIZES = [(256, 512), (512, 1024)]
+DENSITIES = [.01, .05, .2]
+BATCH_SIZE = 4
+
+# relative slowdown that counts as a regression
+TOLERANCE = .2
+
+
+def mask_cases(seed=SEED, sizes=SIZES, densities=DENSITIES):
+    """ (suffix, mask) pairs for all sizes and densities
+    """
+    for height, width in sizes:
+        for density in densities:
+            mask = make_mask(get_rng(seed, height, int(density * 1000)), height=height, width=width, density=density)
+            yield f'{height}x{width}-d{density}', mask
+
+
+def get_benchmarks(tmpdir, seed=SEED):
+    """ list of (name, callable) pairs for all hot paths
+    """
+    benchmarks = []
+
+    for suffix, mask in mask_cases(seed):
+        target = make_mask(get_rng(seed, 1, *mask.shape), height=mask.shape[0], width=mask.shape[1],
+                           density=mask.mean())
+
+        # blobbing and blob overlap
+        benchmarks.append((f'to_blobs[{suffix}]', lambda mask=mask: to_blobs(mask)))
+        benchmarks.append((f'calculate[{suffix}]', lambda mask=mask, target=target: calculate(mask.copy(), target.copy())))
+
+        # annotation conversion
+        fortran = np.asfortranarray(mask)
+        benchmarks.append((f'binary_mask_to_rle[{suffix}]', lambda fortran=fortran: binary_mask_to_rle(fortran)))
+        benchmarks.append((f'rle.decode[{suffix}]', lambda counts=rle.encode(mask): rle.decode(counts)))
+
+        # inference height estimator
+        benchmarks.append((f'estimate_height[{suffix}]', lambda mask=mask: estimate_height(mask)))
+
+    # blob overlap over a batch of predictions and targets
+    height, width = SIZES[-1]
+    preds = np.stack([make_mask(get_rng(seed, 2, i), height, width, density=.02) for i in range(BATCH_SIZE)])[:, None]
+    targets = np.stack([make_mask(get_rng(seed, 3, i), height, width, density=.02) for i in range(BATCH_SIZE)])[:, None]
+
+    benchmarks.append((f'rle.encode_batch[b{BATCH_SIZE}]', lambda: rle.encode_batch(preds[:, 0])))
+    benchmarks.append((f'BlobOverlap.update[b{BATCH_SIZE}]', lambda: BlobOverlap().update([preds.copy()], [targets.copy()])))
+
+    try:
+        import ray
+        ray.init(num_cpus=os.cpu_count(), ignore_reinit_error=True, include_dashboard=False, log_to_driver=False)
+        benchmarks.append((f'BlobOverlap.update_all[b{BATCH_SIZE}]', lambda: BlobOverlap().update_all([preds.copy()], [targets.copy()])))
+    except Exception as e:
+        print(f'skipping BlobOverlap.update_all: {e}')
+
+    # polyline rasterization and blobbing
+    fences, i = [], 0
+    while not fences:
+        fences, _ = make_geometry(get_rng(seed, 4, i), density=1.)
+        i += 1
+    benchmarks.append(('polyline_to_polygon', lambda: polyline_to_polygon(fences[0], 1024, 512)))
+
+    # datasets on a small synthetic dataset
+    paths = write_dataset(save=tmpdir, number=8, seed=seed, batches=1, panoramas=False, verbose=False)
+    annotations = os.path.join(paths['json'], os.listdir(paths['json'])[0])
+
+    amsterdam = AmsterdamDataset(paths['images'], annotations, train=False)
+    amsterdam_tensor = AmsterdamDataset(paths['images'], annotations, train=False, preprocessing=get_preprocessing())
+    polygons = PolygonFences(paths['images'], paths['masks'], subset='train')
+
+    # full pass over all crops
+    n = len(polygons)
+
+    benchmarks.append((f'AmsterdamDataset.__getitem__[x{n}]', lambda: [amsterdam[i] for i in range(len(amsterdam))]))
+    benchmarks.append((f'AmsterdamDataset.__getitem__[x{n}-preprocessing]', lambda: [amsterdam_tensor[i] for i in range(len(amsterdam_tensor))]))
+    benchmarks.append((f'PolygonFences.__getitem__[x{n}]', lambda: [polygons[i] for i in range(len(polygons))]))
+
+    # panorama slicing, with and without wrap-around at the 0/360 degree seam
+    metadata = make_metadata(seed, 0)
+    panorama, _ = make_panorama(seed, 0, metadata=metadata)
+    panorama = PanoramaImage(panorama, pd.Series(metadata))
+
+    benchmarks.append(('PanoramaImage.__getitem__', lambda: panorama[1744:2256, 2000:3024]))
+    benchmarks.append(('PanoramaImage.__getitem__[wrap]', lambda: panorama[1744:2256, 7500:524]))
+
+    return benchmarks
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='micro-benchmarks for hot paths')
+    parser.add_argument('--filter', type=str, default='*', help='glob pattern on benchmark names')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--baseline', type=str, default=BASELINE)
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE)
+    parser.add_argument('--save-baseline', action='store_true', help='store these results as the new baseline')
+    parser.add_argument('--check', action='store_true', help='exit with an error on regressions')
+    args = parser.parse_args()
+
+    np.random.seed(SEED)
+    os.makedirs(RESULTS, exist_ok=True)
+
+    results = {}
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for name, fn in get_benchmarks(tmpdir):
+            if not fnmatch.fnmatch(name, args.filter):
+                continue
+
+            results[name] = timeit(fn, repeat=args.repeat)
+            print(f'{name}: {results[name]["median"] * 1e3:.3f}ms')
+
+    save_results(os.path.join(RESULTS, f'hotpaths-{time.strftime("%Y%m%d-%H%M%S")}.json'), results)
+
+    if args.save_baseline:
+        # merge into the existing baseline, so filtered runs only update their own entries
+        baseline = load_results(args.baseline) if os.path.isfile(args.baseline) else {}
+        baseline.update(results)
+        save_results(args.baseline, baseline)
+
+    elif os.path.isfile(args.baseline):
+        rows = compare(results, load_results(args.baseline), tolerance=args.tolerance)
+        print('\n' + format_table(rows))
+
+        if args.check and any(row[-1] == 'REGRESSION' for row in rows):
+            sys.exit(1)
@@ -0,0 +1,84 @@
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+import numpy as np
+
+sys.path.insert(0, '..')
+from utils.benchmark import save_results, format_table, compare, load_results
+
+
+BASELINE = 'imports-baseline.json'
+RESULTS = 'results'
+
+# models are imported from their own folder, as train.py does
+MODELS_DIR = os.path.join('..', 'models')
+
+REPEAT = 3
+
+# every case runs in a fresh interpreter, which reports its own wall time and peak memory
+TEMPLATE = '''
+import time, json, resource
+start = time.perf_counter()
+{code}
+print(json.dumps({{'time': time.perf_counter() - start,
+                  'peak_memory_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2 ** 10}}))
+'''
+
+
+def get_cases(decoder, encoder, weights):
+    """ (name, code) pairs, eager construction of all architectures is what importing model.py used to do
+    """
+    kwargs = f'encoder_name={encoder!r}, encoder_weights={weights!r}, classes=1, activation="sigmoid", offline=True'
+
+    return [
+        ('import model', 'import model'),
+        (f'get_model[{decoder}]', f'import model; model.get_model({decoder!r}, {kwargs})'),
+        ('get_model[all]', f'import model\nfor name in model.ARCHITECTURES: model.get_model(name, {kwargs})'),
+    ]
+
+
+def run_case(code, cwd=MODELS_DIR):
+    """"""
+    output = subprocess.run([sys.executable, '-c', TEMPLATE.format(code=code)], cwd=cwd,
+                            capture_output=True, text=True, check=True).stdout
+
+    return json.loads(output.strip().splitlines()[-1])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='import and construction time of the model registry')
+    parser.add_argument('--decoder', type=str, default='UNet')
+    parser.add_argument('--encoder', type=str, default='resnet18')
+    parser.add_argument('--weights', type=str, default=None, help='pretrained encoder weights, read from the local cache')
+    parser.add_argument('--repeat', type=int, default=REPEAT)
+    parser.add_argument('--baseline', type=str, default=BASELINE)
+    parser.add_argument('--save-baseline', action='store_true')
+    args = parser.parse_args()
+
+    os.makedirs(RESULTS, exist_ok=True)
+    results = {}
+
+    for name, code in get_cases(args.decoder, args.encoder, args.weights):
+        runs = [run_case(code) for _ in range(args.repeat)]
+        times = np.array([run['time'] for run in runs])
+
+        results[name] = {
+            'median': float(np.median(times)),
+            'min': float(times.min()),
+            'max': float(times.max()),
+            'peak_memory_mb': max(run['peak_memory_mb'] for run in runs),
+            'repeat': args.repeat,
+        }
+
+        print(f'{name}: {results[name]["median"] * 1e3:.1f}ms, {results[name]["peak_memory_mb"]:.0f}MB')
+
+    save_results(os.path.join(RESULTS, f'imports-{time.strftime("%Y%m%d-%H%M%S")}.json'), results)
+
+    if args.save_baseline:
+        save_results(args.baseline, results)
+    elif os.path.isfile(args.baseline):
+        print('\n' + format_table(compare(results, load_results(args.baseline))))
@@ -0,0 +1,149 @@
+import os
+import sys
+import copy
+import time
+import torch
+import argparse
+
+import numpy as np
+import segmentation_models_pytorch as smp
+
+sys.path.insert(0, '..')
+from utils.benchmark import save_results
+from utils.augmentation import get_preprocessing
+from utils.train import TrainEpoch
+from loaders.datasets import SyntheticFences
+
+
+RESULTS = 'results'
+
+# TrainEpoch keyword arguments per mode, compared against the default path
+MODES = {
+    'default': {},
+    'channels_last': {'channels_last': True},
+    'compile': {'compile': True},
+    'accumulation': {'accumulation_steps': 2},
+}
+
+# synthetic input details, crops are cut from the top left to keep cpu runs short
+SEED = 0
+BATCH_SIZE = 4
+HEIGHT = 256
+WIDTH = 512
+
+STEPS = 10
+WARMUP = 2 # untimed steps, includes compilation
+
+# relative parameter drift from the default path, as a fraction of the parameter update
+TOLERANCE = 1e-3
+
+
+def get_batches(n, batch_size=BATCH_SIZE, height=HEIGHT, width=WIDTH, seed=SEED):
+    """ fixed synthetic batches, shared by all modes
+    """
+    dataset = SyntheticFences(length=n * batch_size, seed=seed, preprocessing=get_preprocessing())
+    batches = []
+
+    for i in range(n):
+        samples = [dataset[i * batch_size + j] for j in range(batch_size)]
+
+        x = torch.stack([torch.as_tensor(image) for image, _ in samples])[..., :height, :width]
+        y = torch.stack([torch.as_tensor(mask) for _, mask in samples])[..., :height, :width]
+
+        batches.append((x.float(), y.float()))
+
+    return batches
+
+
+def freeze_batchnorm(model):
+    """ batch statistics depend on the (micro-)batch, running statistics make all modes comparable
+    """
+    for module in model.modules():
+        if isinstance(module, torch.nn.modules.batchnorm._BatchNorm):
+            module.eval()
+
+
+def run_mode(model, batches, loss, device, precision, warmup=WARMUP, **kwargs):
+    """ train a copy of the model on the batches, returns losses, step times and final parameters
+    """
+    model = copy.deepcopy(model)
+    optimizer = torch.optim.SGD(model.parameters(), lr=1e-2)
+
+    train_epoch = TrainEpoch(model, loss=loss, metrics=[], optimizer=optimizer,
+                             device=device, precision=precision, verbose=False, **kwargs)
+    train_epoch.on_epoch_start()
+    freeze_batchnorm(model)
+
+    synchronize = torch.cuda.synchronize if torch.device(device).type == 'cuda' else lambda: None
+    losses, times = [], []
+
+    for x, y in batches:
+        x, y = x.to(device, memory_format=train_epoch.memory_format), y.to(device)
+
+        start = time.perf_counter()
+        value, _ = train_epoch.batch_update(x, y)
+        synchronize()
+
+        times.append(time.perf_counter() - start)
+        losses.append(float(value.detach()))
+
+    parameters = torch.cat([p.detach().float().flatten().cpu() for p in model.parameters()])
+
+    return np.array(losses), np.array(times[warmup:]), parameters
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='speed and numerical parity of TrainEpoch performance modes')
+    parser.add_argument('--modes', type=str, nargs='+', default=list(MODES))
+    parser.add_argument('--encoder', type=str, default='resnet18')
+    parser.add_argument('--loss', type=str, default='bce', choices=['bce', 'dice'])
+    parser.add_argument('--device', type=str, default='cpu')
+    parser.add_argument('--precision', type=str, default='single', choices=['single', 'mixed'])
+    parser.add_argument('--steps', type=int, default=STEPS)
+    parser.add_argument('--warmup', type=int, default=WARMUP)
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE)
+    args = parser.parse_args()
+
+    torch.manual_seed(SEED)
+    os.makedirs(RESULTS, exist_ok=True)
+
+    model = smp.Unet(encoder_name=args.encoder, encoder_weights=None, classes=1, activation='sigmoid')
+    initial = torch.cat([p.detach().flatten() for p in model.parameters()])
+
+    # dice is computed over the whole batch, so accumulation only matches for per-pixel losses
+    loss = smp.utils.losses.BCELoss() if args.loss == 'bce' else smp.utils.losses.DiceLoss()
+
+    batches = get_batches(args.warmup + args.steps, batch_size=args.batch_size)
+
+    modes = ['default'] + [mode for mode in args.modes if mode != 'default']
+    results, reference = {}, None
+
+    for mode in modes:
+        losses, times, parameters = run_mode(model, batches, loss, args.device, args.precision,
+                                             warmup=args.warmup, **MODES[mode])
+
+        if reference is None:
+            reference = (losses, times, parameters)
+
+        ref_losses, ref_times, ref_parameters = reference
+
+        # drift relative to how far the default path moved the parameters
+        drift = float((parameters - ref_parameters).norm() / (ref_parameters - initial).norm())
+
+        results[mode] = {
+            'step_ms': float(np.median(times) * 1e3),
+            'speedup': float(np.median(ref_times) / np.median(times)),
+            'max_loss_diff': float(np.abs(losses - ref_losses).max()),
+            'parameter_drift': drift,
+            'parity': drift <= args.tolerance,
+        }
+
+        print(f'{mode:<14}  {results[mode]["step_ms"]:>9.1f}ms  {results[mode]["speedup"]:>5.2f}x  '
+              f'loss diff {results[mode]["max_loss_diff"]:.2e}  drift {drift:.2e}  '
+              f'{"ok" if results[mode]["parity"] else "MISMATCH"}')
+
+    save_results(os.path.join(RESULTS, f'modes-{time.strftime("%Y%m%d-%H%M%S")}.json'), results)
+
+    if not all(result['parity'] for result in results.values()):
+        sys.exit(1)
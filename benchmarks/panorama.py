@@ -0,0 +1,88 @@
+import os
+import sys
+import time
+import torch
+import argparse
+
+import numpy as np
+import segmentation_models_pytorch as smp
+
+sys.path.insert(0, '..')
+from utils.benchmark import save_results
+from utils.inference import predict_panorama, crop_centers, crop_columns, tile_positions, TILE_WIDTH, TILE_HEIGHT, \
+                            BATCH_SIZE
+from utils.synthetic import make_panorama, make_metadata, HORIZON
+
+
+RESULTS = 'results'
+
+SEED = 0
+STRIDES = [1024, 768, 512]
+REPEAT = 3
+
+
+def two_crops(model, panorama, heading, device):
+    """ the current inference pass, the left and right crops in a single batch
+    """
+    width = panorama.shape[1]
+    rows = slice(HORIZON - TILE_HEIGHT // 2, HORIZON + TILE_HEIGHT // 2)
+
+    crops = [panorama[rows][:, crop_columns(center, width)] for center in crop_centers(heading, width=width)]
+    x = torch.as_tensor(np.stack(crops).transpose(0, 3, 1, 2).astype('float32'), device=device)
+
+    with torch.no_grad():
+        return model(x).cpu().numpy()
+
+
+def median_time(fn, repeat=REPEAT):
+    """"""
+    times = []
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+
+    return float(np.median(times))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='cost of tiled full-panorama inference relative to the two-crop pass')
+    parser.add_argument('--encoder', type=str, default='resnet18')
+    parser.add_argument('--device', type=str, default='cpu')
+    parser.add_argument('--strides', type=int, nargs='+', default=STRIDES)
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--repeat', type=int, default=REPEAT)
+    args = parser.parse_args()
+
+    torch.manual_seed(SEED)
+    os.makedirs(RESULTS, exist_ok=True)
+
+    model = smp.Unet(encoder_name=args.encoder, encoder_weights=None, classes=1, activation='sigmoid').to(args.device).eval()
+
+    panorama, _ = make_panorama(SEED, 0)
+    heading = make_metadata(SEED, 0)['heading']
+    width = panorama.shape[1]
+
+    # warm up kernels and allocator
+    two_crops(model, panorama, heading, args.device)
+
+    reference = median_time(lambda: two_crops(model, panorama, heading, args.device), args.repeat)
+    results = {'two_crops': {'tiles': 2, 'coverage': 2 * TILE_WIDTH / width, 'time': reference, 'cost': 1.}}
+
+    for stride in args.strides:
+        seconds = median_time(lambda: predict_panorama(model, panorama, stride=stride, batch_size=args.batch_size,
+                                                       device=args.device), args.repeat)
+
+        results[f'panorama[stride={stride}]'] = {
+            'tiles': len(tile_positions(width, stride=stride)),
+            'coverage': 1.,
+            'time': seconds,
+            'cost': seconds / reference,
+        }
+
+    for name, result in results.items():
+        print(f'{name:<22}  {result["tiles"]:>3} tiles  {result["coverage"]:>6.1%} of 360 degrees  '
+              f'{result["time"]:>7.2f}s  {result["cost"]:>5.2f}x')
+
+    save_results(os.path.join(RESULTS, f'panorama-{time.strftime("%Y%m%d-%H%M%S")}.json'), results)
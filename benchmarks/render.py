@@ -0,0 +1,109 @@
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+from functools import partial
+from multiprocessing import Pool
+
+sys.path.insert(0, '..')
+sys.path.insert(0, os.path.join('..', 'scripts'))
+from utils.benchmark import save_results
+from utils.render import render_file, SheetWriter, THUMBNAIL_WIDTH
+from utils.synthetic import make_crop, fence_mask
+from inference_save import save_figure
+
+
+RESULTS = 'results'
+
+SEED = 0
+CROPS = 32
+WORKERS = [1, 4]
+
+
+def make_jobs(save, n, extension):
+    """ synthetic crops and their fence masks
+    """
+    jobs = []
+
+    for i in range(n):
+        img, fences, _ = make_crop(SEED, i // 2, i % 2)
+        jobs.append((os.path.join(save, f'{i}.{extension}'), img.astype('uint8'), fence_mask(fences) > 0))
+
+    return jobs
+
+
+def run_figures(jobs):
+    """"""
+    for fpath, img, mask in jobs:
+        save_figure(fpath, img, mask)
+
+
+def run_renders(jobs, layout, workers, sheets=None):
+    """ render in worker processes, thumbnails of the written files go to contact sheets
+    """
+    fn = partial(render_file, layout=layout, width=THUMBNAIL_WIDTH if sheets else None)
+
+    with Pool(workers) as pool:
+        for fpath, thumbnail in pool.imap(fn, jobs, chunksize=4):
+            if sheets:
+                sheets.add(thumbnail)
+
+    if sheets:
+        sheets.flush()
+
+
+def timed(fn):
+    """"""
+    start = time.perf_counter()
+    fn()
+
+    return time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='crops written per second by matplotlib figures and cv2 renderings')
+    parser.add_argument('--crops', type=int, default=CROPS)
+    parser.add_argument('--workers', type=int, nargs='+', default=WORKERS)
+    parser.add_argument('--extensions', type=str, nargs='+', default=['png', 'jpg'])
+    args = parser.parse_args()
+
+    import matplotlib
+    matplotlib.use('Agg')
+
+    os.makedirs(RESULTS, exist_ok=True)
+    save = tempfile.mkdtemp()
+
+    results = {}
+
+    try:
+        for extension in args.extensions:
+            jobs = make_jobs(save, args.crops, extension)
+            runs = {'figure': lambda: run_figures(jobs)}
+
+            for layout in ['overlay', 'side']:
+                for workers in args.workers:
+                    runs[f'{layout}, workers={workers}'] = partial(run_renders, jobs, layout, workers)
+
+            sheets = SheetWriter(os.path.join(save, 'sheets'))
+            runs[f'overlay, workers={max(args.workers)}, sheets'] = \
+                partial(run_renders, jobs, 'overlay', max(args.workers), sheets)
+
+            reference = None
+
+            for name, fn in runs.items():
+                seconds = timed(fn)
+                reference = reference or seconds
+
+                results[f'{extension}: {name}'] = {'time': seconds, 'crops_per_second': args.crops / seconds,
+                                                   'speedup': reference / seconds}
+    finally:
+        shutil.rmtree(save)
+
+    for name, result in results.items():
+        print(f'{name:<36}  {result["time"]:>7.2f}s  {result["crops_per_second"]:>7.1f} crops/s  '
+              f'{result["speedup"]:>6.1f}x')
+
+    save_results(os.path.join(RESULTS, f'render-{time.strftime("%Y%m%d-%H%M%S")}.json'), results)
@@ -0,0 +1,117 @@
+import os
+import re
+import sys
+import time
+import argparse
+import subprocess
+
+import numpy as np
+
+from collections import defaultdict
+
+sys.path.insert(0, '..')
+from utils.benchmark import save_results, format_table, compare, load_results
+
+
+BASELINE = 'startup-baseline.json'
+RESULTS = 'results'
+
+REPEAT = 3
+TOP = 5 # heaviest packages shown per entry point
+
+# (name, working directory, code) per entry point, scripts are imported without running their main block,
+# data loader workers import the dataset module, and under spawn the top level of train.py as well
+ENTRY_POINTS = [
+    ('worker: loaders.datasets', os.path.join('..', 'models'), 'import sys; sys.path.insert(0, ".."); import loaders.datasets'),
+    ('models/train.py', os.path.join('..', 'models'), 'import train'),
+    ('models/model.py', os.path.join('..', 'models'), 'import model'),
+    ('utils.metrics', '..', 'import utils.metrics'),
+    ('utils.checkpoint', '..', 'import utils.checkpoint'),
+    ('scripts/cvat2coco.py', os.path.join('..', 'scripts'), 'import cvat2coco'),
+    ('scripts/synthetic.py', os.path.join('..', 'scripts'), 'import synthetic'),
+    ('scripts/compress_rle.py', os.path.join('..', 'scripts'), 'import compress_rle'),
+    ('scripts/split_geo.py', os.path.join('..', 'scripts'), 'import split_geo'),
+    ('scripts/inference.py', os.path.join('..', 'scripts'), 'import inference'),
+    ('scripts/inference_save.py', os.path.join('..', 'scripts'), 'import inference_save'),
+]
+
+# python -X importtime lines: self [us] | cumulative [us] | module name, indented by nesting depth
+IMPORTTIME = re.compile(r'^import time:\s+(\d+) \|\s+\d+ \|\s+(\S+)$')
+
+
+def parse_importtime(stderr):
+    """ total import time, number of modules and import time per top-level package, in seconds
+    """
+    total, count, packages = 0, 0, defaultdict(float)
+
+    for line in stderr.splitlines():
+        match = IMPORTTIME.match(line)
+
+        if match is None:
+            continue
+
+        own, module = match.groups()
+        total += int(own)
+        count += 1
+
+        # own time summed per package, e.g. torch.nn counts towards torch
+        packages[module.split('.')[0]] += int(own) / 1e6
+
+    return total / 1e6, count, dict(packages)
+
+
+def run_entry_point(code, cwd):
+    """ wall time of a fresh interpreter running the code, with its import time breakdown
+    """
+    start = time.perf_counter()
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=cwd,
+                             capture_output=True, text=True)
+    wall_time = time.perf_counter() - start
+
+    if process.returncode != 0:
+        raise RuntimeError(f'{code!r} failed in {cwd}:\n{process.stderr[-2000:]}')
+
+    return (wall_time, *parse_importtime(process.stderr))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='startup time of every entry point in a fresh interpreter')
+    parser.add_argument('--select', type=str, nargs='+', default=None, help='entry point names to run')
+    parser.add_argument('--repeat', type=int, default=REPEAT)
+    parser.add_argument('--top', type=int, default=TOP)
+    parser.add_argument('--baseline', type=str, default=BASELINE)
+    parser.add_argument('--save-baseline', action='store_true')
+    args = parser.parse_args()
+
+    os.makedirs(RESULTS, exist_ok=True)
+    results = {}
+
+    for name, cwd, code in ENTRY_POINTS:
+        if args.select and name not in args.select:
+            continue
+
+        runs = [run_entry_point(code, cwd) for _ in range(args.repeat)]
+        times = np.array([run[0] for run in runs])
+        _, import_time, modules, packages = runs[int(np.argsort(times)[len(times) // 2])]
+
+        heaviest = dict(sorted(packages.items(), key=lambda item: -item[1])[:args.top])
+
+        results[name] = {
+            'median': float(np.median(times)),
+            'min': float(times.min()),
+            'max': float(times.max()),
+            'import_time': import_time,
+            'modules': modules,
+            'heaviest': heaviest,
+            'repeat': args.repeat,
+        }
+
+        print(f'{name}: {results[name]["median"] * 1e3:.0f}ms, {modules} modules, heaviest: '
+              + ', '.join(f'{module} {seconds * 1e3:.0f}ms' for module, seconds in heaviest.items()))
+
+    save_results(os.path.join(RESULTS, f'startup-{time.strftime("%Y%m%d-%H%M%S")}.json'), results)
+
+    if args.save_baseline:
+        save_results(args.baseline, results)
+    elif os.path.isfile(args.baseline):
+        print('\n' + format_table(compare(results, load_results(args.baseline))))
@@ -1,21 +1,17 @@
 import os
-import io
 import sys
 import json
 import torch
 
 import numpy as np
 
-from PIL import Image
-
-from skimage import io, transform
+from skimage import io
 from torch.utils.data import Dataset
-from torchvision import transforms
-from pycocotools import mask as cmask
 from pycocotools.coco import COCO
 
 sys.path.insert(0, '..')
-from utils.metrics import to_blobs
+from utils import rle
+from utils.cache import get_cache
 
 
 class COCODataset(Dataset):
@@ -88,13 +84,16 @@ class ADE20KDataset(Dataset):
 class AmsterdamDataset(Dataset):
     """
     """
-    def __init__(self, imagedir, annotations, transform=None, preprocessing=None, train=True, classname='fence'):
+    def __init__(self, imagedir, annotations, transform=None, preprocessing=None, train=True, classname='fence', cache=None):
         """
         """
         self.transform = transform
         self.preprocessing = preprocessing
         self.imagedir = imagedir
         self.classname = classname
+
+        # optional utils.cache.DecodedCache, or its directory
+        self.cache = get_cache(cache)
         
         # get annotations using COCO API
         self.coco = COCO(annotations)
@@ -134,28 +133,27 @@ class AmsterdamDataset(Dataset):
         # load image
         obj = self.images[idx]
         fname = os.path.join(self.imagedir, obj['file_name'])
-        image = io.imread(fname)
+        image = self.cache.load(fname) if self.cache else io.imread(fname)
         
         # get all annotations corresponding to image
         annotation_ids = self.coco.getAnnIds(imgIds=obj['id'], iscrowd=None)
         annotations = self.coco.loadAnns(annotation_ids)
 
-        # generate mask
-        mask = np.zeros((obj['height'], obj['width']))
+        # generate a mask per class, e.g. ['fence', 'quay'] for multi-task models
+        classnames = [self.classname] if isinstance(self.classname, str) else self.classname
+        masks = {classname: np.zeros((obj['height'], obj['width'])) for classname in classnames}
 
         for annotation in annotations:
             if annotation.get('counts'):
-                if self.classname == 'fence':
+                if 'fence' in masks:
                     # decode uncompressed RLE
-                    ann = cmask.frPyObjects(annotation.get('counts'), obj['height'], obj['width'])
-                    ann = cmask.decode(ann)
-                    mask = np.maximum(mask, np.array(ann) * 1)
-            elif self.classname == 'quay':
-                mask = np.maximum(mask, self.coco.annToMask(annotation) * 1)
+                    ann = rle.decode(annotation.get('counts'))
+                    masks['fence'] = np.maximum(masks['fence'], ann)
+            elif 'quay' in masks:
+                masks['quay'] = np.maximum(masks['quay'], self.coco.annToMask(annotation) * 1)
 
         # convert from float to integer
-        mask = mask.astype(np.uint8)
-        mask = np.expand_dims(mask, axis=-1)
+        mask = np.stack([masks[classname] for classname in classnames], axis=-1).astype(np.uint8)
 
         if self.transform:
             sample = self.transform(image=image, mask=mask)
@@ -181,10 +179,14 @@ class AmsterdamDataset(Dataset):
             
         return tuple()
 
+    def image_fpaths(self):
+        """"""
+        return [os.path.join(self.imagedir, image['file_name']) for image in self.images]
+
 
 class PolygonFences(Dataset):
     """"""
-    def __init__(self, images, annotations, subset='train', transform=None, preprocessing=None):
+    def __init__(self, images, annotations, subset='train', transform=None, preprocessing=None, cache=None):
         """"""
         self.img_dir = images
         self.ann_dir = os.path.join(annotations, f'masks-{subset}')
@@ -192,6 +194,9 @@ class PolygonFences(Dataset):
         self.transform = transform
         self.preprocessing = preprocessing
 
+        # optional utils.cache.DecodedCache, or its directory
+        self.cache = get_cache(cache)
+
         self.fnames = os.listdir(self.ann_dir)
 
         self.fnames_masks = self.fnames
@@ -208,7 +213,7 @@ class PolygonFences(Dataset):
         fname_img = os.path.join(self.img_dir, self.fnames_imgs[idx])
         fname_mask = os.path.join(self.ann_dir, self.fnames_masks[idx])
 
-        image = io.imread(fname_img)
+        image = self.cache.load(fname_img) if self.cache else io.imread(fname_img)
 
         with open(fname_mask, 'rb') as f:
             mask = np.load(f)
@@ -223,4 +228,49 @@ class PolygonFences(Dataset):
             
         return image, mask
 
-        
\ No newline at end of file
+
+    def image_fpaths(self):
+        """"""
+        return [os.path.join(self.img_dir, fname) for fname in self.fnames_imgs]
+
+
+class SyntheticFences(Dataset):
+    """ deterministic synthetic crops and fence masks, generated on the fly
+    """
+    def __init__(self, length=1000, seed=0, density=.5, transform=None, preprocessing=None, classname='fence'):
+        """"""
+        self.length = length
+        self.seed = seed
+        self.density = density
+
+        # fence, quay, or a list of both for multi-task models
+        self.classnames = [classname] if isinstance(classname, str) else classname
+
+        self.transform = transform
+        self.preprocessing = preprocessing
+
+
+    def __len__(self):
+        """"""
+        return self.length
+
+
+    def __getitem__(self, idx):
+        """"""
+        # cv2 and the generator are only imported by synthetic runs
+        from utils.synthetic import make_crop, fence_mask, quay_mask
+
+        # every panorama yields a left and right crop
+        image, fences, quays = make_crop(self.seed, idx // 2, idx % 2, density=self.density)
+        masks = {'fence': fence_mask(fences), 'quay': quay_mask(quays)}
+        mask = np.stack([masks[classname] for classname in self.classnames], axis=-1)
+
+        if self.transform:
+            sample = self.transform(image=image, mask=mask)
+            image, mask = sample['image'], sample['mask']
+
+        if self.preprocessing:
+            sample = self.preprocessing(image=image, mask=mask)
+            image, mask = sample['image'], sample['mask']
+
+        return image, mask
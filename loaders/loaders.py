@@ -3,21 +3,14 @@ import io
 import cv2
 import yaml
 import json
-import torch
 import types
 import inspect
 
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
 
-from PIL import Image
 from pprint import pprint
 
-from skimage import io, transform
-from torch.utils.data import Dataset
-from torchvision import transforms
-
 
 # helper functions
 def pixel_to_viewpoint(pixel, image_width=8000, dtype=int):
@@ -160,6 +153,8 @@ class PanoramaImage(object):
             copy[:, front - viewpoint_width:front + viewpoint_width, :] = (0, 255, 0)
             copy[:, back - viewpoint_width:back + viewpoint_width, :] = (255, 0, 0)
 
+        import matplotlib.pyplot as plt
+
         self.show_method(copy)
         plt.show()
 
@@ -261,6 +256,8 @@ class PanoramaLoader(object):
     def geoplot(self, img=None, **kwargs):
         """
         """
+        import matplotlib.pyplot as plt
+
         lngs = self.all_metadata.lng
         lats = self.all_metadata.lat
 
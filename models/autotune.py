@@ -0,0 +1,124 @@
+import os
+import sys
+import copy
+import torch
+import config
+import argparse
+
+from model import get_model
+from train import get_datasets, get_batch_preprocessing
+
+import segmentation_models_pytorch as smp
+
+sys.path.insert(0, '..')
+from utils.train import TrainEpoch, ValidEpoch
+from utils.autotune import tune_batch_size, tune_loader, memory_budget, save_settings, BATCH_SIZES, STEPS
+
+
+def tune(model, train_dataset, valid_dataset, device, precision='single', budget=None, sizes=BATCH_SIZES, steps=STEPS,
+         **kwargs):
+    """ recommended config fields, settings of the inference scripts and the probes they are based on,
+        the model is copied so probing leaves its weights untouched, kwargs go to TrainEpoch
+    """
+    budget = budget or memory_budget(device)
+    loss = smp.utils.losses.DiceLoss()
+
+    model = copy.deepcopy(model)
+    optimizer = torch.optim.Adam(model.parameters(), lr=config.LR)
+
+    train_epoch = TrainEpoch(model, loss=loss, metrics=[], optimizer=optimizer, device=device, precision=precision,
+                             verbose=False, **kwargs)
+    valid_epoch = ValidEpoch(model, loss=loss, metrics=[], device=device, precision=precision, verbose=False,
+                             **{key: kwargs[key] for key in ['channels_last', 'compile', 'preprocessing'] if key in kwargs})
+
+    probes = {'budget_mb': budget}
+
+    # the largest batches that fit, training needs gradients and optimizer state, inference only the forward pass
+    train_epoch.on_epoch_start()
+    train_step = lambda x, y: train_epoch.batch_update(*train_epoch.to_device(x, y))
+    train_batch_size, probes['train_batch_sizes'] = tune_batch_size(train_step, train_dataset, device, budget, sizes,
+                                                                    steps)
+
+    valid_epoch.on_epoch_start()
+    inference_step = lambda x, y: valid_epoch.batch_update(*valid_epoch.to_device(x, y))
+    inference_batch_size, probes['inference_batch_sizes'] = tune_batch_size(inference_step, valid_dataset, device,
+                                                                            budget, sizes, steps)
+
+    if train_batch_size is None or inference_batch_size is None:
+        raise RuntimeError(f'a batch of {sizes[0]} does not fit in {budget:.0f}MB')
+
+    # loaders only need to keep up with the model
+    required = probes['train_batch_sizes'][train_batch_size]['images_per_sec']
+    train_loader, probes['train_loaders'] = tune_loader(train_dataset, train_batch_size, device, required,
+                                                        batches=steps, shuffle=True)
+
+    required = probes['inference_batch_sizes'][inference_batch_size]['images_per_sec']
+    inference_loader, probes['inference_loaders'] = tune_loader(valid_dataset, inference_batch_size, device, required,
+                                                                batches=steps)
+
+    settings = {
+        'TRAIN_BATCH_SIZE': train_batch_size,
+        'VALID_BATCH_SIZE': inference_batch_size,
+        'NUM_WORKERS': train_loader['num_workers'],
+        'PREFETCH_FACTOR': train_loader['prefetch_factor'] or config.PREFETCH_FACTOR,
+        'PIN_MEMORY': train_loader['pin_memory'],
+        # worker startup is paid once instead of every epoch
+        'PERSISTENT_WORKERS': train_loader['num_workers'] > 0,
+    }
+
+    # batch size and loader of the inference scripts
+    inference = {key: inference_loader[key] for key in ['num_workers', 'prefetch_factor', 'pin_memory']}
+    inference['batch_size'] = inference_batch_size
+
+    return settings, inference, probes
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='batch sizes and data loader settings for this machine')
+    parser.add_argument('--device', type=str, default=None, help='overrides config.DEVICE')
+    parser.add_argument('--precision', type=str, default=None, choices=['single', 'mixed'], help='overrides config.PRECISION')
+    parser.add_argument('--synthetic', action='store_true', help='use synthetic instead of annotated data')
+    parser.add_argument('--budget', type=float, default=None, help='megabytes, a fraction of the device memory by default')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=BATCH_SIZES)
+    parser.add_argument('--steps', type=int, default=STEPS, help='timed steps or batches per probe')
+    parser.add_argument('--output', type=str, default=None, help='settings json, autotune-<device>.json in the logs by default')
+    args = parser.parse_args()
+
+    device = torch.device(args.device) if args.device else config.DEVICE
+    output = args.output or os.path.join(config.LOGS_PATH, f'autotune-{device.type}.json')
+
+    model = get_model(config.DECODER,
+                      encoder_name=config.ENCODER_DETAILS,
+                      encoder_weights=None,
+                      classes=config.CLASSES,
+                      activation=config.ACTIVATION,
+                      tasks=config.TASKS,
+                      task_decoder_channels=config.TASK_DECODER_CHANNELS)
+
+    train_dataset, valid_dataset = get_datasets(synthetic=args.synthetic)
+
+    settings, inference, probes = tune(model, train_dataset, valid_dataset, device, args.precision or config.PRECISION,
+                                       args.budget, args.batch_sizes, args.steps, channels_last=config.CHANNELS_LAST,
+                                       accumulation_steps=config.ACCUMULATION_STEPS,
+                                       preprocessing=get_batch_preprocessing())
+
+    for name in ['train', 'inference']:
+        print(f'\n{name} batch sizes, {probes["budget_mb"]:.0f}MB budget')
+        for size, probe in probes[f'{name}_batch_sizes'].items():
+            speed = f'{probe["images_per_sec"]:>8.2f} images/s' if probe['fits'] else f'{"does not fit":>17}'
+            print(f'{size:>4}  {speed}  {probe["peak_memory_mb"] or 0:>8.0f}MB')
+
+        print(f'\n{name} loaders')
+        for probe in probes[f'{name}_loaders']:
+            print(f'workers {probe["num_workers"]}  prefetch {probe["prefetch_factor"] or "-"}  '
+                  f'pinned {probe["pin_memory"]!s:<5}  {probe["images_per_sec"]:>8.2f} images/s  '
+                  f'startup {probe["startup_sec"]:.2f}s')
+
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    save_settings(output, device, settings, inference, probes)
+
+    print()
+    for key, value in settings.items():
+        print(f'{key} = {value!r}')
+    print(f'inference: {inference}')
+    print(f'\nsaved {output}, set AUTOTUNE in config.py or train with --autotune to apply')
@@ -0,0 +1,147 @@
+import os
+import sys
+import time
+import torch
+import config
+import argparse
+import itertools
+
+import numpy as np
+
+from train import get_datasets
+from sweep import overridden
+from quantize import positive_iou
+from torch.utils.data import DataLoader
+
+sys.path.insert(0, '..')
+from utils.benchmark import save_results
+from utils.checkpoint import load_model, load_preprocessing
+from utils.inference import predict_cascade, GATE_SCALE, GATE_THRESHOLD, GATE_MIN_AREA, GATE_MARGIN
+
+
+def run(model, dataloader, device, preprocessing, cascade=None):
+    """ fence probabilities, targets and gated windows of the whole dataloader, and the seconds it took,
+        preprocessing converts the inputs of the fence model, the cascade holds the gate preprocessing
+    """
+    preds, targets, windows = [], [], []
+    seconds = 0
+
+    for x, y in dataloader:
+        x = x.to(device)
+        start = time.perf_counter()
+
+        if cascade is None:
+            with torch.no_grad():
+                pred = model(preprocessing(x))
+            window = [slice(0, x.shape[-1])] * len(x)
+        else:
+            pred, window = predict_cascade(model, **cascade, x=x, preprocessing=preprocessing)
+
+        # the fence channel, the first task of multi-task models
+        pred = pred[:, :1].float().cpu().numpy()
+        seconds += time.perf_counter() - start
+
+        preds.append(pred)
+        targets.append(y[:, :1].numpy())
+        windows += window
+
+    return np.concatenate(preds), np.concatenate(targets), windows, seconds
+
+
+def recall(preds, targets):
+    """ fraction of fence pixels found
+    """
+    positives = targets > .5
+
+    return float((preds[positives] > .5).mean()) if positives.any() else 1.
+
+
+def evaluate(full, cascade, targets, windows, width):
+    """ skip rate and recall loss of the cascade relative to running the fence model on every crop
+    """
+    skipped = np.array([window is None for window in windows])
+    columns = sum(window.stop - window.start for window in windows if window is not None)
+
+    has_fence = (targets > .5).reshape(len(targets), -1).any(axis=1)
+
+    return {
+        'skip_rate': float(skipped.mean()),
+        'column_fraction': columns / (len(windows) * width),
+        'recall': {'full': recall(full, targets), 'cascade': recall(cascade, targets)},
+        'recall_loss': recall(full, targets) - recall(cascade, targets),
+        'positive_iou': {'full': positive_iou(full, targets), 'cascade': positive_iou(cascade, targets)},
+        'skipped_fence_crops': int((skipped & has_fence).sum()),
+        'fence_crops': int(has_fence.sum()),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='skip rate and recall loss of quay-gated cascade inference on the validation split')
+    parser.add_argument('--fence-model', type=str, default=os.path.join(config.LOGS_PATH, config.TITLE, 'best_model.pth'))
+    parser.add_argument('--gate-model', type=str, required=True, help='quay segmenter or crop classifier')
+    parser.add_argument('--synthetic', action='store_true', help='use synthetic instead of annotated data')
+    parser.add_argument('--device', type=str, default='cpu')
+    parser.add_argument('--scale', type=float, default=GATE_SCALE)
+    parser.add_argument('--thresholds', type=float, nargs='+', default=[GATE_THRESHOLD])
+    parser.add_argument('--min-areas', type=float, nargs='+', default=[GATE_MIN_AREA])
+    parser.add_argument('--margin', type=int, default=GATE_MARGIN)
+    parser.add_argument('--no-regions', action='store_true', help='run the fence model on whole crops that pass the gate')
+    parser.add_argument('--batch-size', type=int, default=config.VALID_BATCH_SIZE)
+    parser.add_argument('--valid', type=int, default=None, help='limit the number of validation images')
+    parser.add_argument('--report', type=str, default=None, help='report json, next to --fence-model by default')
+    args = parser.parse_args()
+
+    report = args.report or f'{os.path.splitext(args.fence_model)[0]}-cascade-report.json'
+
+    fence_model = load_model(args.fence_model, map_location=args.device).eval()
+    gate_model = load_model(args.gate_model, map_location=args.device).eval()
+
+    # normalization each model was trained with, the loaders yield uint8 crops whatever the config
+    fence_preprocessing = load_preprocessing(args.fence_model)
+    gate_preprocessing = load_preprocessing(args.gate_model)
+
+    with overridden(config, {'AUGMENTATION': False, 'DEVICE_PREPROCESSING': True}):
+        _, valid_dataset = get_datasets(args.synthetic)
+
+    if args.valid:
+        valid_dataset = torch.utils.data.Subset(valid_dataset, range(min(args.valid, len(valid_dataset))))
+
+    dataloader = DataLoader(valid_dataset, batch_size=args.batch_size, shuffle=False, num_workers=config.NUM_WORKERS)
+
+    # warm up kernels and allocator before timing
+    with torch.no_grad():
+        fence_model(fence_preprocessing(next(iter(dataloader))[0].to(args.device)))
+
+    full, targets, _, full_seconds = run(fence_model, dataloader, args.device, fence_preprocessing)
+    width = targets.shape[-1]
+
+    results = {
+        'fence_model': args.fence_model,
+        'gate_model': args.gate_model,
+        'scale': args.scale,
+        'margin': args.margin,
+        'regions': not args.no_regions,
+        'images': len(targets),
+        'full_seconds': full_seconds,
+        'settings': [],
+    }
+
+    print(f'{"threshold":>9}  {"min area":>8}  {"skipped":>7}  {"columns":>7}  {"recall loss":>11}  '
+          f'{"skipped fences":>14}  {"speedup":>7}')
+
+    for threshold, min_area in itertools.product(args.thresholds, args.min_areas):
+        cascade = {'gate_model': gate_model, 'scale': args.scale, 'threshold': threshold, 'min_area': min_area,
+                   'margin': args.margin, 'regions': not args.no_regions, 'gate_preprocessing': gate_preprocessing}
+
+        preds, _, windows, seconds = run(fence_model, dataloader, args.device, fence_preprocessing, cascade)
+
+        setting = {'threshold': threshold, 'min_area': min_area, 'seconds': seconds, 'speedup': full_seconds / seconds,
+                   **evaluate(full, preds, targets, windows, width)}
+        results['settings'].append(setting)
+
+        print(f'{threshold:>9.2f}  {min_area:>8.4f}  {setting["skip_rate"]:>7.1%}  {setting["column_fraction"]:>7.1%}  '
+              f'{setting["recall_loss"]:>11.4f}  {setting["skipped_fence_crops"]:>6}/{setting["fence_crops"]:<7}  '
+              f'{setting["speedup"]:>6.2f}x')
+
+    save_results(report, results)
+    print(f'saved {report}')
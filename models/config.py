@@ -1,6 +1,5 @@
 import os
 import torch
-from model import *
 
 TITLE = 'resnet18-unet-1600s-aug-11px-blobs'
 
@@ -15,7 +14,14 @@ ENCODER_DETAILS = 'resnet18'
 ENCODER_WEIGHTS = 'imagenet' # 'imagenet'
 ACTIVATION = 'sigmoid'
 
-DECODER = UNet
+DECODER = 'UNet' # FPN, UNet, UNetPP, PSPNet, DeepLabV3, MANet, PAN or Linknet, see model.py
+
+# ['fence', 'quay'] shares one encoder between a fence and a quay decoder, masks get a channel per task,
+# the fence first, quay masks are only in the coco annotations (BLOBS = False) and the synthetic data
+TASKS = ['fence']
+TASK_DECODER_CHANNELS = None # e.g. (128, 64, 32, 16, 8), narrower UNet and UNetPP decoders for the tasks after the first
+
+OFFLINE = False # only use pretrained encoder weights from the local cache (python model.py --cache)
 
 # data details
 TRAIN_IMAGE_PATH = os.path.join('..', 'data', 'fences-quays', 'images')
@@ -34,13 +40,44 @@ LOGS_PATH = os.path.join('..', 'experiments')
 DEVICE = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
 PRECISION = 'mixed' # mixed or single precision floats
 
+# performance modes, see benchmarks/modes.py for speed and parity on this machine
+CHANNELS_LAST = False # channels_last memory format for model and inputs
+COMPILE = False # torch.compile the model, requires torch 2.0
+ACCUMULATION_STEPS = 1 # micro-batches per batch, gradients are accumulated before each step
+# the dice loss is computed over the whole batch, accumulated micro-batches approximate its gradient, they only
+# match for per-pixel losses such as bce
+
+# per-phase timers and memory high-water marks, optionally a torch.profiler trace of a [start, stop) step range
+PROFILE = False
+PROFILE_TRACE_STEPS = None # e.g. (10, 15)
+
 PREPROCESSING = False
+
+# loaders yield uint8 images and masks, float conversion and encoder preprocessing run batched on the device
+DEVICE_PREPROCESSING = True
 AUGMENTATION = True
 
 TRAIN_BATCH_SIZE = 16
 VALID_BATCH_SIZE = 16
 
 NUM_WORKERS = 3
+PREFETCH_FACTOR = 2 # batches loaded ahead by every worker
+PIN_MEMORY = False # page-locked batches, faster and asynchronous copies to the gpu
+PERSISTENT_WORKERS = False # keep the workers between epochs
+
+# batch sizes and loader settings measured on this machine by autotune.py, e.g. '../experiments/autotune-cuda.json',
+# applied at startup over the settings above, train.py --autotune measures them first
+AUTOTUNE = None
+
 NUM_EPOCHS = 30
 
-LR = 8e-5
\ No newline at end of file
+LR = 8e-5
+
+# number of epoch checkpoints kept next to the last and best ones
+KEEP_CHECKPOINTS = 3
+
+# distributed data parallel, batch sizes are per process, see train.py --nproc
+DISTRIBUTED_BACKEND = None # nccl on gpu, gloo on cpu
+
+# directory of decoded images shared by concurrent runs and workers, e.g. '/dev/shm/fence-detection-cache', see sweep.py
+DATA_CACHE = None
\ No newline at end of file
@@ -1,28 +1,130 @@
-import config
-import segmentation_models_pytorch as smp
+import os
+import argparse
 
 
-def get_encoder(name):
-    model = getattr(smp, name)
-    model = model(encoder_name=config.ENCODER_DETAILS, 
-                  encoder_weights=config.ENCODER_WEIGHTS, 
-                  classes=config.CLASSES, 
-                  activation=config.ACTIVATION)
+# config.DECODER names and their segmentation_models_pytorch classes
+ARCHITECTURES = {
+    'FPN': 'FPN',
+    'UNet': 'Unet',
+    'UNetPP': 'UnetPlusPlus',
+    'PSPNet': 'PSPNet',
+    'DeepLabV3': 'DeepLabV3',
+    'MANet': 'MAnet',
+    'PAN': 'PAN',
+    'Linknet': 'Linknet',
+}
+
+# local copies of pretrained encoder weights, construction works offline once they are cached
+WEIGHTS_CACHE = os.path.join('..', 'weights')
+
+# models constructed on first access of their name, torch and smp are only imported then
+_models = {}
+
+
+def get_weights_url(encoder_name, encoder_weights):
+    """"""
+    import segmentation_models_pytorch as smp
+
+    settings = smp.encoders.encoders[encoder_name]['pretrained_settings']
+
+    if encoder_weights not in settings:
+        raise KeyError(f'{encoder_weights} weights are not available for {encoder_name}, '
+                       f'available: {list(settings)}')
+
+    return settings[encoder_weights]['url']
+
+
+def get_weights_path(encoder_name, encoder_weights, cache=WEIGHTS_CACHE):
+    """"""
+    return os.path.join(cache, os.path.basename(get_weights_url(encoder_name, encoder_weights)))
+
+
+def cache_weights(encoder_name, encoder_weights, cache=WEIGHTS_CACHE):
+    """ download pretrained encoder weights into the local cache, if not there yet
+    """
+    import torch
+
+    os.makedirs(cache, exist_ok=True)
+    torch.hub.load_state_dict_from_url(get_weights_url(encoder_name, encoder_weights), model_dir=cache,
+                                       map_location='cpu', progress=True)
+
+    return get_weights_path(encoder_name, encoder_weights, cache)
+
+
+def get_model(name, encoder_name, encoder_weights=None, classes=1, activation=None, cache=WEIGHTS_CACHE, offline=False,
+              tasks=None, task_decoder_channels=None):
+    """ construct a single architecture, pretrained encoder weights are read from the cache when available,
+        otherwise they are downloaded into it unless offline, several tasks share one encoder
+    """
+    import torch
+    import segmentation_models_pytorch as smp
+
+    # the decoders of the tasks after the first can be narrower
+    narrow = {'decoder_channels': task_decoder_channels} if task_decoder_channels else {}
+    kwargs = [{}] + [narrow] * (len(tasks) - 1 if tasks else 0)
+
+    models = [getattr(smp, ARCHITECTURES.get(name, name))(encoder_name=encoder_name,
+                                                          encoder_weights=None,
+                                                          classes=classes,
+                                                          activation=activation,
+                                                          **task_kwargs) for task_kwargs in kwargs]
+    model = models[0]
+
+    if encoder_weights is not None:
+        fpath = get_weights_path(encoder_name, encoder_weights, cache)
+
+        if not os.path.isfile(fpath):
+            if offline:
+                raise FileNotFoundError(f'{fpath} not found, cache it with: python model.py --cache {encoder_name} {encoder_weights}')
+
+            fpath = cache_weights(encoder_name, encoder_weights, cache)
+
+        model.encoder.load_state_dict(torch.load(fpath, map_location='cpu'))
+
+    if len(models) > 1:
+        from utils.multitask import MultiTaskModel
+
+        model = MultiTaskModel(models, tasks)
+
     return model
 
 
-FPN = get_encoder('FPN')
+def get_encoder(name):
+    """ architecture as specified in the config
+    """
+    import config
+
+    return get_model(name,
+                     encoder_name=config.ENCODER_DETAILS,
+                     encoder_weights=config.ENCODER_WEIGHTS,
+                     classes=config.CLASSES,
+                     activation=config.ACTIVATION,
+                     offline=getattr(config, 'OFFLINE', False),
+                     tasks=getattr(config, 'TASKS', None),
+                     task_decoder_channels=getattr(config, 'TASK_DECODER_CHANNELS', None))
+
 
-UNet = get_encoder('Unet')
+def __getattr__(name):
+    """ FPN, UNet, ... are built on first access only, e.g. `from model import UNet`
+    """
+    if name not in ARCHITECTURES:
+        raise AttributeError(f'module {__name__} has no attribute {name}')
 
-UNetPP = get_encoder('UnetPlusPlus')
+    if name not in _models:
+        _models[name] = get_encoder(name)
 
-PSPNet = get_encoder('PSPNet')
+    return _models[name]
 
-DeepLabV3 = get_encoder('DeepLabV3')
 
-MANet = get_encoder('MAnet')
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='manage the local pretrained encoder weights cache')
+    parser.add_argument('--cache', type=str, nargs=2, metavar=('ENCODER', 'WEIGHTS'), action='append', default=[],
+                        help='download weights, e.g. --cache resnet18 imagenet')
+    parser.add_argument('--dirpath', type=str, default=WEIGHTS_CACHE)
+    args = parser.parse_args()
 
-PAN = get_encoder('PAN')
+    for encoder_name, encoder_weights in args.cache:
+        print(cache_weights(encoder_name, encoder_weights, args.dirpath))
 
-Linknet = get_encoder('Linknet')
\ No newline at end of file
+    if not args.cache:
+        print('\n'.join(os.listdir(args.dirpath)) if os.path.isdir(args.dirpath) else f'{args.dirpath} is empty')
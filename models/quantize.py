@@ -0,0 +1,190 @@
+import os
+import sys
+import torch
+import config
+import argparse
+
+import numpy as np
+
+from train import get_datasets
+from sweep import overridden
+from torch.utils.data import DataLoader
+
+sys.path.insert(0, '..')
+from utils.benchmark import timeit, save_results
+from utils.checkpoint import load_model, load_preprocessing
+from utils.inference import estimate_height
+from utils.metrics import PositiveIoUScore, BlobOverlap
+from utils.quantization import quantize_static, calibration_batches, model_size, set_engine, PARTS
+
+
+CALIBRATION_IMAGES = 64
+BATCH_SIZE = 8 # throughput batch size
+
+# seeds estimate_height per image, so both models sample the same fence columns
+HEIGHT_SEED = 0
+
+
+def latency(model, x, repeat=10):
+    """ seconds per forward pass
+    """
+    def forward():
+        with torch.no_grad():
+            model(x)
+
+    return timeit(forward, repeat=repeat, warmup=2)
+
+
+def predict(model, dataloader, preprocessing):
+    """ probabilities and targets of the whole dataloader, as numpy arrays
+    """
+    preds, targets = [], []
+
+    with torch.no_grad():
+        for x, y in dataloader:
+            # the fence channel, the first task of multi-task models
+            preds.append(model(preprocessing(x))[:, :1].numpy())
+            targets.append(y[:, :1].numpy())
+
+    return np.concatenate(preds), np.concatenate(targets)
+
+
+def positive_iou(preds, targets):
+    """ PositiveIoUScore of thresholded probabilities, averaged over images
+    """
+    metric = PositiveIoUScore()
+
+    return float(np.mean([metric(torch.as_tensor(pred), torch.as_tensor(target)).item()
+                          for pred, target in zip(preds, targets)]))
+
+
+def blob_iou(preds, targets):
+    """"""
+    metric = BlobOverlap()
+    metric.update([preds], [targets])
+
+    return metric.compute()
+
+
+def heights(preds):
+    """ estimated fence height in pixels per image
+    """
+    results = []
+
+    for i, pred in enumerate(preds):
+        np.random.seed(HEIGHT_SEED + i)
+        results.append(estimate_height(pred.squeeze() > .5))
+
+    return np.array(results, dtype='float64')
+
+
+def compare(fp32, int8, targets):
+    """ accuracy of both models on the validation targets, and the drift of int8 from fp32
+    """
+    fp32_heights, int8_heights = heights(fp32), heights(int8)
+    drift = np.abs(int8_heights - fp32_heights)
+
+    # images where exactly one of both models finds a fence
+    detected = (fp32_heights > 0) != (int8_heights > 0)
+
+    return {
+        'positive_iou': {'fp32': positive_iou(fp32, targets), 'int8': positive_iou(int8, targets)},
+        'blob_iou': {'fp32': blob_iou(fp32, targets), 'int8': blob_iou(int8, targets)},
+        'agreement_iou': positive_iou(int8, fp32 > .5),
+        'height_drift_px': {
+            'mean': float(drift.mean()),
+            'p90': float(np.percentile(drift, 90)),
+            'max': float(drift.max()),
+            'mean_fp32_height': float(fp32_heights.mean()),
+        },
+        'detection_flips': int(detected.sum()),
+        'images': len(targets),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='int8 post-training quantization for cpu inference, with an accuracy and speed report')
+    parser.add_argument('--model', type=str, default=os.path.join(config.LOGS_PATH, config.TITLE, 'best_model.pth'))
+    parser.add_argument('--output', type=str, default=None, help='quantized model, next to --model by default')
+    parser.add_argument('--report', type=str, default=None, help='report json, next to --model by default')
+    parser.add_argument('--synthetic', action='store_true', help='use synthetic instead of annotated data')
+    parser.add_argument('--calibration', type=int, default=CALIBRATION_IMAGES, help='number of training crops')
+    parser.add_argument('--parts', type=str, nargs='+', default=PARTS, choices=PARTS, help='submodules to quantize')
+    parser.add_argument('--engine', type=str, default=None, help='x86, fbgemm or qnnpack, the first supported by default')
+    parser.add_argument('--threads', type=int, default=None, help='torch cpu threads')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--valid', type=int, default=None, help='limit the number of validation images')
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    root = os.path.splitext(args.model)[0]
+    output = args.output or f'{root}-int8.pth'
+    report = args.report or f'{root}-int8-report.json'
+
+    model = load_model(args.model, map_location='cpu').eval()
+
+    # normalization the model was trained with, the loaders yield uint8 crops whatever the config
+    preprocessing = load_preprocessing(args.model)
+
+    # calibrate on training crops as seen at inference, without augmentation
+    with overridden(config, {'AUGMENTATION': False, 'DEVICE_PREPROCESSING': True}):
+        train_dataset, valid_dataset = get_datasets(args.synthetic)
+
+    if args.valid:
+        valid_dataset = torch.utils.data.Subset(valid_dataset, range(min(args.valid, len(valid_dataset))))
+
+    engine = set_engine(args.engine)
+    batches = calibration_batches(train_dataset, args.calibration, preprocessing=preprocessing)
+    quantized = quantize_static(model, batches, parts=args.parts, engine=engine)
+
+    dataloader = DataLoader(valid_dataset, batch_size=args.batch_size, shuffle=False, num_workers=config.NUM_WORKERS)
+    x = preprocessing(next(iter(dataloader))[0])
+
+    # saved as torchscript, quantized fx modules do not unpickle, utils.checkpoint.load_model loads it as is
+    with torch.no_grad():
+        torch.jit.save(torch.jit.trace(quantized, x[:1]), output)
+
+    speed = {}
+    for name, m in [('fp32', model), ('int8', quantized)]:
+        single = latency(m, x[:1], args.repeat)
+        batch = latency(m, x, args.repeat)
+
+        speed[name] = {
+            'latency_ms': single['median'] * 1e3,
+            'images_per_sec': len(x) / batch['median'],
+            'size_mb': model_size(m) / 2 ** 20,
+        }
+
+    speed['speedup'] = speed['int8']['images_per_sec'] / speed['fp32']['images_per_sec']
+
+    fp32, targets = predict(model, dataloader, preprocessing)
+    int8, _ = predict(quantized, dataloader, preprocessing)
+
+    results = {
+        'model': args.model,
+        'output': output,
+        'engine': engine,
+        'parts': args.parts,
+        'calibration_images': args.calibration,
+        'threads': torch.get_num_threads(),
+        'batch_size': args.batch_size,
+        'speed': speed,
+        'accuracy': compare(fp32, int8, targets),
+    }
+
+    save_results(report, results)
+
+    accuracy = results['accuracy']
+
+    print(f'{"":<6}  {"latency":>9}  {"images/s":>8}  {"size":>8}  {"IoU":>6}  {"blob IoU":>8}')
+    for name in ['fp32', 'int8']:
+        print(f'{name:<6}  {speed[name]["latency_ms"]:>7.1f}ms  {speed[name]["images_per_sec"]:>8.2f}  '
+              f'{speed[name]["size_mb"]:>6.1f}MB  {accuracy["positive_iou"][name]:>6.3f}  {accuracy["blob_iou"][name]:>8.3f}')
+
+    print(f'\n{speed["speedup"]:.2f}x throughput, int8 vs fp32 IoU {accuracy["agreement_iou"]:.3f}, '
+          f'height drift {accuracy["height_drift_px"]["mean"]:.1f}px mean, {accuracy["detection_flips"]} detection flips '
+          f'on {accuracy["images"]} images')
+    print(f'saved {output} and {report}')
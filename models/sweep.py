@@ -0,0 +1,311 @@
+import os
+import ast
+import sys
+import json
+import time
+import argparse
+import itertools
+import subprocess
+
+from collections import deque
+from contextlib import contextmanager
+
+
+SWEEPS_PATH = os.path.join('..', 'experiments', 'sweeps')
+
+# decoded images shared by all runs, memory backed where available
+DATA_CACHE = os.path.join('/dev/shm' if os.path.isdir('/dev/shm') else '..', 'fence-detection-cache')
+
+THREADS = 2 # torch threads per cpu run, cpu slots are the cpu count divided by this
+POLL_INTERVAL = 2.
+
+
+def parse_override(string):
+    """ KEY=VALUE, values are python literals, anything else is kept as a string, e.g. DECODER=UNetPP
+    """
+    key, sep, value = string.partition('=')
+
+    if not sep or not key:
+        raise ValueError(f'{string!r} is not of the form KEY=VALUE')
+
+    try:
+        value = ast.literal_eval(value)
+    except (ValueError, SyntaxError):
+        pass
+
+    return key, value
+
+
+def parse_overrides(strings):
+    """"""
+    return dict(parse_override(string) for string in strings)
+
+
+def apply_overrides(config, overrides):
+    """ set config fields, fields derived from others in config.py are not recomputed
+    """
+    for key, value in overrides.items():
+        if not key.isupper() or not hasattr(config, key):
+            raise KeyError(f'{key} is not a config field')
+
+        setattr(config, key, value)
+
+
+@contextmanager
+def overridden(config, overrides):
+    """ temporarily overridden config fields
+    """
+    original = {key: getattr(config, key) for key in overrides if hasattr(config, key)}
+    apply_overrides(config, overrides)
+
+    try:
+        yield config
+    finally:
+        for key, value in original.items():
+            setattr(config, key, value)
+
+
+def get_runs(grid=None, runs=None, base=None):
+    """ the cartesian product of a grid of values, followed by a list of runs, on top of base overrides
+    """
+    base = base or {}
+    variants = []
+
+    if grid:
+        keys = list(grid)
+        variants += [dict(zip(keys, values)) for values in itertools.product(*(grid[key] for key in keys))]
+
+    variants += runs or []
+
+    return [{**base, **variant} for variant in variants or [{}]]
+
+
+def get_name(i, variant):
+    """ run directory name, the index keeps names unique
+    """
+    values = '_'.join(f'{key.lower()}-{value}' for key, value in variant.items())
+    name = f'{i:03d}-{values}' if values else f'{i:03d}'
+
+    return ''.join(c if c.isalnum() or c in '-_.' else '_' for c in name)
+
+
+def get_slots(devices, runs_per_device=None, threads=THREADS):
+    """ (device, slot) pairs, a gpu runs one run at a time by default, the cpu as many as the thread budget allows
+    """
+    slots = []
+
+    for device in devices:
+        n = runs_per_device or (max(1, (os.cpu_count() or 1) // threads) if device == 'cpu' else 1)
+        slots += [(device, i) for i in range(n)]
+
+    return slots
+
+
+def get_devices():
+    """ all visible gpus, or the cpu
+    """
+    import torch
+
+    if torch.cuda.is_available():
+        return [f'cuda:{i}' for i in range(torch.cuda.device_count())]
+
+    return ['cpu']
+
+
+def warm_cache(runs, cache, synthetic=False, workers=None):
+    """ decode the images of all runs into the shared cache once, instead of once per run
+    """
+    if synthetic:
+        return 0
+
+    import config
+    import train
+
+    from utils.cache import DecodedCache
+
+    fpaths = set()
+
+    for run in runs:
+        with overridden(config, run['overrides']):
+            for dataset in train.get_datasets():
+                if hasattr(dataset, 'image_fpaths'):
+                    fpaths.update(dataset.image_fpaths())
+
+    return DecodedCache(cache).warm(sorted(fpaths), workers=workers)
+
+
+def best_score(dirpath, column='positive_iou'):
+    """ best validation score of a run so far
+    """
+    fpath = os.path.join(dirpath, 'valid-log.csv')
+
+    if not os.path.isfile(fpath) or not os.path.getsize(fpath):
+        return None
+
+    import pandas as pd
+
+    scores = pd.read_csv(fpath)
+
+    return float(scores[column].max()) if column in scores and len(scores) else None
+
+
+class Sweep():
+    """ runs train.py once per run, in parallel over device slots, every run logs to its own directory
+    """
+
+    def __init__(self, name, runs, slots, train_args=(), threads=THREADS, dirpath=SWEEPS_PATH, poll_interval=POLL_INTERVAL):
+        self.dirpath = os.path.join(dirpath, name)
+        self.slots = deque(slots)
+        self.train_args = list(train_args)
+        self.threads = threads
+        self.poll_interval = poll_interval
+
+        os.makedirs(self.dirpath, exist_ok=True)
+
+        self.runs = [{
+            'name': run_name,
+            'overrides': {**overrides, 'LOGS_PATH': self.dirpath, 'TITLE': run_name},
+            'status': 'pending',
+        } for run_name, overrides in runs]
+
+        self.active = {}
+
+
+    def command(self, run, device):
+        """"""
+        overrides = [f'{key}={value!r}' for key, value in run['overrides'].items()]
+
+        return [sys.executable, 'train.py', '--device', device, *self.train_args, '--override', *overrides]
+
+
+    def start(self, run, slot):
+        """"""
+        device, _ = slot
+        os.makedirs(os.path.join(self.dirpath, run['name']), exist_ok=True)
+
+        # cpu runs share the machine, gpu runs each get their own device
+        env = {**os.environ, 'OMP_NUM_THREADS': str(self.threads), 'MKL_NUM_THREADS': str(self.threads)}
+        output = open(os.path.join(self.dirpath, run['name'], 'output.log'), 'w')
+
+        process = subprocess.Popen(self.command(run, device), stdout=output, stderr=subprocess.STDOUT, env=env)
+
+        run.update(status='running', device=device, start=time.time())
+        self.active[slot] = (run, process, output)
+
+        print(f'started {run["name"]} on {device}')
+
+
+    def finish(self, slot):
+        """"""
+        run, process, output = self.active.pop(slot)
+        output.close()
+
+        run.update(status='done' if process.returncode == 0 else 'failed',
+                   returncode=process.returncode,
+                   duration=time.time() - run['start'],
+                   best_score=best_score(os.path.join(self.dirpath, run['name'])))
+
+        self.slots.append(slot)
+
+        print(f'{run["status"]} {run["name"]} in {run["duration"]:.0f}s, best valid IoU {run["best_score"]}')
+
+
+    def save(self):
+        """ manifest of all runs and their status, rewritten on every change
+        """
+        with open(os.path.join(self.dirpath, 'sweep.json'), 'w') as f:
+            json.dump({'train_args': self.train_args, 'runs': self.runs}, f, indent=2)
+
+
+    def run(self):
+        """ start runs while slots are free, until all runs finished
+        """
+        pending = deque(self.runs)
+        self.save()
+
+        try:
+            while pending or self.active:
+                while pending and self.slots:
+                    self.start(pending.popleft(), self.slots.popleft())
+                    self.save()
+
+                time.sleep(self.poll_interval)
+
+                for slot in [slot for slot, (_, process, _) in self.active.items() if process.poll() is not None]:
+                    self.finish(slot)
+                    self.save()
+        finally:
+            # an interrupted sweep stops its runs, each can be continued with train.py --resume
+            for run, process, output in self.active.values():
+                process.terminate()
+                process.wait()
+                output.close()
+                run['status'] = 'interrupted'
+
+            self.save()
+
+        return self.runs
+
+
+    def summary(self):
+        """"""
+        lines = [f'{"run":<40}  {"device":<8}  {"status":<11}  {"time":>8}  best valid IoU']
+
+        for run in sorted(self.runs, key=lambda run: -(run.get('best_score') or 0)):
+            duration = f'{run["duration"]:>7.0f}s' if 'duration' in run else f'{"-":>8}'
+            lines.append(f'{run["name"]:<40}  {run.get("device", "-"):<8}  {run["status"]:<11}  {duration}  '
+                         f'{run.get("best_score")}')
+
+        return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='train config variants in parallel, unknown arguments are passed on to train.py')
+    parser.add_argument('--name', type=str, default=time.strftime('sweep-%Y%m%d-%H%M%S'))
+    parser.add_argument('--spec', type=str, default=None, help='json with "base", "grid" and "runs" overrides')
+    parser.add_argument('--grid', type=str, nargs='+', default=[], metavar='KEY=[VALUES]',
+                        help="e.g. ENCODER_DETAILS=\"['resnet18', 'resnet34']\" LR=[1e-4,8e-5]")
+    parser.add_argument('--override', type=str, nargs='+', default=[], metavar='KEY=VALUE', help='applied to every run')
+    parser.add_argument('--devices', type=str, nargs='+', default=None, help='all gpus, or the cpu, by default')
+    parser.add_argument('--runs-per-device', type=int, default=None)
+    parser.add_argument('--max-parallel', type=int, default=None, help='upper bound on concurrent runs')
+    parser.add_argument('--threads', type=int, default=THREADS, help='torch threads per run')
+    parser.add_argument('--cache', type=str, default=DATA_CACHE, help='shared decoded image cache')
+    parser.add_argument('--no-cache', action='store_true')
+    parser.add_argument('--cache-workers', type=int, default=None)
+    parser.add_argument('--dry-run', action='store_true', help='print the runs and commands only')
+    args, train_args = parser.parse_known_args()
+
+    spec = {}
+    if args.spec:
+        with open(args.spec) as f:
+            spec = json.load(f)
+
+    grid = {**spec.get('grid', {}), **parse_overrides(args.grid)}
+    base = {**spec.get('base', {}), **parse_overrides(args.override)}
+
+    if not args.no_cache:
+        base['DATA_CACHE'] = args.cache
+
+    variants = get_runs(grid=grid, runs=spec.get('runs'), base=base)
+    runs = [(get_name(i, {key: value for key, value in variant.items() if key not in base or key in grid}), variant)
+            for i, variant in enumerate(variants)]
+
+    slots = get_slots(args.devices or get_devices(), args.runs_per_device, args.threads)[:args.max_parallel]
+    sweep = Sweep(args.name, runs, slots, train_args=train_args, threads=args.threads)
+
+    print(f'{len(runs)} runs on {len(slots)} slots, logs in {sweep.dirpath}')
+
+    if args.dry_run:
+        for run in sweep.runs:
+            print(' '.join(sweep.command(run, slots[0][0])))
+        sys.exit()
+
+    if not args.no_cache:
+        n = warm_cache(sweep.runs, args.cache, synthetic='--synthetic' in train_args, workers=args.cache_workers)
+        print(f'{n} images decoded into {args.cache}')
+
+    sweep.run()
+    print('\n' + sweep.summary())
+
+    sys.exit(int(any(run['status'] != 'done' for run in sweep.runs)))
@@ -1,64 +1,95 @@
 import os
 import sys
+import json
+import time
 import torch
 import config
+import argparse
+import resource
 
-from model import *
+import numpy as np
+
+from model import get_model
+from sweep import parse_overrides, apply_overrides
 from torch.utils.data import DataLoader
 
 import segmentation_models_pytorch as smp
 
 sys.path.insert(0, '..')
-from loaders.datasets import AmsterdamDataset, PolygonFences
+from loaders.datasets import AmsterdamDataset, PolygonFences, SyntheticFences
 from utils.augmentation import *
 from utils.metrics import *
 from utils.train import TrainEpoch, ValidEpoch
 from utils.log import TrainLog
+from utils.profile import PhaseProfiler
+from utils.checkpoint import Checkpointer, load, get_rng_state, set_rng_state
+from utils.autotune import load_settings, save_settings, loader_kwargs
+from utils import distributed
 
 
-if __name__ == '__main__':
-    # dedicated log
-    train_logs = TrainLog(config.TITLE, dirpath=config.LOGS_PATH)
-
-    # get decoder
-    model = config.DECODER
-
-    train_logs.add_model_data(model)
-    train_logs.add_config_data(config)
-
+def get_datasets(synthetic=False):
+    """ train and validation datasets as specified in the config
+    """
     # get encoding and training augmentation
-    preprocessing_fn = smp.encoders.get_preprocessing_fn(config.ENCODER, config.ENCODER_WEIGHTS) \
-                       if config.PREPROCESSING else None
+    preprocessing_fn = smp.encoders.get_preprocessing_fn(config.ENCODER_DETAILS, config.ENCODER_WEIGHTS) \
+                       if config.PREPROCESSING and not config.DEVICE_PREPROCESSING else None
+
+    # uint8 samples, converted on the device by get_batch_preprocessing
+    preprocessing = get_uint8_preprocessing() if config.DEVICE_PREPROCESSING else get_preprocessing(preprocessing_fn)
 
     train_transform = get_amsterdam_augmentation() if config.AUGMENTATION else None
 
-    if config.BLOBS:
+    # multi-task masks have a channel per task
+    multitask = len(config.TASKS) > 1
+
+    if synthetic:
+        train_dataset = SyntheticFences(seed=0,
+                                        transform=train_transform,
+                                        preprocessing=preprocessing,
+                                        classname=config.TASKS)
+        valid_dataset = SyntheticFences(seed=1,
+                                        preprocessing=preprocessing,
+                                        classname=config.TASKS)
+    elif config.BLOBS and multitask:
+        raise ValueError(f'polygon fence masks have no quays, set BLOBS = False to train {config.TASKS}')
+    elif config.BLOBS:
         train_dataset = PolygonFences(config.TRAIN_IMAGE_PATH, config.TRAIN_ANNOTATIONS_PATH,
                                     transform=train_transform,
-                                    preprocessing=get_preprocessing(preprocessing_fn),
-                                    subset='train')
-        valid_dataset = PolygonFences(config.VALID_IMAGE_PATH, config.VALID_ANNOTATIONS_PATH, 
-                                    preprocessing=get_preprocessing(preprocessing_fn),
-                                    subset='valid')
+                                    preprocessing=preprocessing,
+                                    subset='train',
+                                    cache=config.DATA_CACHE)
+        valid_dataset = PolygonFences(config.VALID_IMAGE_PATH, config.VALID_ANNOTATIONS_PATH,
+                                    preprocessing=preprocessing,
+                                    subset='valid',
+                                    cache=config.DATA_CACHE)
     else:
         train_dataset = AmsterdamDataset(config.TRAIN_IMAGE_PATH, config.TRAIN_ANNOTATIONS_PATH,
                                         transform=train_transform,
-                                        preprocessing=get_preprocessing(preprocessing_fn),
-                                        classname=config.CLASSNAME,
-                                        train=False)
-        valid_dataset = AmsterdamDataset(config.VALID_IMAGE_PATH, config.VALID_ANNOTATIONS_PATH, 
-                                        preprocessing=get_preprocessing(preprocessing_fn),
-                                        classname=config.CLASSNAME,
-                                        train=False)
+                                        preprocessing=preprocessing,
+                                        classname=config.TASKS if multitask else config.CLASSNAME,
+                                        train=False,
+                                        cache=config.DATA_CACHE)
+        valid_dataset = AmsterdamDataset(config.VALID_IMAGE_PATH, config.VALID_ANNOTATIONS_PATH,
+                                        preprocessing=preprocessing,
+                                        classname=config.TASKS if multitask else config.CLASSNAME,
+                                        train=False,
+                                        cache=config.DATA_CACHE)
 
-    # get train and val data loaders
-    train_loader = DataLoader(train_dataset, batch_size=config.TRAIN_BATCH_SIZE, shuffle=True, num_workers=config.NUM_WORKERS)
-    valid_loader = DataLoader(valid_dataset, batch_size=config.VALID_BATCH_SIZE, shuffle=False, num_workers=config.NUM_WORKERS)
+    return train_dataset, valid_dataset
 
-    # define loss function
-    loss = smp.utils.losses.DiceLoss()
 
-    # define metrics
+def get_batch_preprocessing():
+    """ float conversion of batches on their device, with the encoder preprocessing when the loaders leave it
+    """
+    if config.PREPROCESSING and config.DEVICE_PREPROCESSING:
+        return BatchPreprocessing(config.ENCODER_DETAILS, config.ENCODER_WEIGHTS)
+
+    return BatchPreprocessing()
+
+
+def get_metrics():
+    """ metrics over all mask channels, and the IoU per task of multi-task models
+    """
     metrics = [
         PositiveIoUScore(),
         NegativeIoUScore(),
@@ -68,46 +99,327 @@ if __name__ == '__main__':
         FalsePositiveRate(),
     ]
 
+    if len(config.TASKS) > 1:
+        metrics += [TaskIoUScore(channel, task) for channel, task in enumerate(config.TASKS)]
+
+    return metrics
+
+
+def benchmark(train_epoch, dataloader, steps=50, warmup=5):
+    """ time a fixed number of training steps, without logging or saving
+    """
+    device = torch.device(train_epoch.device)
+    synchronize = torch.cuda.synchronize if device.type == 'cuda' else lambda: None
+
+    if device.type == 'cuda':
+        torch.cuda.reset_peak_memory_stats(device)
+
+    train_epoch.on_epoch_start()
+    profiler = train_epoch.profiler
+
+    waits, latencies = [], []
+    n_images = 0
+
+    iterator = iter(dataloader)
+
+    for step in range(warmup + steps):
+        start = time.perf_counter()
+
+        # restart the loader when exhausted, worker startup counts as waiting
+        try:
+            x, y = next(iterator)
+        except StopIteration:
+            iterator = iter(dataloader)
+            x, y = next(iterator)
+
+        loaded = time.perf_counter()
+
+        # phase timings only cover the timed steps
+        if profiler and step == warmup:
+            profiler.reset()
+
+        if profiler:
+            profiler.record('data', loaded - start)
+            profiler.on_step_start()
+
+        with train_epoch.phase('to_device'):
+            x, y = train_epoch.to_device(x, y)
+
+        train_epoch.batch_update(x, y)
+        synchronize()
+
+        if profiler:
+            profiler.on_step_end()
+
+        done = time.perf_counter()
+
+        if step >= warmup:
+            waits.append(loaded - start)
+            latencies.append(done - loaded)
+            n_images += len(x)
+
+    total = sum(waits) + sum(latencies)
+    latencies = np.array(latencies) * 1e3
+
+    if device.type == 'cuda':
+        peak_memory = torch.cuda.max_memory_allocated(device) / 2 ** 20
+    else:
+        # maximum resident set size of this process, in kilobytes on linux
+        peak_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2 ** 10
+
+    results = {
+        'decoder': type(getattr(train_epoch.model, 'module', train_epoch.model)).__name__,
+        'encoder': config.ENCODER_DETAILS,
+        'device': str(device),
+        'precision': train_epoch.precision,
+        'channels_last': train_epoch.memory_format == torch.channels_last,
+        'compile': train_epoch.compile,
+        'accumulation_steps': train_epoch.accumulation_steps,
+        'batch_size': dataloader.batch_size,
+        'num_workers': dataloader.num_workers,
+        'steps': steps,
+        'images_per_sec': n_images / total,
+        'step_latency_ms': {
+            'mean': float(latencies.mean()),
+            'p50': float(np.percentile(latencies, 50)),
+            'p90': float(np.percentile(latencies, 90)),
+            'p99': float(np.percentile(latencies, 99)),
+        },
+        'data_wait_fraction': sum(waits) / total,
+        'peak_memory_mb': peak_memory,
+    }
+
+    if profiler:
+        profiler.stop_trace()
+        results['profile'] = profiler.summary()
+
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--benchmark', action='store_true', help='time a fixed number of training steps, no logs or model saving')
+    parser.add_argument('--steps', type=int, default=50, help='number of benchmark steps')
+    parser.add_argument('--warmup', type=int, default=5, help='number of untimed benchmark steps')
+    parser.add_argument('--synthetic', action='store_true', help='use synthetic instead of annotated data')
+    parser.add_argument('--device', type=str, default=None, help='overrides config.DEVICE')
+    parser.add_argument('--precision', type=str, default=None, choices=['single', 'mixed'], help='overrides config.PRECISION')
+    parser.add_argument('--output', type=str, default=None, help='write benchmark results to json')
+    parser.add_argument('--channels-last', action='store_true', help='overrides config.CHANNELS_LAST')
+    parser.add_argument('--compile', action='store_true', help='overrides config.COMPILE')
+    parser.add_argument('--accumulation-steps', type=int, default=None, help='overrides config.ACCUMULATION_STEPS')
+    parser.add_argument('--resume', type=str, nargs='?', const='last', default=None, help='continue from the last or a given checkpoint')
+    parser.add_argument('--profile', action='store_true', help='overrides config.PROFILE')
+    parser.add_argument('--trace-steps', type=int, nargs=2, default=None, help='overrides config.PROFILE_TRACE_STEPS')
+    parser.add_argument('--nproc', type=int, default=1, help='data parallel processes per node, one per gpu')
+    parser.add_argument('--nnodes', type=int, default=1)
+    parser.add_argument('--node-rank', type=int, default=0)
+    parser.add_argument('--master-addr', type=str, default=distributed.MASTER_ADDR)
+    parser.add_argument('--master-port', type=int, default=distributed.MASTER_PORT)
+    parser.add_argument('--backend', type=str, default=None, choices=['gloo', 'nccl'], help='overrides config.DISTRIBUTED_BACKEND')
+    parser.add_argument('--autotune', action='store_true', help='measure batch sizes and loader settings first, see autotune.py')
+    parser.add_argument('--override', type=str, nargs='+', default=[], metavar='KEY=VALUE', help='set config fields, e.g. LR=1e-4')
+    args = parser.parse_args()
+
+    apply_overrides(config, parse_overrides(args.override))
+
+    # relaunch this script once per process, torchrun sets the same environment and can be used instead
+    if args.nproc * args.nnodes > 1 and not distributed.is_launched():
+        sys.exit(distributed.launch([sys.executable] + sys.argv, args.nproc, args.nnodes, args.node_rank,
+                                    args.master_addr, args.master_port))
+
+    device = torch.device(args.device) if args.device else config.DEVICE
+    precision = args.precision or config.PRECISION
+
+    # every process trains on its own shard of the data, only rank 0 logs, prints and saves
+    if distributed.is_launched():
+        device = distributed.setup(device, args.backend or config.DISTRIBUTED_BACKEND)
+
+    main = distributed.is_main_process()
+
+    # performance modes
+    channels_last = args.channels_last or config.CHANNELS_LAST
+    use_compile = args.compile or config.COMPILE
+    accumulation_steps = args.accumulation_steps or config.ACCUMULATION_STEPS
+
+    # per-phase profiling, traces are written to the experiment directory
+    profile = args.profile or config.PROFILE
+    trace_steps = args.trace_steps or config.PROFILE_TRACE_STEPS
+    trace_dir = os.path.join(config.LOGS_PATH, config.TITLE)
+
+    # get decoder, only the configured architecture is constructed
+    model = get_model(config.DECODER,
+                      encoder_name=config.ENCODER_DETAILS,
+                      encoder_weights=config.ENCODER_WEIGHTS,
+                      classes=config.CLASSES,
+                      activation=config.ACTIVATION,
+                      offline=config.OFFLINE,
+                      tasks=config.TASKS,
+                      task_decoder_channels=config.TASK_DECODER_CHANNELS)
+
+    # get train and val data loaders
+    train_dataset, valid_dataset = get_datasets(synthetic=args.synthetic)
+
+    train_sampler = distributed.get_sampler(train_dataset, shuffle=True)
+    valid_sampler = distributed.get_sampler(valid_dataset, shuffle=False)
+
+    # batch sizes and loader settings of this machine
+    if args.autotune:
+        if distributed.is_distributed():
+            raise ValueError('--autotune runs in a single process, tune first and set AUTOTUNE for distributed runs')
+
+        from autotune import tune
+
+        settings, inference, probes = tune(model, train_dataset, valid_dataset, device, precision,
+                                           channels_last=channels_last, accumulation_steps=accumulation_steps,
+                                           preprocessing=get_batch_preprocessing())
+        save_settings(os.path.join(config.LOGS_PATH, f'autotune-{device.type}.json'), device, settings, inference, probes)
+        apply_overrides(config, settings)
+    elif config.AUTOTUNE:
+        tuned = load_settings(config.AUTOTUNE, device)
+
+        if tuned is None and main:
+            print(f'{config.AUTOTUNE} was tuned for another device, using the config settings')
+        elif tuned:
+            apply_overrides(config, tuned['settings'])
+
+    loader_settings = loader_kwargs(config.NUM_WORKERS, config.PREFETCH_FACTOR, config.PIN_MEMORY,
+                                    config.PERSISTENT_WORKERS)
+
+    train_loader = DataLoader(train_dataset, batch_size=config.TRAIN_BATCH_SIZE, shuffle=train_sampler is None,
+                              sampler=train_sampler, **loader_settings)
+    valid_loader = DataLoader(valid_dataset, batch_size=config.VALID_BATCH_SIZE, shuffle=False,
+                              sampler=valid_sampler, **loader_settings)
+
+    # define loss function
+    loss = smp.utils.losses.DiceLoss()
+
+    # dice is computed over the whole batch, the mean over micro-batches has a different gradient
+    if accumulation_steps > 1 and isinstance(loss, smp.utils.losses.DiceLoss) and main:
+        print(f'Accumulating {accumulation_steps} micro-batches does not reproduce the dice loss of full batches, '
+              f'see benchmarks/modes.py --loss dice')
+
+    # define metrics
+    metrics = get_metrics()
+
     # define optimizer
-    optimizer = torch.optim.Adam([ 
+    optimizer = torch.optim.Adam([
         dict(params=model.parameters(), lr=config.LR),
     ])
 
     train_epoch = TrainEpoch(
-        model, 
-        loss=loss, 
-        metrics=metrics, 
+        model,
+        loss=loss,
+        metrics=metrics,
         optimizer=optimizer,
-        device=config.DEVICE,
-        precision=config.PRECISION,
-        verbose=True,
+        device=device,
+        precision=precision,
+        verbose=main,
+        profiler=PhaseProfiler('train', device, trace_steps, trace_dir) if profile else None,
+        channels_last=channels_last,
+        compile=use_compile,
+        accumulation_steps=accumulation_steps,
+        distributed=distributed.is_distributed(),
+        preprocessing=get_batch_preprocessing(),
     )
 
+    if args.benchmark:
+        results = benchmark(train_epoch, train_loader, steps=args.steps, warmup=args.warmup)
+
+        # throughput of rank 0, multiply by the world size for the total
+        results['world_size'] = distributed.get_world_size()
+
+        if main:
+            print(json.dumps(results, indent=2))
+
+            if args.output:
+                with open(args.output, 'w') as f:
+                    json.dump(results, f, indent=2)
+
+        distributed.cleanup()
+        sys.exit()
+
     valid_epoch = ValidEpoch(
-        model, 
-        loss=loss, 
-        metrics=metrics, 
-        device=config.DEVICE,
-        precision=config.PRECISION,
-        verbose=True,
+        model,
+        loss=loss,
+        metrics=metrics,
+        device=device,
+        precision=precision,
+        verbose=main,
+        profiler=PhaseProfiler('valid', device, trace_dir=trace_dir) if profile else None,
+        channels_last=channels_last,
+        compile=use_compile,
+        preprocessing=get_batch_preprocessing(),
     )
 
+    # dedicated log and checkpoints, written in the background, on rank 0 only
+    train_logs, checkpointer = None, None
+
+    if main:
+        train_logs = TrainLog(config.TITLE, dirpath=config.LOGS_PATH, resume=bool(args.resume))
+
+        train_logs.add_model_data(model)
+        train_logs.add_config_data(config)
+
+        checkpointer = Checkpointer(os.path.join(config.LOGS_PATH, config.TITLE), keep=config.KEEP_CHECKPOINTS)
+
+    architecture = {
+        'arch': getattr(model, 'arch', type(model).__name__),
+        'encoder_name': config.ENCODER_DETAILS,
+        'encoder_weights': config.ENCODER_WEIGHTS,
+        # encoder normalization of the inputs, on the host or the device, inference applies the same
+        'preprocessing': config.PREPROCESSING,
+        'classes': config.CLASSES,
+        'activation': config.ACTIVATION,
+        'tasks': config.TASKS,
+        'task_decoder_channels': config.TASK_DECODER_CHANNELS,
+    }
+
     best_iou_score = 0.
+    start_epoch = 0
     train_logs_list, valid_logs_list = [], []
 
+    if args.resume:
+        # every process restores the checkpoint written by rank 0
+        last = os.path.join(config.LOGS_PATH, config.TITLE, 'last_model.pth')
+        checkpoint = load(last if args.resume == 'last' else args.resume)
+
+        model.load_state_dict(checkpoint['model'])
+        optimizer.load_state_dict(checkpoint['optimizer'])
+        train_epoch.scaler.load_state_dict(checkpoint['scaler'])
+        set_rng_state(checkpoint['rng'])
+
+        best_iou_score = checkpoint['best_iou_score']
+        start_epoch = checkpoint['epoch'] + 1
+
+        if main:
+            print(f'Resuming from epoch {start_epoch}')
+
     # training loop
-    for i in range(0, config.NUM_EPOCHS):
+    for i in range(start_epoch, config.NUM_EPOCHS):
+
+        # reshuffle the shards every epoch
+        if train_sampler is not None:
+            train_sampler.set_epoch(i)
 
         # perform training & validation
-        print('\nEpoch: {}'.format(i))
-        train_results = train_epoch.run(train_loader, save=False)
-        valid_results = valid_epoch.run(valid_loader, save=True)
+        if main:
+            print('\nEpoch: {}'.format(i))
+
+        train_results = train_epoch.run(train_loader, save=False, log=train_logs, epoch=i)
+        valid_results = valid_epoch.run(valid_loader, save=True, log=train_logs, epoch=i)
+
+        # losses and metrics are averaged over all processes, rank 0 logs and saves them
+        if not main:
+            continue
 
+        # blob overlap only covers the validation shard of rank 0
         if config.CLASSNAME == 'fence':
             biou_valid = BlobOverlap()
             biou_valid.update(valid_epoch.predictions, valid_epoch.targets)
 
         train_logs.add_metrics(name='train',
+                               timings=train_epoch.timings,
                                epoch=i,
                                dice_loss=train_results['dice_loss'],
                                positive_iou=train_results['iou_score'],
@@ -118,6 +430,7 @@ if __name__ == '__main__':
                                true_positive_rate=train_results['tpr'])
 
         train_logs.add_metrics(name='valid',
+                               timings=valid_epoch.timings,
                                epoch=i,
                                dice_loss=valid_results['dice_loss'],
                                positive_iou=valid_results['iou_score'],
@@ -129,7 +442,25 @@ if __name__ == '__main__':
                                blob_iou=biou_valid.compute() if config.CLASSNAME == 'fences' else 0)
 
         # save model if a better val IoU score is obtained
-        if best_iou_score < valid_results['iou_score']:
+        is_best = best_iou_score < valid_results['iou_score']
+
+        if is_best:
             best_iou_score = valid_results['iou_score']
-            torch.save(model, os.path.join(config.LOGS_PATH, config.TITLE, 'best_model.pth'))
-            print('Model saved!')
\ No newline at end of file
+
+        checkpointer.save({
+            'architecture': architecture,
+            'model': model.state_dict(),
+            'optimizer': optimizer.state_dict(),
+            'scaler': train_epoch.scaler.state_dict(),
+            'rng': get_rng_state(),
+            'best_iou_score': best_iou_score,
+        }, epoch=i, is_best=is_best)
+
+        if is_best:
+            print('Model saved!')
+
+    if main:
+        checkpointer.close()
+        train_logs.close()
+
+    distributed.cleanup()
@@ -0,0 +1,71 @@
+import os
+import sys
+import json
+import time
+import argparse
+
+from tqdm import tqdm
+
+sys.path.insert(0, '..')
+from utils import rle as rlecodec
+
+
+def migrate(dataset, decompress=False):
+    """ convert all fence counts and RLE segmentations of a COCO dataset in place
+    """
+    convert = rlecodec.decompress if decompress else rlecodec.compress
+    n = 0
+
+    for annotation in dataset['annotations']:
+        if annotation.get('counts'):
+            annotation['counts'] = convert(annotation['counts'])
+            n += 1
+
+        # crowd annotations store RLE as segmentation
+        if isinstance(annotation.get('segmentation'), dict):
+            annotation['segmentation'] = convert(annotation['segmentation'])
+            n += 1
+
+    return n
+
+
+def load(fpath):
+    """ json and its parse time in seconds
+    """
+    start = time.perf_counter()
+
+    with open(fpath) as f:
+        data = json.load(f)
+
+    return data, time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='convert annotation files between uncompressed and compressed RLE')
+    parser.add_argument('fpaths', type=str, nargs='+', help='COCO json files')
+    parser.add_argument('--output-dir', type=str, default=None, help='defaults to overwriting the input files')
+    parser.add_argument('--decompress', action='store_true', help='convert back to uncompressed counts')
+    args = parser.parse_args()
+
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+
+    for fpath in tqdm(args.fpaths):
+        dataset, before = load(fpath)
+        size = os.path.getsize(fpath)
+
+        n = migrate(dataset, decompress=args.decompress)
+
+        # write next to the output and rename, so an interrupted run leaves the input intact
+        output = os.path.join(args.output_dir, os.path.basename(fpath)) if args.output_dir else fpath
+        tmp = f'{output}.tmp'
+
+        with open(tmp, 'w') as f:
+            json.dump(dataset, f)
+
+        os.replace(tmp, output)
+
+        _, after = load(output)
+
+        tqdm.write(f'{fpath}: {n} RLEs, {size / 2 ** 20:.1f}MB -> {os.path.getsize(output) / 2 ** 20:.1f}MB, '
+              f'load {before:.2f}s -> {after:.2f}s')
@@ -1,19 +1,20 @@
 import os
 import sys
 import cv2
-import json
 import argparse
 
 import numpy as np
 
 from tqdm import tqdm
+from collections import deque
+from multiprocessing import Pool
 from lxml import etree
-from skimage import measure
 from pycocotools import mask
-from itertools import groupby
 
 sys.path.insert(0, '..')
-from utils.metrics import to_blobs
+from utils.blobs import to_blobs
+from utils import rle as rlecodec
+from utils.coco import COCOWriter
 
 # width of of polyline polygon-like mask
 PIXELS = 11
@@ -21,16 +22,13 @@ PIXELS = 11
 # polygon-like polyline annotations
 BLOBS = True 
 
+# store fence counts as compressed RLE strings
+COMPRESSED = True
+
 
 def binary_mask_to_rle(binary_mask):
     """"""
-    rle = {'counts': [], 'size': list(binary_mask.shape)}
-    counts = rle.get('counts')
-    for i, (value, elements) in enumerate(groupby(binary_mask.ravel(order='F'))):
-        if i == 0 and value == 1:
-            counts.append(0)
-        counts.append(len(list(elements)))
-    return rle
+    return rlecodec.encode(binary_mask)
 
 
 def polyline_to_polygon(points, width, height, pixels=PIXELS):
@@ -39,7 +37,7 @@ def polyline_to_polygon(points, width, height, pixels=PIXELS):
     polygon = []
 
     # create ndarray binary mask
-    background = np.zeros((height, width)).astype(int)
+    background = np.zeros((height, width), dtype=np.uint8)
     binary_mask = cv2.polylines(background, [points], False, 1, pixels, lineType=cv2.LINE_AA)
 
     if BLOBS:
@@ -109,7 +107,7 @@ def parse_polyline(index, image, polyline):
     # convert ndarray to polygon RLE
     counts, rle = polyline_to_polygon(points, width, height)
     
-    json_object['counts'] = counts
+    json_object['counts'] = rlecodec.compress(counts) if COMPRESSED else counts
     json_object['area'] = mask.area(rle).astype(float)
     json_object['bbox'] = mask.toBbox(rle).tolist()
 
@@ -207,20 +205,90 @@ def xml_to_json(xml):
     return json_object
 
 
-if __name__ == '__main__':
-    for i in range(2):
-        dirname = os.path.join('..', 'data', 'fences-quays', 'annotations', 'xml')
-        fname = os.path.join(dirname, f'annotations-{i + 1}.xml')
+def iterparse(fname):
+    """ stream meta and image elements, freeing each one once it has been consumed
+    """
+    for _, elem in etree.iterparse(fname, events=('end',), tag=('meta', 'image')):
+        yield elem
+
+        # drop the element and its already processed siblings
+        elem.clear()
+        while elem.getprevious() is not None:
+            del elem.getparent()[0]
+
+
+def parse_image_string(string):
+    """ worker side of parse_image, elements are passed as serialized xml
+    """
+    _, img, anns = parse_image(0, etree.fromstring(string))
+    return img, anns
+
+
+def convert(fin, fout, workers=None, queue_size=4):
+    """ stream a CVAT xml export into a COCO json, rasterizing annotations in a process pool
+    """
+    workers = workers or os.cpu_count()
+    writer = None
+    index = 0
+
+    # in-flight images are bounded, so memory does not grow with the export size
+    pending = deque()
+
+    def write(result):
+        nonlocal index
+        img, anns = result.get()
+
+        for image in img:
+            writer.add_image(image)
+
+        # annotation ids are assigned in order, as in xml_to_json
+        for ann in anns:
+            ann['id'] = index
+            writer.add_annotation(ann)
+            index += 1
+
+    try:
+        with Pool(workers) as pool:
+            for elem in tqdm(iterparse(fin)):
+                if elem.tag == 'meta':
+                    writer = writer or COCOWriter(fout, *parse_meta(elem))
+
+                elif elem.tag == 'image':
+                    writer = writer or COCOWriter(fout)
+
+                    pending.append(pool.apply_async(parse_image_string, (etree.tostring(elem),)))
+
+                    if len(pending) >= workers * queue_size:
+                        write(pending.popleft())
+
+            writer = writer or COCOWriter(fout)
 
-        with open(fname) as f:
-            xml = f.read().encode('ascii')
+            while pending:
+                write(pending.popleft())
+    except BaseException:
+        # no spooled annotations are left behind
+        if writer:
+            writer.abort()
+        raise
 
-        xml = etree.fromstring(xml)
-        json_object = xml_to_json(xml)
+    writer.close()
+
+    return writer.n_images, writer.n_annotations
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dirpath', type=str, default=os.path.join('..', 'data', 'fences-quays', 'annotations'))
+    parser.add_argument('--batches', type=int, default=2, help='number of annotations-{i}.xml files')
+    parser.add_argument('--workers', type=int, default=None, help='defaults to the number of cores')
+    args = parser.parse_args()
+
+    for i in range(args.batches):
+        fname = os.path.join(args.dirpath, 'xml', f'annotations-{i + 1}.xml')
 
         # dump
-        dirname = os.path.join('..', 'data', 'fences-quays', 'annotations', 'batch-json')
-        fname = f'annotations-{i + 1}-{PIXELS}px' + '-blobs' if BLOBS else ''
-        f = open(os.path.join(dirname, f'{fname}.json'), 'w')
-        json.dump(json_object, f)
-        f.close()
\ No newline at end of file
+        dirname = os.path.join(args.dirpath, 'batch-json')
+        name = f'annotations-{i + 1}-{PIXELS}px' + '-blobs' if BLOBS else ''
+
+        n_images, n_annotations = convert(fname, os.path.join(dirname, f'{name}.json'), workers=args.workers)
+        print(f'{fname}: {n_images} images, {n_annotations} annotations')
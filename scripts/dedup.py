@@ -0,0 +1,45 @@
+import os
+import sys
+import argparse
+
+import pandas as pd
+
+sys.path.insert(0, '..')
+from utils.dedup import select, is_processed, SPACING, MAX_HEADING_DIFFERENCE, MAX_TIME_DIFFERENCE
+
+
+# paths
+PATH_META_FILE = os.path.join('..', 'data', '15000-water-images', 'metadata.csv')
+PATH_SAVE_FILE = os.path.join('..', 'data', '15000-water-images', 'metadata-dedup.csv')
+
+
+def deduplicate(metadata, spacing=SPACING, max_heading=MAX_HEADING_DIFFERENCE, max_time=MAX_TIME_DIFFERENCE):
+    """ metadata with a source column, the filename of the panorama whose results each panorama uses
+    """
+    source = select(metadata.lng, metadata.lat, metadata.heading, metadata.timestamp, spacing, max_heading, max_time)
+
+    metadata = metadata.copy()
+    metadata['source'] = metadata.filename_dump.values[source]
+    metadata['processed'] = is_processed(source)
+
+    return metadata
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='select the panoramas to run inference on, at a minimum spacing')
+    parser.add_argument('--metadata', type=str, default=PATH_META_FILE)
+    parser.add_argument('--output', type=str, default=PATH_SAVE_FILE)
+    parser.add_argument('--spacing', type=float, nargs='+', default=[SPACING], help='metres, the last is written')
+    parser.add_argument('--max-heading', type=float, default=MAX_HEADING_DIFFERENCE, help='degrees')
+    parser.add_argument('--max-time', type=float, default=MAX_TIME_DIFFERENCE, help='seconds')
+    args = parser.parse_args()
+
+    metadata = pd.read_csv(args.metadata)
+
+    for spacing in args.spacing:
+        deduplicated = deduplicate(metadata, spacing, args.max_heading, args.max_time)
+        n = deduplicated.processed.sum()
+
+        print(f'{spacing:>6.1f}m  {n:>7} of {len(metadata)} panoramas processed  {1 - n / len(metadata):>6.1%} skipped')
+
+    deduplicated.to_csv(args.output, index=False)
@@ -4,15 +4,20 @@ import torch
 
 import numpy as np
 import pandas as pd
-import geopandas as gpd
 import matplotlib.pyplot as plt
 
 from tqdm import tqdm
-from shapely.geometry import Point, Polygon
 
 # relative imports
 sys.path.insert(0, '..')
 from utils.general import visualize
+from utils.checkpoint import load_model, load_preprocessing
+from utils.inference import estimate_height, predict_panorama, crop_centers, crop_columns, predict_cascade, \
+                            GATE_SCALE, GATE_THRESHOLD, GATE_MIN_AREA, GATE_MARGIN, BATCH_SIZE
+from utils.autotune import load_settings
+from utils.dedup import select
+from utils.results import ResultCache, file_hash, fingerprint
+from utils.archive import MaskArchive
 
 
 # paths
@@ -24,11 +29,164 @@ PATH_MODEL_QUAY = None
 
 PATH_SAVE_FILE = os.path.join('..', 'data', 'geometry', 'predictions.geojson')
 
+# results per image and model, a re-run only predicts new or changed images, None recomputes everything
+PATH_CACHE_FILE = os.path.join('..', 'data', 'geometry', 'results.sqlite')
+PRUNE_CACHE = False # remove the cached results of other checkpoints and settings
+
+# every predicted mask by panorama and side ('l', 'r' or 'panorama'), for post-processing without the model,
+# one archive per model, None disables it
+PATH_ARCHIVE_FILE = None
+ARCHIVE_PROBABILITIES = False # also store uint8 probabilities, masks of cached results are archived without
+
+# crops: the left and right crops of every panorama, panorama: tiled inference over the full horizon band,
+# cascade: the crops, the fence model only runs where the quay model finds quays, see models/cascade.py
+MODE = 'crops'
+PATH_PANORAMA_DIR = os.path.join('..', 'data', 'panoramas')
+
+# horizontal distance between panorama tiles, overlapping tiles are blended
+STRIDE = 768
+
+# settings measured by models/autotune.py, sets the number of panorama tiles per batch, None uses BATCH_SIZE
+PATH_AUTOTUNE_FILE = None
+
+# metres between processed panoramas, skipped ones inherit the results of the nearest processed one, see scripts/dedup.py
+DEDUP_SPACING = None
+
+
+def add_result(results, row, per_image, source):
+    """ results of a panorama, source is the panorama that was processed for it
+    """
+    results['fname'].append(f'{row.filename_dump}-equirectangular-panorama_8000.jpg')
+    results['source'].append(f'{source}-equirectangular-panorama_8000.jpg')
+    results['timestamp'].append(row.timestamp)
+    results['height_l'].append(per_image['height_l'])
+    results['height_r'].append(per_image['height_r'])
+    results['fence_degrees'].append(per_image['fence_degrees'])
+    results['quay_l'].append(per_image.get('quay_l', np.nan))
+    results['quay_r'].append(per_image.get('quay_r', np.nan))
+    results['geometry'].append((row.lng, row.lat))
+
+
+def cached(cache, fpath, predict, *keys, archive=None, entry=None):
+    """ result of predict() for an image, from the cache when neither the image nor the model changed,
+        None for missing or unreadable images, the mask is archived under entry, a (fname, side) key
+    """
+    # images are only hashed to look them up in the cache
+    image = None
+
+    if cache:
+        try:
+            image = ':'.join([file_hash(fpath), *map(str, keys)])
+        except OSError:
+            return None
+
+    result = cache.get(image) if cache else None
+    probs, mask = None, None
+
+    if result is None:
+        result, probs = predict()
+
+        if result is None:
+            return None
+
+        mask = probs > .5
+
+        if cache:
+            cache.put(image, os.path.basename(fpath), result, mask)
+    elif archive is not None and entry not in archive:
+        mask = cache.mask(image)
+
+        # results cached without a mask are predicted again for the archive, the cached result is kept
+        if mask is None:
+            _, probs = predict()
+
+            if probs is not None:
+                mask = probs > .5
+                cache.put(image, os.path.basename(fpath), result, mask)
+
+    # the mask is only set for new predictions and entries missing from the archive
+    if archive is not None and mask is not None:
+        archive.put(*entry, mask, probs if ARCHIVE_PROBABILITIES else None)
+
+    return result
+
+
+def predict_crop(model_fence, model_quay, fpath, preprocessing=None, quay_preprocessing=None):
+    """ fence height and quay fraction of a crop, and its fence probabilities, preprocessing as the models were trained
+    """
+    try:
+        img = plt.imread(fpath)
+    except:
+        return None, None
+
+    # uint8 copy to the device, converted there
+    x = torch.as_tensor(np.ascontiguousarray(img.transpose(2, 0, 1))).unsqueeze(0).cuda()
+
+    # predict
+    if MODE == 'cascade':
+        y, _ = predict_cascade(model_fence, model_quay, x, preprocessing=preprocessing,
+                               gate_preprocessing=quay_preprocessing)
+    else:
+        with torch.no_grad():
+            y = model_fence(preprocessing(x) if preprocessing else x.float())
+
+    # to np array, multi-task models segment quays in their second channel
+    probs = y[0].cpu().numpy()
+    y = probs > .5
+    quay = float(y[1].mean()) if len(y) > 1 else np.nan
+
+    # visualize(x=img, y=y[0])
+    return {'height': float(estimate_height(y[0])), 'quay': quay}, probs[0]
+
+
+def predict_panorama_heights(model, fpath, heading, batch_size=BATCH_SIZE, device='cuda', preprocessing=None):
+    """ heights in the left and right crop windows of the blended full-band prediction,
+        and the number of degrees of the horizon with fences, and the fence probabilities of the band
+    """
+    try:
+        img = plt.imread(fpath)
+    except:
+        return None, None
+
+    probs = predict_panorama(model, img, stride=STRIDE, batch_size=batch_size, device=device,
+                             preprocessing=preprocessing)[0]
+    y = probs > .5
+    width = y.shape[1]
+
+    per_image = {'fence_degrees': float(y.any(axis=0).mean() * 360)}
+
+    for side, center in zip(['l', 'r'], crop_centers(heading, width=width)):
+        per_image[f'height_{side}'] = float(estimate_height(y[:, crop_columns(center, width)]))
+
+    return per_image, probs
+
 
 if __name__ == '__main__':
     # load fence and quay models
-    model_fence = torch.load(PATH_MODEL_FENCE)
-    model_quay = None
+    model_fence = load_model(PATH_MODEL_FENCE, map_location='cuda')
+    model_quay = load_model(PATH_MODEL_QUAY, map_location='cuda') if MODE == 'cascade' else None
+
+    # encoder normalization the models were trained with, applied on the device
+    preprocessing_fence = load_preprocessing(PATH_MODEL_FENCE)
+    preprocessing_quay = load_preprocessing(PATH_MODEL_QUAY) if MODE == 'cascade' else None
+
+    # batch size of this machine, when tuned for the same device
+    tuned = load_settings(PATH_AUTOTUNE_FILE, 'cuda') if PATH_AUTOTUNE_FILE else None
+    batch_size = tuned['inference']['batch_size'] if tuned else BATCH_SIZE
+
+    # results are cached per checkpoint and settings, any change invalidates them
+    model = fingerprint(PATH_MODEL_FENCE, PATH_MODEL_QUAY if MODE == 'cascade' else None, mode=MODE,
+                        stride=STRIDE if MODE == 'panorama' else None,
+                        gate=[GATE_SCALE, GATE_THRESHOLD, GATE_MIN_AREA, GATE_MARGIN] if MODE == 'cascade' else None)
+    cache = None
+
+    if PATH_CACHE_FILE:
+        cache = ResultCache(PATH_CACHE_FILE, model)
+
+        if PRUNE_CACHE:
+            print(f'{cache.prune()} results of other models removed from the cache')
+
+    archive = MaskArchive(PATH_ARCHIVE_FILE, model) if PATH_ARCHIVE_FILE else None
 
     # debug limit
     n = np.inf
@@ -40,94 +198,77 @@ if __name__ == '__main__':
     f = lambda x: x.replace('-equirectangular-panorama_8000.jpg', '')
     metadata.filename_dump = metadata.filename_dump.apply(f)
 
-    results = {'fname':[], 'timestamp':[], 'height_l':[], 'height_r':[], 'geometry':[]}
+    results = {'fname':[], 'source':[], 'timestamp':[], 'height_l':[], 'height_r':[], 'fence_degrees':[], 'quay_l':[],
+               'quay_r':[], 'geometry':[]}
+
+    # position of the panorama whose results each panorama uses, nearby panoramas facing the same way are skipped
+    source = select(metadata.lng, metadata.lat, metadata.heading, metadata.timestamp, DEDUP_SPACING) \
+             if DEDUP_SPACING else np.arange(len(metadata))
+    processed = {}
 
     # inference loop
     for i in tqdm(metadata.index):
         row = metadata.iloc[i]
 
-        lng = row.lng
-        lat = row.lat
+        if source[i] != i:
+            continue
 
         fname = row.filename_dump
         
         # get image
         new_entry = False
-        per_image = {'height_l':np.nan, 'height_r':np.nan}
-        
-        for side in ['l', 'r']:
-            try:
-                name = f'{fname}-{side}.jpg'
-                img = plt.imread(os.path.join(PATH_IMAGE_DIR, name))
+        per_image = {'height_l':np.nan, 'height_r':np.nan, 'fence_degrees':np.nan, 'quay_l':np.nan, 'quay_r':np.nan}
+
+        if MODE == 'panorama':
+            fpath = os.path.join(PATH_PANORAMA_DIR, f'{fname}-equirectangular-panorama_8000.jpg')
+
+            # crop windows depend on the heading
+            predict = lambda: predict_panorama_heights(model_fence, fpath, row.heading, batch_size,
+                                                       preprocessing=preprocessing_fence)
+            result = cached(cache, fpath, predict, row.heading, archive=archive, entry=(fname, 'panorama'))
+
+            if result is not None:
+                new_entry = True
+                per_image.update(result)
+        else:
+            for side in ['l', 'r']:
+                fpath = os.path.join(PATH_IMAGE_DIR, f'{fname}-{side}.jpg')
+                predict = lambda: predict_crop(model_fence, model_quay, fpath, preprocessing_fence, preprocessing_quay)
+                result = cached(cache, fpath, predict, archive=archive, entry=(fname, side))
+
+                if result is None:
+                    continue
+
                 new_entry = True
-            except:
-                continue
-            
-            x = img.transpose(2, 0, 1).astype('float32')
-            x = torch.as_tensor(x).unsqueeze(0).cuda()
-            
-            # predict
-            with torch.no_grad():
-                y = model_fence(x)
-            
-            # to np array
-            y = y.squeeze().cpu().numpy() > .5
-            
-            # visualize(x=img, y=y)
-            coords = np.asarray(np.where(y == 1)).T
-            ys, xs = coords[:, 0], coords[:, 1]
-            height = 0
-
-            if len(coords) > 0:
-                sorted_by_min_y = coords[coords[:, 0].argsort()[::-1]]
-                max_y = sorted_by_min_y[0][0]
-                
-                sub_ys = sorted_by_min_y[:, 0]
-                sub_xs = sorted_by_min_y[:, 1]
-                
-                y_range = sub_ys[sub_ys > (max_y - 50)]
-                x_range = sub_xs[sub_ys > (max_y - 50)]
-                
-                min_y = y_range.min()
-                min_x = x_range.min()
-                max_x = x_range.max()
-                
-                # print('min_y', min_y)
-                # print('max_y', max_y)
-                
-                # print('min_x', min_x)
-                # print('max_x', max_x)
-                # print('\n')
-                sample_range = np.arange(min_x, max_x)
-
-                if len(sample_range) > 20:
-                    samples = np.random.choice(sample_range, 20)
-                
-                    for j, sample in enumerate(samples):
-                        ys_per_x = coords[xs == sample, 0]
-                        
-                        if len(ys_per_x) >= 1:
-                            height_per_x = abs(ys_per_x.min() - max_y)
-                            height += height_per_x
-                        else:
-                            height += 1
-
-                    height /= (j + 1)
-            
-                    # print('est. height', height)
-            
-            per_image[f'height_{side}'] = height
-            
+                per_image[f'height_{side}'] = result['height']
+                per_image[f'quay_{side}'] = result['quay']
+
         # save results
         if new_entry:
-            results['fname'].append(f'{fname}-equirectangular-panorama_8000.jpg')
-            results['timestamp'].append(row.timestamp)
-            results['height_l'].append(per_image['height_l'])
-            results['height_r'].append(per_image['height_r'])
-            results['geometry'].append(Point(lng, lat))
+            processed[i] = per_image
+            add_result(results, row, per_image, fname)
         
         if i == n:
             break
 
+    if cache:
+        print(cache.summary())
+        cache.close()
+
+    if archive is not None:
+        print(f'{len(archive)} masks in {PATH_ARCHIVE_FILE}')
+        archive.close()
+
+    # skipped panoramas inherit the results of their processed neighbour
+    for i in np.flatnonzero(source != np.arange(len(source))):
+        if source[i] in processed:
+            add_result(results, metadata.iloc[i], processed[source[i]], metadata.filename_dump.iloc[source[i]])
+
+    # geopandas and shapely are only needed to write the results
+    import geopandas as gpd
+    from shapely.geometry import Point
+
+    results['geometry'] = [Point(lng, lat) for lng, lat in results['geometry']]
+
     gdf = gpd.GeoDataFrame(results)
     gdf.to_file(PATH_SAVE_FILE, driver='GeoJSON') 
\ No newline at end of file
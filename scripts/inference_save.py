@@ -4,15 +4,18 @@ import torch
 
 import numpy as np
 import pandas as pd
-import geopandas as gpd
 import matplotlib.pyplot as plt
 
 from tqdm import tqdm
-from shapely.geometry import Point, Polygon
+from functools import partial
+from collections import deque
+from multiprocessing import Pool
 
 # relative imports
 sys.path.insert(0, '..')
 from utils.general import visualize
+from utils.checkpoint import load_model, load_preprocessing
+from utils.render import render_file, SheetWriter, LAYOUTS, THUMBNAIL_WIDTH
 
 # figsize
 plt.rcParams["figure.figsize"] = (10, 5)
@@ -25,22 +28,74 @@ PATH_MODEL_FENCE = os.path.join('..', 'experiments', 'fences', 'effnetb5-unetpp-
 PATH_MODEL_QUAY = None
 
 PATH_SAVE_FILE = os.path.join('..', 'data', 'images-masks')
+PATH_SHEET_DIR = os.path.join('..', 'data', 'images-masks-sheets')
 
-# load fence and quay models
-model_fence = torch.load(PATH_MODEL_FENCE)
-model_quay = None
+# 'overlay' blends the mask into the image, 'side' puts them next to each other, both rendered with numpy and cv2
+# by worker processes, 'figure' is the matplotlib figure of image and mask
+LAYOUT = 'overlay'
+EXTENSION = 'png' # 'jpg' encodes several times faster but is lossy
+WORKERS = 4 # 0 renders in the inference process
+MAX_PENDING = 64 # rendered crops waiting for a worker, bounds memory
 
-# debug limit
-n = np.inf
+# contact sheets of 4x4 thumbnails for quick review, None disables them
+SHEETS = True
 
-# load datadump metadata
-metadata = pd.read_csv(PATH_META_FILE)
 
-# change column to match image names
-f = lambda x: x.replace('-equirectangular-panorama_8000.jpg', '')
-metadata.filename_dump = metadata.filename_dump.apply(f)
+def save_figure(fpath, img, y):
+    """ matplotlib figure of the image and mask
+    """
+    f, (ax1, ax2) = plt.subplots(1, 2)
+
+    ax1.imshow(img)
+    ax2.imshow(y)
+
+    ax1.axis('off')
+    ax2.axis('off')
+
+    plt.tight_layout()
+    plt.savefig(fpath, dpi=96)
+    plt.close(f)
+
+
+def collect(result, sheets):
+    """ add the thumbnail of a written rendering to the contact sheets
+    """
+    fpath, thumbnail = result
+
+    if sheets:
+        sheets.add(thumbnail, os.path.splitext(os.path.basename(fpath))[0])
+
 
 if __name__ == '__main__':
+    # load fence and quay models
+    model_fence = load_model(PATH_MODEL_FENCE, map_location='cuda')
+    model_quay = None
+
+    # encoder normalization the model was trained with, applied on the device
+    preprocessing = load_preprocessing(PATH_MODEL_FENCE)
+
+    if LAYOUT not in LAYOUTS + ['figure']:
+        raise ValueError(f'unknown layout {LAYOUT}, choose from {LAYOUTS + ["figure"]}')
+
+    os.makedirs(PATH_SAVE_FILE, exist_ok=True)
+
+    sheets = SheetWriter(PATH_SHEET_DIR) if SHEETS and LAYOUT != 'figure' else None
+    # plt.imread reads jpg crops as uint8 and png crops as floats in [0, 1]
+    fn = partial(render_file, layout=LAYOUT, width=THUMBNAIL_WIDTH if sheets else None, max_value=1.)
+
+    pool = Pool(WORKERS) if WORKERS and LAYOUT != 'figure' else None
+    pending = deque()
+
+    # debug limit
+    n = np.inf
+
+    # load datadump metadata
+    metadata = pd.read_csv(PATH_META_FILE)
+
+    # change column to match image names
+    f = lambda x: x.replace('-equirectangular-panorama_8000.jpg', '')
+    metadata.filename_dump = metadata.filename_dump.apply(f)
+
     # inference loop
     for i in tqdm(metadata.index):
         row = metadata.iloc[i]
@@ -62,24 +117,43 @@ if __name__ == '__main__':
             except:
                 continue
 
-            x = img.transpose(2, 0, 1).astype('float32')
-            x = torch.as_tensor(x).unsqueeze(0).cuda()
+            # uint8 copy to the device, converted there
+            x = torch.as_tensor(np.ascontiguousarray(img.transpose(2, 0, 1))).unsqueeze(0).cuda()
 
             # predict
             with torch.no_grad():
-                y = model_fence(x)
-
-            # to np array
-            y = y.squeeze().cpu().numpy() > .5
-            
-            f, (ax1, ax2) = plt.subplots(1, 2)
-            
-            ax1.imshow(img)
-            ax2.imshow(y)
-            
-            ax1.axis('off')
-            ax2.axis('off')
-            
-            plt.tight_layout()
-            plt.savefig(os.path.join(PATH_SAVE_FILE, f'{lng}-{lat}-{side}.png'), dpi=96)
-            plt.close(f)
\ No newline at end of file
+                y = model_fence(preprocessing(x))
+
+            # to np array, the fence channel
+            y = y[0, 0].cpu().numpy() > .5
+
+            fpath = os.path.join(PATH_SAVE_FILE, f'{lng}-{lat}-{side}.{EXTENSION}')
+
+            if LAYOUT == 'figure':
+                save_figure(fpath, img, y)
+                continue
+
+            job = (fpath, img, y)
+
+            if pool is None:
+                collect(fn(job), sheets)
+                continue
+
+            pending.append(pool.apply_async(fn, (job,)))
+
+            while len(pending) > MAX_PENDING:
+                collect(pending.popleft().get(), sheets)
+
+        if i == n:
+            break
+
+    # ordered results keep the contact sheets deterministic
+    while pending:
+        collect(pending.popleft().get(), sheets)
+
+    if pool:
+        pool.close()
+        pool.join()
+
+    if sheets:
+        sheets.flush()
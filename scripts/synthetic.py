@@ -0,0 +1,288 @@
+import os
+import sys
+import cv2
+import csv
+import argparse
+
+import numpy as np
+
+from tqdm import tqdm
+from functools import partial
+from multiprocessing import Pool
+from xml.sax.saxutils import quoteattr
+
+sys.path.insert(0, '..')
+from utils.coco import COCOWriter
+from utils import rle as rlecodec
+from utils.synthetic import *
+
+
+# synthetic data save directory, mirrors the layout of ../data
+SAVE = os.path.join('..', 'data', 'synthetic')
+
+# generation details
+NUMBER = 100 # number of panoramas, each yields a left and right crop
+SEED = 0
+BATCHES = 2 # number of CVAT annotation exports
+DENSITY = .5 # fraction of crops containing fences
+COMPRESSED = True # store fence counts as compressed RLE strings, as scripts/cvat2coco.py
+
+# geographic subsets by capture route, used for masks-{subset}
+SUBSETS = ['train'] * 8 + ['valid', 'test']
+
+CATEGORIES = [{'id': 1, 'name': 'Quay', 'supercategory': ''},
+              {'id': 2, 'name': 'Fence', 'supercategory': ''}]
+
+
+def get_paths(save):
+    """ output paths following the original data directory layout
+    """
+    panoramas = os.path.join(save, '15000-water-images')
+    annotations = os.path.join(save, 'fences-quays', 'annotations')
+
+    return {
+        'panoramas': os.path.join(panoramas, 'water_images_2'),
+        'panorama_meta': [os.path.join(panoramas, 'metadata_with_new_filenames.csv'),
+                          os.path.join(panoramas, 'metadata.csv')],
+        'images': os.path.join(save, 'images'),
+        'image_meta': os.path.join(save, 'images', 'metadata.csv'),
+        'annotated_meta': os.path.join(save, 'fences-quays', 'metadata.csv'),
+        'xml': os.path.join(annotations, 'xml'),
+        'json': os.path.join(annotations, 'batch-json'),
+        'masks': os.path.join(save, 'polygon-fences'),
+    }
+
+
+def generate(index, seed, paths, panoramas=True, images=True, masks=True, density=DENSITY):
+    """ generate and write one panorama and its crops, return annotations
+    """
+    metadata = make_metadata(seed, index)
+    name = metadata['filename_dump'].replace('-equirectangular-panorama_8000.jpg', '')
+    subset = SUBSETS[(index // ROUTE_LENGTH) % len(SUBSETS)]
+
+    if panoramas:
+        panorama, crops = make_panorama(seed, index, metadata=metadata, density=density)
+        cv2.imwrite(os.path.join(paths['panoramas'], metadata['filename_dump']), panorama[..., ::-1])
+    else:
+        crops = [make_crop(seed, index, i, density=density, render=images) for i in range(len(SIDES))]
+
+    records = []
+    for side, center, (crop, fences, quays) in zip(SIDES, crop_centers(metadata['heading']), crops):
+        fname = f'{name}-{side}.jpg'
+
+        if images:
+            cv2.imwrite(os.path.join(paths['images'], fname), crop[..., ::-1])
+
+        # one blob per fence polyline, as converted by cvat2coco.py
+        blobs = [fence_mask([fence]) for fence in fences]
+
+        if masks:
+            union = np.zeros((HEIGHT, WIDTH, 1), dtype=np.uint8)
+            for blob in blobs:
+                union[..., 0] |= blob
+
+            with open(os.path.join(paths['masks'], f'masks-{subset}', fname.replace('.jpg', '.npy')), 'wb') as f:
+                np.save(f, union)
+
+        records.append({
+            'name': name,
+            'side': side,
+            'fname': fname,
+            'bbox': [HORIZON + HEIGHT // 2, center - WIDTH // 2, WIDTH, HEIGHT],
+            'fences': fences,
+            'quays': quays,
+            'rles': rlecodec.encode_batch(blobs, compressed=COMPRESSED) if blobs else [],
+            'areas': [float(cv2.countNonZero(blob)) for blob in blobs],
+            'bboxes': [[float(v) for v in cv2.boundingRect(blob)] for blob in blobs],
+        })
+
+    return metadata, records
+
+
+def points_to_str(points):
+    """"""
+    return ';'.join(f'{x:.2f},{y:.2f}' for x, y in points)
+
+
+def write_xml_header(f, size):
+    """"""
+    labels = ''.join(f'<label><name>{c["name"]}</name><attributes></attributes></label>' for c in CATEGORIES)
+
+    f.write('<?xml version="1.0" encoding="utf-8"?>\n<annotations>\n')
+    f.write('  <version>1.1</version>\n')
+    f.write(f'  <meta><task><name>synthetic</name><size>{size}</size><labels>{labels}</labels></task></meta>\n')
+
+
+def write_xml_image(f, image_id, record):
+    """"""
+    f.write(f'  <image id="{image_id}" name={quoteattr(record["fname"])} width="{WIDTH}" height="{HEIGHT}">\n')
+
+    for quay in record['quays']:
+        f.write(f'    <polygon label="Quay" occluded="0" source="manual" points="{points_to_str(quay)}" z_order="0">\n')
+        f.write('      <attribute name="Class">Quay</attribute>\n    </polygon>\n')
+
+    for fence in record['fences']:
+        f.write(f'    <polyline label="Fence" occluded="0" source="manual" points="{points_to_str(fence)}" z_order="0">\n')
+        f.write('      <attribute name="Class">Fence</attribute>\n    </polyline>\n')
+
+    f.write('  </image>\n')
+
+
+def polygon_area(points):
+    """ shoelace formula
+    """
+    x, y = points[:, 0], points[:, 1]
+    return float(abs(np.dot(x, np.roll(y, 1)) - np.dot(y, np.roll(x, 1))) / 2)
+
+
+def to_coco(image_id, annotation_id, record):
+    """ COCO image and annotations with RLE fence counts
+    """
+    image = {
+        'id': image_id,
+        'width': WIDTH,
+        'height': HEIGHT,
+        'file_name': record['fname'],
+        'flickr_url': '',
+        'coco_url': '',
+        'date_captured': 0,
+    }
+
+    annotations = []
+
+    for quay in record['quays']:
+        x, y = quay.min(axis=0)
+        w, h = quay.max(axis=0) - quay.min(axis=0)
+
+        annotations.append({
+            'id': annotation_id,
+            'image_id': image_id,
+            'category_id': 1,
+            'segmentation': [quay.flatten().tolist()],
+            'area': polygon_area(quay),
+            'bbox': [float(x), float(y), float(w), float(h)],
+            'iscrowd': 0,
+            'attributes': {'Class': 'Quay'},
+        })
+        annotation_id += 1
+
+    for rle, area, bbox in zip(record['rles'], record['areas'], record['bboxes']):
+        annotations.append({
+            'id': annotation_id,
+            'image_id': image_id,
+            'category_id': 2,
+            'counts': rle,
+            'area': area,
+            'bbox': bbox,
+            'iscrowd': 0,
+            'attributes': {'Class': 'Fence'},
+        })
+        annotation_id += 1
+
+    return image, annotations
+
+
+def write_dataset(save=SAVE, number=NUMBER, seed=SEED, batches=BATCHES, density=DENSITY,
+                  workers=1, panoramas=True, images=True, masks=True, verbose=True):
+    """ generate and write a full synthetic dataset, return the output paths
+    """
+    paths = get_paths(save)
+
+    for key in ['panoramas', 'images', 'xml', 'json']:
+        os.makedirs(paths[key], exist_ok=True)
+    for subset in set(SUBSETS):
+        os.makedirs(os.path.join(paths['masks'], f'masks-{subset}'), exist_ok=True)
+
+    # crops are divided over contiguous annotation batches, each with ids starting at 0
+    n_crops = number * len(SIDES)
+    batch_size = -(-n_crops // batches)
+
+    xmls, cocos = [], []
+    for i in range(batches):
+        size = min(batch_size, n_crops - i * batch_size)
+
+        xmls.append(open(os.path.join(paths['xml'], f'annotations-{i + 1}.xml'), 'w'))
+        write_xml_header(xmls[i], size)
+
+        fname = f'annotations-{i + 1}-{PIXELS}px-blobs.json'
+        cocos.append(COCOWriter(os.path.join(paths['json'], fname),
+                                licenses=[{'name': '', 'id': 0, 'url': ''}],
+                                info={'contributor': 'synthetic', 'date_created': '', 'url': '',
+                                      'version': '', 'year': 2022, 'seed': seed},
+                                categories=CATEGORIES))
+
+    # metadata csvs
+    meta_files = [open(fpath, 'w', newline='') for fpath in paths['panorama_meta'] + [paths['image_meta'], paths['annotated_meta']]]
+    meta_writers = [csv.writer(f) for f in meta_files]
+    keys = list(make_metadata(seed, 0).keys())
+
+    for writer in meta_writers[:2]:
+        writer.writerow(keys)
+    meta_writers[2].writerow(['filename', 'bbox'] + keys)
+    meta_writers[3].writerow(['filename'] + keys)
+
+    fn = partial(generate, seed=seed, paths=paths, panoramas=panoramas, images=images, masks=masks, density=density)
+
+    annotation_ids = [0] * batches
+    k = 0
+
+    try:
+        with Pool(workers) as pool:
+            # ordered results keep the output deterministic for any number of workers
+            for metadata, records in tqdm(pool.imap(fn, range(number), chunksize=8), total=number,
+                                          disable=not verbose):
+                values = list(metadata.values())
+
+                for writer in meta_writers[:2]:
+                    writer.writerow(values)
+
+                for record in records:
+                    batch, image_id = divmod(k, batch_size)
+
+                    write_xml_image(xmls[batch], image_id, record)
+
+                    image, annotations = to_coco(image_id, annotation_ids[batch], record)
+                    annotation_ids[batch] += len(annotations)
+
+                    cocos[batch].add_image(image)
+                    for annotation in annotations:
+                        cocos[batch].add_annotation(annotation)
+
+                    meta_writers[2].writerow([f'{record["name"]}_{record["side"]}', str(record['bbox'])] + values)
+                    meta_writers[3].writerow([record['fname']] + values)
+
+                    k += 1
+    except BaseException:
+        # no spooled annotations are left behind
+        for coco in cocos:
+            coco.abort()
+        raise
+
+    for f in xmls:
+        f.write('</annotations>\n')
+        f.close()
+
+    for coco in cocos:
+        coco.close()
+
+    for f in meta_files:
+        f.close()
+
+    return paths
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='generate a synthetic fence dataset')
+    parser.add_argument('--number', type=int, default=NUMBER, help='number of panoramas (2 crops each)')
+    parser.add_argument('--seed', type=int, default=SEED)
+    parser.add_argument('--batches', type=int, default=BATCHES, help='number of CVAT/COCO annotation batches')
+    parser.add_argument('--density', type=float, default=DENSITY, help='fraction of crops with fences')
+    parser.add_argument('--save', type=str, default=SAVE)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--no-panoramas', action='store_true', help='skip 8000x4000 panoramas')
+    parser.add_argument('--no-images', action='store_true', help='skip crop images (annotations only)')
+    parser.add_argument('--no-masks', action='store_true', help='skip masks-{subset}/*.npy')
+    args = parser.parse_args()
+
+    write_dataset(save=args.save, number=args.number, seed=args.seed, batches=args.batches, density=args.density,
+                  workers=args.workers, panoramas=not args.no_panoramas, images=not args.no_images, masks=not args.no_masks)
@@ -0,0 +1,156 @@
+import zlib
+import sqlite3
+
+import numpy as np
+
+from . import rle
+
+
+COMMIT_EVERY = 256 # masks written per transaction
+LEVELS = 255 # probabilities are quantized to uint8
+
+
+def bbox(mask):
+    """ COCO [x, y, width, height] of the positive pixels, zeros for an empty mask
+    """
+    rows, cols = np.flatnonzero(mask.any(axis=1)), np.flatnonzero(mask.any(axis=0))
+
+    if len(rows) == 0:
+        return [0, 0, 0, 0]
+
+    return [int(cols[0]), int(rows[0]), int(cols[-1] - cols[0] + 1), int(rows[-1] - rows[0] + 1)]
+
+
+def quantize(probs):
+    """"""
+    return np.round(np.clip(probs, 0, 1) * LEVELS).astype('uint8')
+
+
+def dequantize(probs):
+    """"""
+    return probs.astype('float32') / LEVELS
+
+
+class MaskArchive():
+    """ thresholded masks, and optionally quantized probabilities, of every prediction of one model in a single
+        sqlite file, keyed by filename and side, masks are stored as the compressed RLE of their bounding box,
+        probabilities within the bounding box of the non-zero quantized values
+    """
+
+    def __init__(self, fpath, model=None, readonly=False):
+        self.db = sqlite3.connect(f'file:{fpath}?mode=ro', uri=True) if readonly else sqlite3.connect(fpath)
+        self.pending = 0
+
+        if not readonly:
+            # without rowid the table is clustered on its key, range scans read consecutive pages
+            self.db.execute('CREATE TABLE IF NOT EXISTS masks (fname TEXT, side TEXT, height INTEGER, width INTEGER, '
+                            'x INTEGER, y INTEGER, w INTEGER, h INTEGER, area INTEGER, counts TEXT, '
+                            'px INTEGER, py INTEGER, pw INTEGER, ph INTEGER, probs BLOB, '
+                            'PRIMARY KEY (fname, side)) WITHOUT ROWID')
+            self.db.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+            self.db.commit()
+
+        stored = self.db.execute("SELECT value FROM meta WHERE key = 'model'").fetchone()
+
+        # masks of different models are never mixed
+        if stored and model and stored[0] != model:
+            raise ValueError(f'{fpath} holds the masks of another model, use a new archive')
+
+        self.model = stored[0] if stored else model
+
+        if not stored and model and not readonly:
+            self.db.execute("INSERT INTO meta VALUES ('model', ?)", (model,))
+            self.db.commit()
+
+
+    def put(self, fname, side, mask, probs=None):
+        """ store the mask and optionally its probabilities, replacing an earlier entry
+        """
+        mask = np.asarray(mask, dtype=bool)
+        x, y, w, h = bbox(mask)
+        window = mask[y:y + h, x:x + w]
+
+        counts = rle.encode(window, compressed=True)['counts']
+        pbox, blob = [None] * 4, None
+
+        if probs is not None:
+            probs = quantize(probs)
+            pbox = bbox(probs > 0)
+            px, py, pw, ph = pbox
+            blob = zlib.compress(probs[py:py + ph, px:px + pw].tobytes())
+
+        self.db.execute('INSERT OR REPLACE INTO masks VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                        (fname, side, *mask.shape, x, y, w, h, int(window.sum()), counts, *pbox, blob))
+
+        self.pending += 1
+
+        if self.pending >= COMMIT_EVERY:
+            self.commit()
+
+
+    def get(self, fname, side, masks=True, probabilities=False):
+        """ entry of a filename and side, None when missing
+        """
+        row = self.db.execute('SELECT * FROM masks WHERE fname = ? AND side = ?', (fname, side)).fetchone()
+
+        return self.to_entry(row, masks, probabilities) if row else None
+
+
+    def scan(self, start=None, stop=None, side=None, masks=True, probabilities=False):
+        """ entries with filenames in [start, stop) in key order, without masks only the bounding boxes and areas
+            are read
+        """
+        query, values = 'SELECT * FROM masks WHERE 1', []
+
+        for condition, value in [('fname >= ?', start), ('fname < ?', stop), ('side = ?', side)]:
+            if value is not None:
+                query += f' AND {condition}'
+                values.append(value)
+
+        for row in self.db.execute(query + ' ORDER BY fname, side', values):
+            yield self.to_entry(row, masks, probabilities)
+
+
+    def to_entry(self, row, masks=True, probabilities=False):
+        """ entry of a row, masks and probabilities are decoded to the full prediction size
+        """
+        fname, side, height, width, x, y, w, h, area, counts, px, py, pw, ph, probs = row
+        entry = {'fname': fname, 'side': side, 'size': [height, width], 'bbox': [x, y, w, h], 'area': area}
+
+        if masks:
+            entry['mask'] = np.zeros((height, width), dtype=bool)
+
+            if area:
+                entry['mask'][y:y + h, x:x + w] = rle.decode({'counts': counts, 'size': [h, w]})
+
+        if probabilities:
+            entry['probs'] = None
+
+            if probs is not None:
+                entry['probs'] = np.zeros((height, width), dtype='float32')
+                window = np.frombuffer(zlib.decompress(probs), dtype='uint8').reshape(ph, pw)
+                entry['probs'][py:py + ph, px:px + pw] = dequantize(window)
+
+        return entry
+
+
+    def __contains__(self, key):
+        """"""
+        return self.db.execute('SELECT 1 FROM masks WHERE fname = ? AND side = ?', key).fetchone() is not None
+
+
+    def __len__(self):
+        """"""
+        return self.db.execute('SELECT COUNT(*) FROM masks').fetchone()[0]
+
+
+    def commit(self):
+        """"""
+        self.db.commit()
+        self.pending = 0
+
+
+    def close(self):
+        """"""
+        self.commit()
+        self.db.close()
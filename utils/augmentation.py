@@ -1,5 +1,7 @@
 import cv2
 
+import torch
+
 import numpy as np
 import albumentations as A
 
@@ -12,6 +14,15 @@ def to_tensor(x, **kwargs):
     return x.transpose(2, 0, 1).astype('float32')
 
 
+def to_uint8_tensor(x, **kwargs):
+    """ channels first uint8 image or mask, converted to float on the device, see BatchPreprocessing
+    """
+    if x.dtype != np.uint8:
+        x = np.clip(np.round(x), 0, 255).astype('uint8')
+
+    return np.ascontiguousarray(x.transpose(2, 0, 1))
+
+
 def to_rolled(x, **kwargs):
     """ roll image along horizontal axis
     """
@@ -29,6 +40,53 @@ def get_preprocessing(preprocessing_fn=None):
     return A.Compose(_transform)
 
 
+def get_uint8_preprocessing():
+    """ channels first uint8 images and masks, a quarter of the bytes of float32 through workers and copies,
+        encoder preprocessing is left to BatchPreprocessing
+    """
+    return A.Compose([A.Lambda(image=to_uint8_tensor, mask=to_uint8_tensor)])
+
+
+class BatchPreprocessing():
+    """ float conversion and encoder preprocessing (as smp get_preprocessing_fn) of (N, C, H, W) batches on their
+        device, without an encoder only the conversion, float batches of the loaders pass unchanged
+    """
+
+    def __init__(self, encoder_name=None, encoder_weights=None):
+        params = {}
+
+        if encoder_name and encoder_weights:
+            import segmentation_models_pytorch as smp
+
+            params = smp.encoders.get_preprocessing_params(encoder_name, encoder_weights)
+
+        self.bgr = params.get('input_space') == 'BGR'
+        self.unit_range = params.get('input_range') is not None and params['input_range'][1] == 1
+
+        self.mean = params.get('mean')
+        self.std = params.get('std')
+
+
+    def __call__(self, x):
+        """"""
+        x = x.float()
+
+        if self.bgr:
+            x = x.flip(1)
+
+        # per image, as the encoder preprocessing of a single image
+        if self.unit_range:
+            x = torch.where(x.amax(dim=(1, 2, 3), keepdim=True) > 1, x / 255, x)
+
+        if self.mean is not None:
+            x = x - torch.as_tensor(self.mean, dtype=x.dtype, device=x.device).view(1, -1, 1, 1)
+
+        if self.std is not None:
+            x = x / torch.as_tensor(self.std, dtype=x.dtype, device=x.device).view(1, -1, 1, 1)
+
+        return x
+
+
 def RandomHorizontalRoll(**kwargs):
     """ roll image random amount of pixels along horizontal axis
     """
@@ -0,0 +1,212 @@
+import os
+import json
+import time
+import torch
+import resource
+import queue
+import itertools
+import multiprocessing
+
+from torch.utils.data import DataLoader
+
+from .profile import memory_usage
+
+
+# probed settings
+BATCH_SIZES = [1, 2, 4, 8, 16, 32, 64]
+WORKERS = [0, 1, 2, 4, 8]
+PREFETCH_FACTORS = [2, 4]
+PIN_MEMORY = [False, True]
+
+MEMORY_FRACTION = .8 # of the gpu memory, or of the available plus used memory on cpu
+HEADROOM = 1.2 # loaders should deliver this many times the images per second the model consumes
+STEPS = 5 # timed steps per probe
+
+
+def memory_budget(device, fraction=MEMORY_FRACTION):
+    """ megabytes a process may use, total gpu memory or available system memory plus what this process uses
+    """
+    device = torch.device(device)
+
+    if device.type == 'cuda':
+        return torch.cuda.get_device_properties(device).total_memory * fraction / 2 ** 20
+
+    with open('/proc/meminfo') as f:
+        available = next(int(line.split()[1]) for line in f if line.startswith('MemAvailable')) / 2 ** 10
+
+    return (available + memory_usage(device)) * fraction
+
+
+def time_steps(step, x, y, device, steps=STEPS):
+    """ seconds per step, after one untimed step, and the peak memory in megabytes
+    """
+    device = torch.device(device)
+    synchronize = torch.cuda.synchronize if device.type == 'cuda' else lambda: None
+
+    if device.type == 'cuda':
+        torch.cuda.reset_peak_memory_stats(device)
+
+    x, y = x.to(device), y.to(device)
+    step(x, y)
+    synchronize()
+
+    start = time.perf_counter()
+    for _ in range(steps):
+        step(x, y)
+    synchronize()
+
+    seconds = (time.perf_counter() - start) / steps
+
+    # peak resident set size of the process, forked probes start from the size of the parent
+    peak = torch.cuda.max_memory_allocated(device) / 2 ** 20 if device.type == 'cuda' else \
+           resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2 ** 10
+
+    return seconds, peak
+
+
+def _forked_probe(results, step, x, y, device, steps):
+    """"""
+    try:
+        results.put(time_steps(step, x, y, device, steps))
+    except RuntimeError as e:
+        results.put(str(e))
+
+
+def probe_batch(step, x, y, device, steps=STEPS):
+    """ seconds per step and peak memory of a batch, None when it does not fit, on cpu in a forked process,
+        so the model is left untouched and the peak memory of every batch size is measured separately
+    """
+    if torch.device(device).type == 'cuda':
+        try:
+            return time_steps(step, x, y, device, steps)
+        except RuntimeError as e:
+            if 'out of memory' not in str(e):
+                raise
+
+            torch.cuda.empty_cache()
+            return None
+
+    context = multiprocessing.get_context('fork')
+    results = context.Queue()
+    process = context.Process(target=_forked_probe, args=(results, step, x, y, device, steps))
+    process.start()
+
+    # the kernel kills a process that runs out of memory, without a result
+    result = None
+    while result is None and (process.is_alive() or not results.empty()):
+        try:
+            result = results.get(timeout=1)
+        except queue.Empty:
+            pass
+
+    process.join()
+
+    return result if isinstance(result, tuple) else None
+
+
+def tune_batch_size(step, dataset, device, budget, sizes=BATCH_SIZES, steps=STEPS):
+    """ largest batch size within the memory budget, with the images per second and peak memory of every
+        probed size, stops at the first size that does not fit
+    """
+    probes = {}
+    best = None
+
+    for size in sizes:
+        x, y = next(iter(DataLoader(dataset, batch_size=size, shuffle=False)))
+
+        # a smaller dataset than the batch size gives a smaller batch
+        if len(x) < size:
+            break
+
+        result = probe_batch(step, x, y, device, steps)
+
+        if result is None or result[1] > budget:
+            probes[size] = {'fits': False, 'peak_memory_mb': result[1] if result else None}
+            break
+
+        seconds, peak = result
+        probes[size] = {'fits': True, 'images_per_sec': size / seconds, 'peak_memory_mb': peak}
+        best = size
+
+    return best, probes
+
+
+def loader_kwargs(num_workers=0, prefetch_factor=None, pin_memory=False, persistent_workers=False):
+    """ DataLoader arguments, prefetching and persistent workers only apply with workers
+    """
+    kwargs = {'num_workers': num_workers, 'pin_memory': pin_memory}
+
+    if num_workers:
+        kwargs['persistent_workers'] = persistent_workers
+
+        if prefetch_factor:
+            kwargs['prefetch_factor'] = prefetch_factor
+
+    return kwargs
+
+
+def loader_throughput(dataset, batch_size, device, batches, shuffle=False, **kwargs):
+    """ images per second of a loader including the transfer to the device, and the seconds to the first batch
+    """
+    device = torch.device(device)
+    loader = DataLoader(dataset, batch_size=batch_size, shuffle=shuffle, drop_last=True, **loader_kwargs(**kwargs))
+    non_blocking = kwargs.get('pin_memory', False)
+
+    start = time.perf_counter()
+    iterator = iter(loader)
+    next(iterator)[0].to(device, non_blocking=non_blocking)
+    first = time.perf_counter()
+
+    n_images = 0
+    for x, y in itertools.islice(iterator, batches):
+        x.to(device, non_blocking=non_blocking), y.to(device, non_blocking=non_blocking)
+        n_images += len(x)
+
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+
+    seconds = time.perf_counter() - first
+
+    return (n_images / seconds if n_images else 0.), first - start
+
+
+def tune_loader(dataset, batch_size, device, required=None, workers=WORKERS, prefetch_factors=PREFETCH_FACTORS,
+                pin_memory=PIN_MEMORY, batches=STEPS, shuffle=False):
+    """ cheapest loader settings delivering the required images per second, the fastest when none does,
+        cheaper means fewer workers, then less prefetching, then no pinned memory
+    """
+    cuda = torch.device(device).type == 'cuda'
+    workers = [n for n in workers if n <= (os.cpu_count() or 1)]
+
+    # batches per worker ahead of time, only with workers, pinned memory only speeds up gpu transfers
+    candidates = [{'num_workers': n, 'prefetch_factor': factor if n else None, 'pin_memory': pin}
+                  for n in workers for factor in (prefetch_factors if n else [None])
+                  for pin in (pin_memory if cuda else [False])]
+
+    probes = []
+    for settings in candidates:
+        images_per_sec, startup = loader_throughput(dataset, batch_size, device, batches, shuffle, **settings)
+        probes.append({**settings, 'images_per_sec': images_per_sec, 'startup_sec': startup})
+
+    # candidates are ordered from cheap to expensive
+    enough = [probe for probe in probes if required is not None and probe['images_per_sec'] >= required * HEADROOM]
+    best = enough[0] if enough else max(probes, key=lambda probe: probe['images_per_sec'])
+
+    return best, probes
+
+
+def save_settings(fpath, device, settings, inference, probes):
+    """ config fields and inference settings recommended for a device, with the measurements they are based on
+    """
+    with open(fpath, 'w') as f:
+        json.dump({'device': torch.device(device).type, 'settings': settings, 'inference': inference,
+                   'probes': probes}, f, indent=2)
+
+
+def load_settings(fpath, device):
+    """ settings file with 'settings' (config fields) and 'inference', None when tuned for another device type
+    """
+    with open(fpath) as f:
+        tuned = json.load(f)
+
+    return tuned if tuned['device'] == torch.device(device).type else None
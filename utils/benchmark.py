@@ -0,0 +1,104 @@
+import os
+import sys
+import json
+import time
+import platform
+import subprocess
+
+import numpy as np
+
+
+def timeit(fn, repeat=5, number=1, warmup=1):
+    """ time a callable, returns per-call statistics in seconds
+    """
+    for _ in range(warmup):
+        fn()
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        times.append((time.perf_counter() - start) / number)
+
+    times = np.array(times)
+
+    return {
+        'median': float(np.median(times)),
+        'mean': float(times.mean()),
+        'std': float(times.std()),
+        'min': float(times.min()),
+        'max': float(times.max()),
+        'repeat': repeat,
+        'number': number,
+    }
+
+
+def get_environment():
+    """ machine and software details stored with every result file
+    """
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ''
+
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': commit,
+        'python': sys.version.split()[0],
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpus': os.cpu_count(),
+    }
+
+
+def save_results(fpath, results):
+    """"""
+    with open(fpath, 'w') as f:
+        json.dump({'environment': get_environment(), 'results': results}, f, indent=2)
+
+
+def load_results(fpath):
+    """"""
+    with open(fpath) as f:
+        return json.load(f)['results']
+
+
+def compare(results, baseline, tolerance=.2, key='median'):
+    """ compare results against a baseline, a ratio above 1 + tolerance is a regression
+    """
+    rows = []
+
+    for name, result in results.items():
+        reference = baseline.get(name)
+
+        if reference is None:
+            rows.append((name, result[key], None, None, 'new'))
+            continue
+
+        ratio = result[key] / reference[key] if reference[key] > 0 else np.inf
+
+        if ratio > 1 + tolerance:
+            status = 'REGRESSION'
+        elif ratio < 1 - tolerance:
+            status = 'faster'
+        else:
+            status = 'ok'
+
+        rows.append((name, result[key], reference[key], ratio, status))
+
+    return rows
+
+
+def format_table(rows):
+    """"""
+    width = max([len(row[0]) for row in rows] + [4])
+    lines = [f'{"name":<{width}}  {"time":>10}  {"baseline":>10}  {"ratio":>6}  status']
+
+    for name, value, reference, ratio, status in rows:
+        reference = f'{reference * 1e3:>8.3f}ms' if reference is not None else f'{"-":>10}'
+        ratio = f'{ratio:>6.2f}' if ratio is not None else f'{"-":>6}'
+        lines.append(f'{name:<{width}}  {value * 1e3:>8.3f}ms  {reference}  {ratio}  {status}')
+
+    return '\n'.join(lines)
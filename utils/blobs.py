@@ -0,0 +1,104 @@
+import cv2
+
+import numpy as np
+
+
+def to_canvas(mask, threshold=.5, blobber=None):
+    """"""
+    # sklearn and scipy are only imported once masks are blobbed
+    if blobber is None:
+        from sklearn.cluster import DBSCAN as blobber
+    from scipy.spatial import ConvexHull
+
+    canvas = np.zeros(mask.shape)
+    contours = []
+
+    # get all positive prediction coordinates
+    coords = np.flip(np.column_stack(np.where(mask > threshold)), axis=1)
+
+    if len(coords) > 10:
+        # use clustering algorithm to find labels per pixel coordinate
+        clustering = blobber(eps=5, min_samples=10).fit(coords)
+        coord_labels = clustering.labels_
+
+        # get non noisy cluster labels
+        labels = np.unique(coord_labels)
+        labels = labels[labels >= 0]
+
+        for label in labels:
+            cluster = coords[coord_labels == label]
+            contour = cluster[ConvexHull(cluster).vertices]
+
+            contours.append(contour)
+
+        canvas = cv2.drawContours(canvas, contours, -1, 1, -1)
+
+    return canvas
+
+
+def to_blobs(mask, threshold=.5, blobber=None, eps=5):
+    """"""
+    # sklearn and scipy are only imported once masks are blobbed
+    if blobber is None:
+        from sklearn.cluster import DBSCAN as blobber
+    from scipy.spatial import ConvexHull
+
+    canvas = np.zeros(mask.shape)
+    contours = []
+
+    # get all positive prediction coordinates
+    coords = np.flip(np.column_stack(np.where(mask > threshold)), axis=1)
+
+    if len(coords) > 0:
+        # use clustering algorithm to find labels per pixel coordinate
+        clustering = blobber(eps=eps, min_samples=10).fit(coords)
+        coord_labels = clustering.labels_
+
+        # get non noisy cluster labels
+        labels = np.unique(coord_labels)
+        labels = labels[labels >= 0]
+
+        for label in labels:
+            cluster = coords[coord_labels == label]
+            try:
+                contour = cluster[ConvexHull(cluster).vertices]
+            except:
+                return canvas, False
+
+            contours.append(contour)
+
+        canvas = cv2.drawContours(canvas, contours, -1, 1, -1)
+
+    return canvas, True
+
+
+def calculate(preds, target, blobbing=True):
+    """"""
+    if blobbing:
+        preds, pred_success = to_blobs(preds)
+        if not pred_success:
+            return 0, False
+
+        target, target_success = to_blobs(target)
+        if not target_success:
+            return 0, False
+
+    union = target + preds
+
+    # change background value of prediction for efficient overlap computation
+    preds[preds == 0] = -1
+
+    # calculate blob overlap
+    overlap = target - preds
+
+    area_of_overlap = np.count_nonzero(overlap == 0)
+    area_of_union = np.count_nonzero(union > 0)
+
+    if area_of_union > 0:
+        blobs_iou = area_of_overlap / area_of_union
+    elif area_of_overlap == 0 and area_of_union == 0:
+        blobs_iou = 1
+    else:
+        blobs_iou = 0
+
+    return blobs_iou, True
@@ -0,0 +1,97 @@
+import os
+import hashlib
+
+import numpy as np
+
+from tqdm import tqdm
+from concurrent.futures import ProcessPoolExecutor
+
+
+class DecodedCache():
+    """ decoded images as .npy files, shared by all runs and data loader workers reading the same data,
+        cached arrays are memory-mapped so concurrent readers share the page cache
+    """
+
+    def __init__(self, dirpath, reader=None):
+        self.dirpath = dirpath
+        self.reader = reader
+
+        os.makedirs(dirpath, exist_ok=True)
+
+
+    def key(self, fpath):
+        """ source path, size and modification time, an updated source is decoded again
+        """
+        stat = os.stat(fpath)
+        source = f'{os.path.abspath(fpath)}:{stat.st_size}:{stat.st_mtime_ns}'
+
+        return hashlib.sha1(source.encode()).hexdigest()[:20]
+
+
+    def path(self, fpath):
+        """"""
+        return os.path.join(self.dirpath, f'{self.key(fpath)}.npy')
+
+
+    def read(self, fpath):
+        """ decode the source file, skimage by default
+        """
+        if self.reader is not None:
+            return self.reader(fpath)
+
+        from skimage import io
+
+        return io.imread(fpath)
+
+
+    def load(self, fpath):
+        """ writable copy of the decoded image, decoded and stored on a miss
+        """
+        cached = self.path(fpath)
+
+        try:
+            return np.array(np.load(cached, mmap_mode='r'))
+        except FileNotFoundError:
+            pass
+
+        image = self.read(fpath)
+        self.store(cached, image)
+
+        return image
+
+
+    def store(self, cached, image):
+        """ concurrent writers of the same image are harmless, the last rename wins
+        """
+        tmp = f'{cached}.{os.getpid()}.tmp'
+
+        with open(tmp, 'wb') as f:
+            np.save(f, image)
+
+        os.replace(tmp, cached)
+
+
+    def warm(self, fpaths, workers=None):
+        """ decode all missing files up front, with a process pool, returns the number decoded
+        """
+        missing = [fpath for fpath in fpaths if not os.path.isfile(self.path(fpath))]
+
+        with ProcessPoolExecutor(workers) as executor:
+            for _ in tqdm(executor.map(self._warm, missing, chunksize=8), total=len(missing), desc='cache'):
+                pass
+
+        return len(missing)
+
+
+    def _warm(self, fpath):
+        """"""
+        self.store(self.path(fpath), self.read(fpath))
+
+
+def get_cache(cache):
+    """ DecodedCache of a directory, None without one
+    """
+    if cache is None or isinstance(cache, DecodedCache):
+        return cache
+
+    return DecodedCache(cache)
@@ -0,0 +1,203 @@
+import os
+import glob
+import queue
+import atexit
+import random
+import shutil
+import threading
+
+import numpy as np
+import torch
+
+
+def get_rng_state():
+    """ python, numpy and torch random states, restoring them continues the same random streams
+    """
+    return {
+        'python': random.getstate(),
+        'numpy': np.random.get_state(),
+        'torch': torch.get_rng_state(),
+        'cuda': torch.cuda.get_rng_state_all() if torch.cuda.is_available() else [],
+    }
+
+
+def set_rng_state(state):
+    """"""
+    random.setstate(state['python'])
+    np.random.set_state(state['numpy'])
+    torch.set_rng_state(state['torch'])
+
+    if state['cuda'] and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state['cuda'])
+
+
+def to_cpu(obj):
+    """ copy of all tensors in a (nested) state dict on the cpu, safe to serialize while training continues
+    """
+    if isinstance(obj, torch.Tensor):
+        return obj.detach().to('cpu', copy=True)
+    elif isinstance(obj, dict):
+        return {key: to_cpu(value) for key, value in obj.items()}
+    elif isinstance(obj, (list, tuple)):
+        return type(obj)(to_cpu(value) for value in obj)
+
+    return obj
+
+
+def save(fpath, state):
+    """ write to a temporary file first, so a killed job never leaves a truncated checkpoint
+    """
+    tmp = f'{fpath}.tmp'
+    torch.save(state, tmp)
+    os.replace(tmp, fpath)
+
+
+def load(fpath, map_location='cpu'):
+    """ checkpoints hold python and numpy random states, which are not plain tensors
+    """
+    try:
+        return torch.load(fpath, map_location=map_location, weights_only=False)
+    except TypeError:
+        # torch < 1.13 has no weights_only argument
+        return torch.load(fpath, map_location=map_location)
+
+
+def load_model(fpath, map_location='cpu'):
+    """ model from a state_dict checkpoint, a pickled model as saved by earlier versions of train.py, or a torchscript model
+    """
+    import segmentation_models_pytorch as smp
+
+    checkpoint = load(fpath, map_location=map_location)
+
+    if isinstance(checkpoint, torch.nn.Module):
+        return checkpoint
+
+    architecture = checkpoint['architecture']
+    tasks = architecture.get('tasks') or [None]
+
+    # multi-task models can have narrower decoders for the tasks after the first
+    channels = architecture.get('task_decoder_channels')
+    narrow = {'decoder_channels': channels} if channels else {}
+    kwargs = [{}] + [narrow] * (len(tasks) - 1)
+
+    models = [getattr(smp, architecture['arch'])(encoder_name=architecture['encoder_name'],
+                                                 encoder_weights=None,
+                                                 classes=architecture['classes'],
+                                                 activation=architecture['activation'],
+                                                 **task_kwargs) for task_kwargs in kwargs]
+    model = models[0]
+
+    if len(models) > 1:
+        from .multitask import MultiTaskModel
+
+        model = MultiTaskModel(models, tasks)
+
+    model.load_state_dict(checkpoint['model'])
+
+    return model.to(map_location)
+
+
+def load_preprocessing(fpath):
+    """ batch preprocessing the model of a checkpoint was trained with, checkpoints of earlier versions of train.py
+        and torchscript models hold no architecture, their inputs are only converted to float
+    """
+    from .augmentation import BatchPreprocessing
+
+    checkpoint = load(fpath)
+    architecture = checkpoint.get('architecture', {}) if isinstance(checkpoint, dict) else {}
+
+    if not architecture.get('preprocessing'):
+        return BatchPreprocessing()
+
+    return BatchPreprocessing(architecture['encoder_name'], architecture['encoder_weights'])
+
+
+class Checkpointer():
+    """ last, best and the last K epoch checkpoints of a run, serialized on a background thread
+    """
+
+    def __init__(self, dirpath, keep=3, last='last_model.pth', best='best_model.pth'):
+        self.dirpath = dirpath
+        self.keep = keep
+
+        self.last = os.path.join(dirpath, last)
+        self.best = os.path.join(dirpath, best)
+        self.epochs = os.path.join(dirpath, 'checkpoints')
+
+        os.makedirs(self.epochs, exist_ok=True)
+
+        # one pending checkpoint at most, a second save waits for the first
+        self.queue = queue.Queue(maxsize=1)
+        self.error = None
+
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+        atexit.register(self.close)
+
+
+    def save(self, state, epoch, is_best=False):
+        """ snapshot the state on the calling thread, serialize it in the background
+        """
+        self._raise()
+        self.queue.put((to_cpu({**state, 'epoch': epoch}), epoch, is_best))
+
+
+    def _run(self):
+        """"""
+        while True:
+            item = self.queue.get()
+
+            if item is None:
+                self.queue.task_done()
+                return
+
+            state, epoch, is_best = item
+
+            try:
+                fpath = os.path.join(self.epochs, f'epoch-{epoch:03d}.pth')
+                save(fpath, state)
+
+                # last and best are copies, so retention never removes them
+                for target in [self.last] + ([self.best] if is_best else []):
+                    shutil.copyfile(fpath, f'{target}.tmp')
+                    os.replace(f'{target}.tmp', target)
+
+                self._prune()
+            except Exception as e:
+                self.error = e
+
+            self.queue.task_done()
+
+
+    def _prune(self):
+        """ keep the last K epoch checkpoints
+        """
+        fpaths = sorted(glob.glob(os.path.join(self.epochs, 'epoch-*.pth')))
+
+        for fpath in fpaths[:max(len(fpaths) - self.keep, 0)]:
+            os.remove(fpath)
+
+
+    def _raise(self):
+        """ surface errors of the background thread on the training thread
+        """
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise RuntimeError('saving checkpoint failed') from error
+
+
+    def wait(self):
+        """ block until all checkpoints are written
+        """
+        self.queue.join()
+        self._raise()
+
+
+    def close(self):
+        """"""
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+
+        self._raise()
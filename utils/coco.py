@@ -0,0 +1,209 @@
+import os
+import json
+
+import numpy as np
+
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+
+class COCOWriter():
+    """ writes a COCO json incrementally, keeping only one annotation in memory
+    """
+
+    def __init__(self, fpath, licenses=None, info=None, categories=None):
+        self.fpath = fpath
+        self.spool = f'{fpath}.annotations'
+
+        self.n_images = 0
+        self.n_annotations = 0
+
+        # images are written in place, annotations are spooled and appended on close
+        self.f = open(self.fpath, 'w')
+        self.f_anns = open(self.spool, 'w')
+
+        self.f.write('{')
+        self.f.write(f'"licenses": {json.dumps(licenses)}, ')
+        self.f.write(f'"info": {json.dumps(info)}, ')
+        self.f.write(f'"categories": {json.dumps(categories)}, ')
+        self.f.write('"images": [')
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, *args):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+    def add_image(self, image):
+        """"""
+        self.f.write((', ' if self.n_images else '') + json.dumps(image))
+        self.n_images += 1
+
+
+    def add_annotation(self, annotation):
+        """"""
+        self.f_anns.write((', ' if self.n_annotations else '') + json.dumps(annotation))
+        self.n_annotations += 1
+
+
+    def close(self):
+        """"""
+        if self.f.closed:
+            return
+
+        self.f_anns.close()
+
+        try:
+            self.f.write('], "annotations": [')
+
+            # append spooled annotations in chunks
+            with open(self.spool) as f:
+                for chunk in iter(lambda: f.read(1 << 20), ''):
+                    self.f.write(chunk)
+
+            self.f.write(']}')
+        finally:
+            self.f.close()
+            os.remove(self.spool)
+
+
+    def abort(self):
+        """ close after an error without finishing the json, the spooled annotations are removed
+        """
+        if self.f.closed:
+            return
+
+        self.f_anns.close()
+        self.f.close()
+
+        os.remove(self.spool)
+
+
+def read_json(fpath):
+    """"""
+    with open(fpath, 'r') as f:
+        data = json.load(f)
+
+    return data
+
+
+def write_json(fpath, data):
+    """"""
+    with open(fpath, 'w') as f:
+        json.dump(data, f)
+
+    return fpath
+
+
+def index_annotations(annotations):
+    """ annotations grouped by image id, in their original order
+    """
+    index = defaultdict(list)
+
+    for annotation in annotations:
+        index[annotation['image_id']].append(annotation)
+
+    return index
+
+
+def reset_ids(images, annotations, images_offset=0, annotations_offset=0):
+    """ consecutive image and annotation ids, annotations follow the order of their images
+    """
+    index = index_annotations(annotations)
+    new_images, new_annotations = [], []
+
+    for i, image in enumerate(images):
+        image_id = i + images_offset
+
+        for annotation in index.get(image['id'], []):
+            new_annotations.append({**annotation,
+                                    'id': len(new_annotations) + annotations_offset,
+                                    'image_id': image_id})
+
+        new_images.append({**image, 'id': image_id})
+
+    return new_images, new_annotations
+
+
+def merge(datasets):
+    """ merge COCO datasets with consecutive ids, meta is taken from the first dataset
+    """
+    images, annotations = [], []
+
+    for dataset in datasets:
+        imgs, anns = reset_ids(dataset['images'], dataset['annotations'],
+                               images_offset=len(images), annotations_offset=len(annotations))
+        images += imgs
+        annotations += anns
+
+    merged = {key: value for key, value in datasets[0].items() if key not in ['images', 'annotations']}
+    merged['images'] = images
+    merged['annotations'] = annotations
+
+    return merged
+
+
+def balanced_groups(counts, limits, seed=None):
+    """ assign groups (e.g. buurtcodes) to subsets in random order, a subset is closed once
+        its number of items exceeds its limit and the last subset takes the remainder
+    """
+    groups = list(counts.items())
+    idxs = list(np.random.RandomState(seed).permutation(len(groups)))
+
+    subsets = [[] for _ in range(len(limits) + 1)]
+    totals = np.zeros(len(subsets))
+    i = 0
+
+    while idxs:
+        group, count = groups[idxs.pop()]
+
+        subsets[i].append(group)
+        totals[i] += count
+
+        if i < len(limits) and totals[i] > limits[i]:
+            i += 1
+
+    return subsets
+
+
+def split(dataset, subsets, names=None):
+    """ split a COCO dataset in one pass over images and annotations,
+        subsets maps file names to subset names, other images are dropped
+    """
+    names = names or dict.fromkeys(subsets.values())
+
+    meta = {key: value for key, value in dataset.items() if key not in ['images', 'annotations']}
+    splits = {name: {**meta, 'images': [], 'annotations': []} for name in names}
+
+    # image id to subset
+    image_subsets = {}
+
+    for image in dataset['images']:
+        name = subsets.get(image['file_name'])
+
+        if name in splits:
+            image_subsets[image['id']] = name
+            splits[name]['images'].append(image)
+
+    for annotation in dataset['annotations']:
+        name = image_subsets.get(annotation['image_id'])
+
+        if name in splits:
+            splits[name]['annotations'].append(annotation)
+
+    return splits
+
+
+def write_all(datasets, workers=None):
+    """ write {fpath: dataset} concurrently, one process per file
+    """
+    workers = workers or min(len(datasets), os.cpu_count()) or 1
+
+    with ProcessPoolExecutor(workers) as executor:
+        return list(executor.map(write_json, datasets.keys(), datasets.values()))
@@ -0,0 +1,103 @@
+import numpy as np
+
+
+# panoramas within SPACING metres of a processed one, facing the same way, are skipped
+SPACING = 10.
+MAX_HEADING_DIFFERENCE = 45. # degrees
+MAX_TIME_DIFFERENCE = None # seconds, panoramas of different captures are never merged when set
+
+# metres per degree, matching utils/synthetic.py
+METRES_PER_LNG = 111320
+METRES_PER_LAT = 110540
+
+NEIGHBOURS = 8 # processed candidates a skipped panorama inherits from, nearest first
+
+
+def to_metres(lng, lat):
+    """ local equirectangular projection of lng/lat degrees to metres, accurate at city scale
+    """
+    lng, lat = np.asarray(lng, dtype='float64'), np.asarray(lat, dtype='float64')
+    lat0 = np.radians(lat.mean())
+
+    return np.stack([(lng - lng.mean()) * METRES_PER_LNG * np.cos(lat0), (lat - lat.mean()) * METRES_PER_LAT], axis=1)
+
+
+def to_seconds(timestamp):
+    """ seconds since the epoch of numbers or datetimes, e.g. '2020-05-08 09:11:24+00:00' in the metadata csv
+    """
+    timestamp = np.asarray(timestamp)
+
+    if np.issubdtype(timestamp.dtype, np.number):
+        return timestamp.astype('float64')
+
+    import pandas as pd
+
+    return pd.to_datetime(timestamp, utc=True).astype('int64').to_numpy() / 1e9
+
+
+def heading_difference(a, b):
+    """ absolute difference of headings in degrees, in [0, 180]
+    """
+    return np.abs((np.asarray(a) - np.asarray(b) + 180) % 360 - 180)
+
+
+def compatible(i, candidates, heading, timestamp, max_heading=MAX_HEADING_DIFFERENCE, max_time=MAX_TIME_DIFFERENCE):
+    """ mask of candidates that show the same view as panorama i
+    """
+    mask = heading_difference(heading[candidates], heading[i]) <= max_heading
+
+    if max_time is not None:
+        mask &= np.abs(timestamp[candidates] - timestamp[i]) <= max_time
+
+    return mask
+
+
+def select(lng, lat, heading, timestamp, spacing=SPACING, max_heading=MAX_HEADING_DIFFERENCE,
+           max_time=MAX_TIME_DIFFERENCE):
+    """ greedy covering subset in capture order, returns the position of the panorama whose results every
+        panorama uses, processed panoramas use their own
+    """
+    from scipy.spatial import cKDTree
+
+    xy = to_metres(lng, lat)
+    heading = np.asarray(heading, dtype='float64')
+    timestamp = to_seconds(timestamp)
+
+    tree = cKDTree(xy)
+    covered = np.zeros(len(xy), dtype=bool)
+    selected = []
+
+    for i in np.argsort(timestamp, kind='stable'):
+        if covered[i]:
+            continue
+
+        selected.append(i)
+
+        neighbours = np.array(tree.query_ball_point(xy[i], spacing), dtype=int)
+        covered[neighbours[compatible(i, neighbours, heading, timestamp, max_heading, max_time)]] = True
+
+    selected = np.array(selected, dtype=int)
+    source = np.full(len(xy), -1, dtype=int)
+    source[selected] = selected
+
+    # skipped panoramas inherit from their nearest compatible processed neighbour within the spacing
+    skipped = np.flatnonzero(source < 0)
+
+    if len(skipped):
+        distances, nearest = cKDTree(xy[selected]).query(xy[skipped], k=min(NEIGHBOURS, len(selected)),
+                                                         distance_upper_bound=spacing)
+        distances, nearest = distances.reshape(len(skipped), -1), nearest.reshape(len(skipped), -1)
+
+        for i, candidates, found in zip(skipped, nearest, np.isfinite(distances)):
+            candidates = selected[candidates[found]]
+            match = candidates[compatible(i, candidates, heading, timestamp, max_heading, max_time)]
+
+            # processed after all without a compatible neighbour among the nearest candidates
+            source[i] = match[0] if len(match) else i
+
+    return source
+
+
+def is_processed(source):
+    """"""
+    return source == np.arange(len(source))
@@ -0,0 +1,148 @@
+import os
+import time
+import subprocess
+
+import torch
+import torch.distributed as dist
+
+from torch.utils.data import DistributedSampler
+from torch.nn.parallel import DistributedDataParallel
+
+
+MASTER_ADDR = '127.0.0.1'
+MASTER_PORT = 29500
+
+
+def is_launched():
+    """ started by launch() or torchrun, which set the process group environment
+    """
+    return 'RANK' in os.environ and 'WORLD_SIZE' in os.environ
+
+
+def is_distributed():
+    """"""
+    return dist.is_available() and dist.is_initialized()
+
+
+def get_rank():
+    """"""
+    return dist.get_rank() if is_distributed() else 0
+
+
+def get_world_size():
+    """"""
+    return dist.get_world_size() if is_distributed() else 1
+
+
+def is_main_process():
+    """ rank 0 logs, prints and saves checkpoints
+    """
+    return get_rank() == 0
+
+
+def launch(argv, nproc, nnodes=1, node_rank=0, master_addr=MASTER_ADDR, master_port=MASTER_PORT, poll_interval=1.):
+    """ run argv in nproc processes on this node, every node of a multi-node run calls this with its own node_rank
+    """
+    world_size = nproc * nnodes
+    processes = []
+
+    for local_rank in range(nproc):
+        env = {
+            **os.environ,
+            'MASTER_ADDR': master_addr,
+            'MASTER_PORT': str(master_port),
+            'WORLD_SIZE': str(world_size),
+            'RANK': str(node_rank * nproc + local_rank),
+            'LOCAL_RANK': str(local_rank),
+            'LOCAL_WORLD_SIZE': str(nproc),
+        }
+        processes.append(subprocess.Popen(argv, env=env))
+
+    # a failed process takes the others down, otherwise they wait forever in the next collective
+    failed = None
+
+    try:
+        while failed is None and any(process.poll() is None for process in processes):
+            failed = next((process for process in processes if process.poll() not in (None, 0)), None)
+            time.sleep(poll_interval)
+    finally:
+        for process in processes:
+            if process.poll() is None:
+                process.terminate()
+
+        for process in processes:
+            process.wait()
+
+    # exit code of the first failure, not of the processes terminated because of it
+    failed = failed or next((process for process in processes if process.returncode != 0), None)
+
+    return failed.returncode if failed else 0
+
+
+def setup(device, backend=None):
+    """ join the process group, returns the device of this process: its own gpu, or the cpu
+    """
+    device = torch.device(device)
+
+    if device.type == 'cuda':
+        device = torch.device('cuda', int(os.environ.get('LOCAL_RANK', 0)))
+        torch.cuda.set_device(device)
+
+    dist.init_process_group(backend or ('nccl' if device.type == 'cuda' else 'gloo'), init_method='env://')
+
+    return device
+
+
+def cleanup():
+    """"""
+    if is_distributed():
+        dist.destroy_process_group()
+
+
+def get_sampler(dataset, shuffle=False, seed=0):
+    """ shard of the dataset for this process, None when not distributed,
+        shards are padded with repeated samples to equal length
+    """
+    if not is_distributed():
+        return None
+
+    return DistributedSampler(dataset, num_replicas=get_world_size(), rank=get_rank(), shuffle=shuffle, seed=seed)
+
+
+def wrap(model, device):
+    """ data parallel model, gradients are all-reduced during the backward pass
+    """
+    device = torch.device(device)
+
+    return DistributedDataParallel(model, device_ids=[device] if device.type == 'cuda' else None)
+
+
+def _reduce_device():
+    """ nccl only reduces gpu tensors, gloo cpu tensors
+    """
+    if dist.get_backend() == 'nccl':
+        return torch.device('cuda', torch.cuda.current_device())
+
+    return torch.device('cpu')
+
+
+def all_reduce_sum(values):
+    """ elementwise sum of a list of numbers over all processes
+    """
+    if not is_distributed():
+        return list(values)
+
+    tensor = torch.tensor([float(value) for value in values], dtype=torch.float64, device=_reduce_device())
+    dist.all_reduce(tensor, op=dist.ReduceOp.SUM)
+
+    return tensor.tolist()
+
+
+def all_reduce_meters(meters):
+    """ means of AverageValueMeters over the batches of all processes, by name
+    """
+    names = list(meters)
+    sums = all_reduce_sum([meters[name].sum for name in names] + [meters[name].n for name in names])
+
+    return {name: total / count if count else float('nan')
+            for name, total, count in zip(names, sums[:len(names)], sums[len(names):])}
@@ -1,9 +1,8 @@
-import matplotlib.pyplot as plt
-
-
 def visualize(**images):
     """ plot images in one row
     """
+    import matplotlib.pyplot as plt
+
     n_images = len(images)
     plt.figure(figsize=(20,8))
 
@@ -0,0 +1,212 @@
+import numpy as np
+
+
+def estimate_height(y, band=50, n_samples=20):
+    """ estimate fence height in pixels from a binary prediction mask
+    """
+    coords = np.asarray(np.where(y == 1)).T
+    xs = coords[:, 1]
+    height = 0
+
+    if len(coords) > 0:
+        sorted_by_min_y = coords[coords[:, 0].argsort()[::-1]]
+        max_y = sorted_by_min_y[0][0]
+
+        sub_ys = sorted_by_min_y[:, 0]
+        sub_xs = sorted_by_min_y[:, 1]
+
+        # horizontal extent of the lowest band of the fence
+        x_range = sub_xs[sub_ys > (max_y - band)]
+
+        min_x = x_range.min()
+        max_x = x_range.max()
+
+        sample_range = np.arange(min_x, max_x)
+
+        if len(sample_range) > n_samples:
+            samples = np.random.choice(sample_range, n_samples)
+
+            for j, sample in enumerate(samples):
+                ys_per_x = coords[xs == sample, 0]
+
+                if len(ys_per_x) >= 1:
+                    height_per_x = abs(ys_per_x.min() - max_y)
+                    height += height_per_x
+                else:
+                    height += 1
+
+            height /= (j + 1)
+
+    return height
+
+
+# full-panorama inference, tiles match the training crops, see utils/synthetic.py
+PANORAMA_HORIZON = 2000
+TILE_HEIGHT = 512
+TILE_WIDTH = 1024
+STRIDE = 768 # a quarter overlap, 11 tiles cover 360 degrees of an 8000 pixel wide panorama
+BATCH_SIZE = 4
+
+
+def tile_positions(width, tile_width=TILE_WIDTH, stride=STRIDE):
+    """ left edges of the tiles covering a circular band, tiles past the right edge wrap around the 0/360 degree seam
+    """
+    if stride > tile_width:
+        raise ValueError(f'a stride of {stride} leaves gaps between tiles of width {tile_width}')
+
+    return np.arange(int(np.ceil(width / stride))) * stride
+
+
+def blend_window(tile_width=TILE_WIDTH, blend='hann'):
+    """ per-column weights of a tile, hann weights fade out towards the tile edges where context is missing
+    """
+    if blend == 'mean':
+        return np.ones(tile_width, dtype=np.float32)
+    elif blend == 'hann':
+        # strictly positive, so columns covered by a single tile keep their prediction
+        return np.maximum(np.sin(np.pi * (np.arange(tile_width) + .5) / tile_width), 1e-3).astype(np.float32)
+
+    raise ValueError(f'unknown blend {blend}, use hann or mean')
+
+
+def predict_panorama(model, panorama, horizon=PANORAMA_HORIZON, tile_height=TILE_HEIGHT, tile_width=TILE_WIDTH,
+                     stride=STRIDE, batch_size=BATCH_SIZE, blend='hann', device='cpu', preprocessing=None):
+    """ model outputs over the full horizon band of an equirectangular panorama, (C, tile_height, width),
+        band rows start at horizon - tile_height // 2, overlapping tiles are blended per column, preprocessing
+        converts the tiles, e.g. utils.checkpoint.load_preprocessing
+    """
+    import torch
+
+    height, width = panorama.shape[:2]
+    top = min(max(horizon - tile_height // 2, 0), height - tile_height)
+
+    # the band is moved to the device once, tiles are gathered there with wrap-around column indices
+    band = torch.as_tensor(np.ascontiguousarray(panorama[top:top + tile_height].transpose(2, 0, 1)), device=device)
+
+    positions = torch.as_tensor(tile_positions(width, tile_width, stride), device=device)
+    offsets = torch.arange(tile_width, device=device)
+    window = torch.as_tensor(blend_window(tile_width, blend), device=device)
+
+    output, weights = None, torch.zeros(width, device=device)
+
+    with torch.no_grad():
+        for batch in positions.split(batch_size):
+            cols = (batch[:, None] + offsets) % width
+            tiles = band[:, :, cols].permute(2, 0, 1, 3)
+            tiles = preprocessing(tiles) if preprocessing else tiles.float()
+
+            y = model(tiles).float() * window
+
+            if output is None:
+                output = torch.zeros(y.shape[1], tile_height, width, device=device)
+
+            # columns of different tiles overlap, index_add_ sums them
+            output.index_add_(2, cols.flatten(), y.permute(1, 2, 0, 3).reshape(y.shape[1], tile_height, -1))
+            weights.index_add_(0, cols.flatten(), window.repeat(len(batch)))
+
+    return (output / weights).cpu().numpy()
+
+
+# crops of scripts/split_pan.py are centered on the viewpoints turned by an offset in degrees
+PANORAMA_WIDTH = 8000
+VIEWPOINT_OFFSET = 90
+
+
+def crop_centers(heading, width=PANORAMA_WIDTH):
+    """ horizontal pixel centers of the left and right crops
+    """
+    left = heading - 180 + VIEWPOINT_OFFSET
+    right = heading + VIEWPOINT_OFFSET
+
+    return [int((viewpoint % 360) / 360 * width) for viewpoint in (left, right)]
+
+
+def crop_columns(center, width, tile_width=TILE_WIDTH):
+    """ wrap-around columns of a crop centered on a column, e.g. one of crop_centers
+    """
+    return np.arange(center - tile_width // 2, center + tile_width // 2) % width
+
+
+# cascade inference, a cheap quay model or crop classifier gates the fence model
+GATE_SCALE = .25 # resolution of the gate input
+GATE_THRESHOLD = .5 # quay probability of a pixel, or fence probability of a crop for classifiers
+GATE_MIN_AREA = .002 # fraction of quay pixels for a crop to pass the gate
+GATE_MARGIN = 64 # columns around the quay evidence the fence model sees
+MULTIPLE = 32 # input sizes of the encoders
+
+
+def gate_size(height, width, scale=GATE_SCALE, multiple=MULTIPLE):
+    """ downscaled input size, rounded to a multiple the model accepts
+    """
+    return (max(int(height * scale) // multiple, 1) * multiple,
+            max(int(width * scale) // multiple, 1) * multiple)
+
+
+def gate_columns(evidence, width, min_area=GATE_MIN_AREA, margin=GATE_MARGIN, multiple=MULTIPLE):
+    """ full resolution columns around the evidence of a binary low resolution quay mask, None without evidence,
+        the window width is a multiple the model accepts
+    """
+    if evidence.mean() < min_area:
+        return None
+
+    columns = np.flatnonzero(evidence.any(axis=0)) * width / evidence.shape[1]
+
+    left = max(int(columns.min()) - margin, 0)
+    right = min(int(np.ceil(columns.max() + width / evidence.shape[1])) + margin, width)
+
+    window = min(int(np.ceil((right - left) / multiple)) * multiple, width)
+    left = min(left, width - window)
+
+    return slice(left, left + window)
+
+
+def predict_cascade(fence_model, gate_model, x, scale=GATE_SCALE, threshold=GATE_THRESHOLD, min_area=GATE_MIN_AREA,
+                    margin=GATE_MARGIN, regions=True, preprocessing=None, gate_preprocessing=None):
+    """ fence predictions of a batch, the fence model only runs on crops, or column windows of crops with regions,
+        where the gate finds quays, returns the predictions and the gated column window per crop, None when skipped,
+        preprocessing converts the inputs of the fence and gate models, e.g. utils.checkpoint.load_preprocessing
+    """
+    import torch
+    import torch.nn.functional as F
+
+    height, width = x.shape[-2:]
+
+    # whole crops, as in training, before the fence model sees column windows
+    gate_x = gate_preprocessing(x) if gate_preprocessing else x.float()
+    x = preprocessing(x) if preprocessing else x.float()
+
+    with torch.no_grad():
+        gate = gate_model(F.interpolate(gate_x, size=gate_size(height, width, scale), mode='area')).float().cpu().numpy()
+
+    windows = []
+
+    for score in gate:
+        # segmenters give a quay mask, classifiers a single score per crop
+        if score.size == 1:
+            window = slice(0, width) if score.item() > threshold else None
+        else:
+            window = gate_columns(score[0] > threshold, width, min_area, margin)
+
+            if window is not None and not regions:
+                window = slice(0, width)
+
+        windows.append(window)
+
+    y = None
+
+    with torch.no_grad():
+        for i, window in enumerate(windows):
+            if window is None:
+                continue
+
+            pred = fence_model(x[i:i + 1, :, :, window]).float()
+
+            if y is None:
+                y = torch.zeros(len(x), pred.shape[1], height, width, device=pred.device)
+
+            y[i:i + 1, :, :, window] = pred
+
+    if y is None:
+        y = torch.zeros(len(x), 1, height, width, device=x.device)
+
+    return y, windows
@@ -1,14 +1,85 @@
 import os
 import json
+import time
+import queue
+import atexit
+import threading
 
 import pandas as pd
 
 
+class MetricsSink():
+    """ append-only jsonl log, records are buffered and written by a background thread
+    """
+
+    def __init__(self, fpath, flush_every=100, flush_interval=5.):
+        self.fpath = fpath
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+
+        self.queue = queue.SimpleQueue()
+        self.closed = False
+
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+        # do not lose buffered records when the process exits without closing
+        atexit.register(self.close)
+
+
+    def add(self, **record):
+        """"""
+        record.setdefault('time', time.time())
+        self.queue.put(record)
+
+
+    def _write(self, buffer):
+        """"""
+        if buffer:
+            with open(self.fpath, 'a') as f:
+                f.write(''.join(json.dumps(record, default=float) + '\n' for record in buffer))
+
+        return []
+
+
+    def _run(self):
+        """"""
+        buffer = []
+        last = time.monotonic()
+
+        while True:
+            try:
+                record = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                record = {}
+
+            # None marks the end of the log
+            if record is None:
+                self._write(buffer)
+                return
+
+            if record:
+                buffer.append(record)
+
+            if len(buffer) >= self.flush_every or time.monotonic() - last >= self.flush_interval:
+                buffer = self._write(buffer)
+                last = time.monotonic()
+
+
+    def close(self):
+        """ flush remaining records and stop the writer
+        """
+        if not self.closed:
+            self.closed = True
+            self.queue.put(None)
+            self.thread.join()
+
+
 class TrainLog():
     """ logs all training stats for later use
     """
 
-    def __init__(self, title, dirpath):
+    def __init__(self, title, dirpath, resume=False):
         self.metadata = {}
         self.dataframe = pd.DataFrame()
 
@@ -18,20 +89,34 @@ class TrainLog():
         if not os.path.exists(self.dir):
             os.mkdir(self.dir)
 
-        # create csvs
-        with open(os.path.join(self.dir, 'train-log.csv'), 'w'):
-            pass
-        with open(os.path.join(self.dir, 'valid-log.csv'), 'w'):
-            pass
+        # csvs with a header
+        self.headers = set()
+
+        # create csvs, a resumed run appends to the existing ones
+        for name in ['train', 'valid']:
+            fpath = os.path.join(self.dir, f'{name}-log.csv')
+
+            if resume and os.path.isfile(fpath) and os.path.getsize(fpath):
+                self.headers.add(name)
+            else:
+                with open(fpath, 'w'):
+                    pass
+
+        # per-step and per-epoch records, a new run starts an empty log as the csvs
+        fpath = os.path.join(self.dir, 'metrics.jsonl')
+
+        if not resume:
+            with open(fpath, 'w'):
+                pass
 
-        self.train_counter = 0
-        self.valid_counter = 0
+        self.sink = MetricsSink(fpath)
 
 
     def add_model_data(self, model):
         """"""
         self.metadata['ENCODER_CLASS'] = str(type(model.encoder))
-        self.metadata['DECODER_CLASS'] = str(type(model.decoder))
+        # multi-task models have a decoder per task
+        self.metadata['DECODER_CLASS'] = str(type(model.decoders[0] if hasattr(model, 'decoders') else model.decoder))
 
         return
 
@@ -54,30 +139,36 @@ class TrainLog():
         return
 
 
-    def add_metrics(self, name, **kwargs):
-        """"""
+    def add_metrics(self, name, timings=None, **kwargs):
+        """ epoch row in {name}-log.csv, the jsonl record also holds the epoch timings
+        """
         fname = f'{name}-log.csv'
+        lines = []
 
-        if ((self.train_counter == 0) != (self.valid_counter == 0)) or \
-            (self.train_counter == self.valid_counter == 0):
-            header = ','.join([str(key) for key in kwargs.keys()]) + '\n'
+        if name not in self.headers:
+            lines.append(','.join([str(key) for key in kwargs.keys()]) + '\n')
+            self.headers.add(name)
 
-            with open(os.path.join(self.dir, fname), 'a') as f:
-                f.write(header)
-        
-        row = ','.join([str(val) for val in kwargs.values()]) + '\n'
+        lines.append(','.join([str(val) for val in kwargs.values()]) + '\n')
 
         with open(os.path.join(self.dir, fname), 'a') as f:
-            f.write(row)
+            f.writelines(lines)
 
-        if name == 'train':
-            self.train_counter += 1
-        elif name == 'valid':
-            self.valid_counter += 1
+        self.sink.add(type='epoch', name=name, **kwargs, **(timings or {}))
 
         return
 
 
+    def add_step(self, name, **kwargs):
+        """"""
+        self.sink.add(type='step', name=name, **kwargs)
+
+
+    def close(self):
+        """"""
+        self.sink.close()
+
+
 class TestLog():
     """ logs all testing stats for later use
     """
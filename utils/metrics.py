@@ -1,16 +1,18 @@
-import cv2
-import ray
-import time
 import torch
 
 import numpy as np
 import torch.nn as nn
 
-from tqdm import tqdm
-from sklearn.cluster import DBSCAN, OPTICS
-from torchmetrics import JaccardIndex as JI
-from torchmetrics import ConfusionMatrix as CM
-from scipy.spatial import ConvexHull
+from .blobs import to_canvas, to_blobs, calculate
+
+
+# ray tasks are created on first access, so ray is only imported when blobs are computed in parallel
+REMOTE = {
+    'remote_to_blobs': to_canvas,
+    'remote_calculate': calculate,
+}
+
+_remote = {}
 
 
 # pytorch metrics
@@ -19,19 +21,34 @@ class PositiveIoUScore(nn.Module):
 
     def __init__(self):
         super(PositiveIoUScore, self).__init__()
-        self.metric = JI(num_classes=2, absent_score=1, reduction='none').cuda()
+        from torchmetrics import JaccardIndex as JI
+        self.metric = JI(num_classes=2, absent_score=1, reduction='none')
 
     def forward(self, inputs, targets):
         ious = self.metric(inputs, targets.int())
         return ious[1]
 
 
+class TaskIoUScore(PositiveIoUScore):
+    """ positive IoU of one mask channel of a multi-task model, logged as <task>_iou
+    """
+
+    def __init__(self, channel, task):
+        super(TaskIoUScore, self).__init__()
+        self.channel = channel
+        self.__name__ = f'{task}_iou'
+
+    def forward(self, inputs, targets):
+        return super(TaskIoUScore, self).forward(inputs[:, self.channel], targets[:, self.channel])
+
+
 class NegativeIoUScore(nn.Module):
     __name__ = 'bg_iou'
 
     def __init__(self):
         super(NegativeIoUScore, self).__init__()
-        self.metric = JI(num_classes=2, reduction='none').cuda()
+        from torchmetrics import JaccardIndex as JI
+        self.metric = JI(num_classes=2, reduction='none')
 
     def forward(self, inputs, targets):
         ious = self.metric(inputs, targets.int())
@@ -43,7 +60,8 @@ class TrueNegativeRate(nn.Module):
 
     def __init__(self, normalize=True):
         super(TrueNegativeRate, self).__init__()
-        self.metric = CM(num_classes=2, normalize='true').cuda()
+        from torchmetrics import ConfusionMatrix as CM
+        self.metric = CM(num_classes=2, normalize='true')
     
     def forward(self, inputs, targets):
         cmat = self.metric(inputs, targets.int())
@@ -55,7 +73,8 @@ class FalsePositiveRate(nn.Module):
 
     def __init__(self, normalize=True):
         super(FalsePositiveRate, self).__init__()
-        self.metric = CM(num_classes=2, normalize='true').cuda()
+        from torchmetrics import ConfusionMatrix as CM
+        self.metric = CM(num_classes=2, normalize='true')
     
     def forward(self, inputs, targets):
         cmat = self.metric(inputs, targets.int())
@@ -67,7 +86,8 @@ class FalseNegativeRate(nn.Module):
 
     def __init__(self, normalize=True):
         super(FalseNegativeRate, self).__init__()
-        self.metric = CM(num_classes=2, normalize='true').cuda()
+        from torchmetrics import ConfusionMatrix as CM
+        self.metric = CM(num_classes=2, normalize='true')
     
     def forward(self, inputs, targets):
         cmat = self.metric(inputs, targets.int())
@@ -79,7 +99,8 @@ class TruePositiveRate(nn.Module):
 
     def __init__(self, normalize=True):
         super(TruePositiveRate, self).__init__()
-        self.metric = CM(num_classes=2, normalize='true').cuda()
+        from torchmetrics import ConfusionMatrix as CM
+        self.metric = CM(num_classes=2, normalize='true')
     
     def forward(self, inputs, targets):
         cmat = self.metric(inputs, targets.int())
@@ -87,124 +108,23 @@ class TruePositiveRate(nn.Module):
 
 
 # custom metrics
-@ray.remote
-def remote_to_blobs(mask, threshold=.5, blobber=DBSCAN):
-    """"""
-    canvas = np.zeros(mask.shape)
-    contours = []
-    
-    # get all positive prediction coordinates
-    coords = np.flip(np.column_stack(np.where(mask > threshold)), axis=1)
-    
-    if len(coords) > 10:
-        # use clustering algorithm to find labels per pixel coordinate
-        clustering = blobber(eps=5, min_samples=10).fit(coords)
-        coord_labels = clustering.labels_
-        
-        # get non noisy cluster labels
-        labels = np.unique(coord_labels)
-        labels = labels[labels >= 0]
-        
-        for label in labels:
-            cluster = coords[coord_labels == label]
-            contour = cluster[ConvexHull(cluster).vertices]
-            
-            contours.append(contour)
-    
-        canvas = cv2.drawContours(canvas, contours, -1, 1, -1)
-    
-    return canvas
-
-
-@ray.remote
-def remote_calculate(preds, target, blobbing=True):
-    """"""
-    if blobbing:
-        preds = to_blobs(preds)
-        target = to_blobs(target)
-
-    union = target + preds
-
-    # change background value of prediction for efficient overlap computation
-    preds[preds == 0] = -1
-
-    # calculate blob overlap
-    overlap = target - preds
-
-    area_of_overlap = np.count_nonzero(overlap == 0)
-    area_of_union = np.count_nonzero(union > 0)
-
-    if area_of_union  > 0:
-        blobs_iou = area_of_overlap / area_of_union
-    elif area_of_overlap == 0 and area_of_union == 0:
-        blobs_iou = 1
-    else:
-        blobs_iou = 0
-
-    return blobs_iou
-
-
-def to_blobs(mask, threshold=.5, blobber=DBSCAN, eps=5):
-    """"""
-    canvas = np.zeros(mask.shape)
-    contours = []
-    
-    # get all positive prediction coordinates
-    coords = np.flip(np.column_stack(np.where(mask > threshold)), axis=1)
-    
-    if len(coords) > 0:
-        # use clustering algorithm to find labels per pixel coordinate
-        clustering = blobber(eps=eps, min_samples=10).fit(coords)
-        coord_labels = clustering.labels_
-        
-        # get non noisy cluster labels
-        labels = np.unique(coord_labels)
-        labels = labels[labels >= 0]
-        
-        for label in labels:
-            cluster = coords[coord_labels == label]
-            try:
-                contour = cluster[ConvexHull(cluster).vertices]
-            except:
-                return canvas, False
-            
-            contours.append(contour)
-    
-        canvas = cv2.drawContours(canvas, contours, -1, 1, -1)
-    
-    return canvas, True
-
-
-def calculate(preds, target, blobbing=True):
-    """"""
-    if blobbing:
-        preds, pred_success = to_blobs(preds)
-        if not pred_success:
-            return 0, False
-            
-        target, target_success = to_blobs(target)
-        if not target_success:
-            return 0, False
-
-    union = target + preds
-
-    # change background value of prediction for efficient overlap computation
-    preds[preds == 0] = -1
+def get_remote(name):
+    """ ray task of a blob function, created once
+    """
+    if name not in _remote:
+        import ray
+        _remote[name] = ray.remote(REMOTE[name])
 
-    # calculate blob overlap
-    overlap = target - preds
+    return _remote[name]
 
-    area_of_overlap = np.count_nonzero(overlap == 0)
-    area_of_union = np.count_nonzero(union > 0)
 
-    if area_of_union > 0:
-        blobs_iou = area_of_overlap / area_of_union
-    elif area_of_overlap == 0 and area_of_union == 0:
-        blobs_iou = 1
-    else:
-        blobs_iou = 0
+def __getattr__(name):
+    """ remote_to_blobs and remote_calculate, e.g. `from utils.metrics import remote_to_blobs`
+    """
+    if name not in REMOTE:
+        raise AttributeError(f'module {__name__} has no attribute {name}')
 
-    return blobs_iou, True
+    return get_remote(name)
 
 
 def unravel(batches):
@@ -231,6 +151,7 @@ class BlobOverlap():
         self.count = 0
         
         if num_workers > 1:
+            import ray
             ray.init(num_cpus=num_workers)
 
         self.num_workers = num_workers
@@ -291,6 +212,9 @@ class BlobOverlap():
         order = np.argsort(px_counts)
 
         # parallel blobbing
+        import ray
+        remote_to_blobs = get_remote('remote_to_blobs')
+
         pids = []
         for idx in order:
             pids.append(remote_to_blobs.remote(all_samples[idx]))
@@ -301,7 +225,7 @@ class BlobOverlap():
 
         # calculate mean score
         n = len(all_preds)
-        scores = [calculate(all_blobs[i].copy(), all_blobs[i + n].copy(), blobbing=False) for i in range(n)]
+        scores = [calculate(all_blobs[i].copy(), all_blobs[i + n].copy(), blobbing=False)[0] for i in range(n)]
 
         self.score += sum(scores)
         self.count += n
@@ -0,0 +1,42 @@
+import inspect
+
+import torch
+import torch.nn as nn
+
+
+# mask channels of multi-task datasets and models, in this order
+TASKS = ['fence', 'quay']
+
+
+class MultiTaskModel(nn.Module):
+    """ one encoder shared by a decoder and segmentation head per task, e.g. fences and quays,
+        outputs of the tasks are concatenated along the channels
+    """
+
+    def __init__(self, models, tasks=TASKS):
+        super().__init__()
+
+        if len(models) != len(tasks):
+            raise ValueError(f'{len(models)} models for {len(tasks)} tasks')
+
+        # smp architecture name, to rebuild the model from a checkpoint
+        self.arch = type(models[0]).__name__
+        self.tasks = list(tasks)
+
+        # the encoders of the other models are dropped
+        self.encoder = models[0].encoder
+        self.decoders = nn.ModuleList([model.decoder for model in models])
+        self.heads = nn.ModuleList([model.segmentation_head for model in models])
+
+        # smp < 0.3 decoders take the features as *features, later versions as a list
+        parameters = inspect.signature(models[0].decoder.forward).parameters.values()
+        self.unpacked = any(parameter.kind == parameter.VAR_POSITIONAL for parameter in parameters)
+
+
+    def forward(self, x):
+        """"""
+        features = self.encoder(x)
+
+        return torch.cat([head(decoder(*features) if self.unpacked else decoder(features))
+                          for decoder, head in zip(self.decoders, self.heads)], dim=1)
+
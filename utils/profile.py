@@ -0,0 +1,175 @@
+import os
+import time
+import torch
+import resource
+
+from collections import defaultdict
+from contextlib import contextmanager
+
+
+def memory_usage(device):
+    """ allocated memory on gpu, resident set size on cpu, in megabytes
+    """
+    if torch.device(device).type == 'cuda':
+        return torch.cuda.memory_allocated(device) / 2 ** 20
+
+    # current resident set size is only available on linux, fall back to the peak
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2 ** 10
+
+
+def peak_memory_usage(device):
+    """ peak allocated memory on gpu since the last reset, peak resident set size of the process on cpu, in megabytes
+    """
+    if torch.device(device).type == 'cuda':
+        return torch.cuda.max_memory_allocated(device) / 2 ** 20
+
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2 ** 10
+
+
+class PhaseProfiler():
+    """ per-phase timers, counters and memory high-water marks of an epoch,
+        with an optional torch.profiler trace of a range of steps, the peak memory counters are never reset,
+        so measurements around the profiled epochs (e.g. benchmark in models/train.py) are left intact
+    """
+
+    def __init__(self, name='epoch', device='cpu', trace_steps=None, trace_dir='.'):
+        self.name = name
+        self.device = torch.device(device)
+        self.cuda = self.device.type == 'cuda'
+
+        # [start, stop) range of global steps to trace
+        self.trace_steps = trace_steps
+        self.trace_dir = trace_dir
+        self.trace = None
+
+        self.step = 0
+        self.reset()
+
+
+    def reset(self):
+        """ clear timers and counters, the global step is kept for the trace window
+        """
+        self.times = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.memory = defaultdict(float)
+        self.counters = defaultdict(int)
+
+        self.start = time.perf_counter()
+
+
+    def synchronize(self):
+        """"""
+        if self.cuda:
+            torch.cuda.synchronize(self.device)
+
+
+    @contextmanager
+    def phase(self, name):
+        """ time a phase, gpu work is synchronized so it is attributed to the right phase
+        """
+        self.synchronize()
+
+        peak, usage = peak_memory_usage(self.device), memory_usage(self.device)
+        start = time.perf_counter()
+
+        with torch.profiler.record_function(name):
+            yield
+
+        self.synchronize()
+
+        self.record(name, time.perf_counter() - start)
+
+        # the process peak is the peak of the phase when the phase raised it, otherwise the memory in use at its
+        # start or end is a lower bound, on cpu the resident set size
+        after = peak_memory_usage(self.device)
+        usage = after if after > peak else max(usage, memory_usage(self.device))
+
+        self.memory[name] = max(self.memory[name], usage)
+
+
+    def record(self, name, seconds):
+        """ add an externally timed phase, e.g. waiting on the data loader
+        """
+        self.times[name] += seconds
+        self.calls[name] += 1
+
+
+    def count(self, name, n=1):
+        """"""
+        self.counters[name] += n
+
+
+    def on_step_start(self):
+        """ starts the torch profiler at the start of the trace window
+        """
+        if self.trace_steps and self.step == self.trace_steps[0]:
+            activities = [torch.profiler.ProfilerActivity.CPU]
+
+            if self.cuda:
+                activities.append(torch.profiler.ProfilerActivity.CUDA)
+
+            self.trace = torch.profiler.profile(activities=activities, record_shapes=True, profile_memory=True)
+            self.trace.__enter__()
+
+
+    def on_step_end(self):
+        """ stops the torch profiler and exports a chrome trace at the end of the trace window
+        """
+        self.step += 1
+
+        if self.trace is not None and self.step >= self.trace_steps[1]:
+            self.stop_trace()
+
+
+    def stop_trace(self):
+        """"""
+        if self.trace is None:
+            return
+
+        self.trace.__exit__(None, None, None)
+
+        start, stop = self.trace_steps
+        os.makedirs(self.trace_dir, exist_ok=True)
+        self.trace.export_chrome_trace(os.path.join(self.trace_dir, f'trace-{self.name}-{start}-{stop}.json'))
+
+        self.trace = None
+
+
+    def summary(self):
+        """ per-phase totals, means, share of the wall time and memory high-water marks
+        """
+        wall_time = time.perf_counter() - self.start
+
+        phases = {}
+        for name, seconds in self.times.items():
+            phases[name] = {
+                'total_s': seconds,
+                'mean_ms': seconds / self.calls[name] * 1e3,
+                'calls': self.calls[name],
+                'fraction': seconds / wall_time if wall_time else 0.,
+                'peak_memory_mb': self.memory.get(name),
+            }
+
+        return {'wall_time': wall_time, 'phases': phases, 'counters': dict(self.counters)}
+
+
+    def format_summary(self, summary=None):
+        """"""
+        summary = summary or self.summary()
+
+        lines = [f'{self.name} profile, {summary["wall_time"]:.2f}s wall time']
+        lines.append(f'{"phase":<12}  {"total":>9}  {"mean":>10}  {"calls":>6}  {"share":>6}  {"memory":>10}')
+
+        for name, phase in summary['phases'].items():
+            memory = f'{phase["peak_memory_mb"]:>8.1f}MB' if phase['peak_memory_mb'] is not None else f'{"-":>10}'
+            lines.append(f'{name:<12}  {phase["total_s"]:>8.3f}s  {phase["mean_ms"]:>8.2f}ms  '
+                         f'{phase["calls"]:>6}  {phase["fraction"]:>6.1%}  {memory}')
+
+        for name, value in summary['counters'].items():
+            lines.append(f'{name}: {value}')
+
+        return '\n'.join(lines)
@@ -0,0 +1,151 @@
+import io
+import copy
+import inspect
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+
+# preferred quantized cpu backends, x86 and fbgemm on intel and amd, qnnpack on arm
+ENGINES = ['x86', 'fbgemm', 'qnnpack']
+
+# smp encoders of the default depth return six feature maps
+N_FEATURES = 6
+
+PARTS = ['encoder', 'decoder']
+
+
+def set_engine(engine=None):
+    """ select a quantized backend supported by this torch build, returns its name
+    """
+    supported = torch.backends.quantized.supported_engines
+    engine = engine or next((engine for engine in ENGINES if engine in supported), None)
+
+    if engine not in supported:
+        raise RuntimeError(f'quantized engine {engine} is not supported, available: {supported}')
+
+    torch.backends.quantized.engine = engine
+
+    return engine
+
+
+class FeaturesDecoder(nn.Module):
+    """ decoder with the encoder features as separate arguments, fx can not trace a list of inputs
+    """
+
+    def __init__(self, decoder):
+        super().__init__()
+        self.decoder = decoder
+
+        # smp < 0.3 decoders take the features as *features, later versions as a list
+        parameters = inspect.signature(decoder.forward).parameters.values()
+        self.unpacked = any(parameter.kind == parameter.VAR_POSITIONAL for parameter in parameters)
+
+
+    def forward(self, f0, f1, f2, f3, f4, f5):
+        """"""
+        features = [f0, f1, f2, f3, f4, f5]
+
+        return self.decoder(*features) if self.unpacked else self.decoder(features)
+
+
+class QuantizedDecoder(nn.Module):
+    """ takes the features the way the model passes them to its decoder
+    """
+
+    def __init__(self, decoder):
+        super().__init__()
+        self.decoder = decoder
+
+
+    def forward(self, *features):
+        """"""
+        if len(features) == 1 and isinstance(features[0], (list, tuple)):
+            features = features[0]
+
+        return self.decoder(*features)
+
+
+def calibration_batches(dataset, n=32, batch_size=4, seed=0, preprocessing=None):
+    """ a random subset of the dataset images as float batches, observers record activation ranges on these,
+        preprocessing converts uint8 batches, e.g. utils.augmentation.BatchPreprocessing
+    """
+    indices = np.random.default_rng(seed).choice(len(dataset), min(n, len(dataset)), replace=False)
+    images = [torch.as_tensor(np.asarray(dataset[i][0])) for i in indices]
+    batches = [torch.stack(images[i:i + batch_size]) for i in range(0, len(images), batch_size)]
+
+    return [preprocessing(x) if preprocessing else x.float() for x in batches]
+
+
+def quantize_static(model, batches, parts=PARTS, engine=None):
+    """ int8 copy of a segmentation model for cpu inference, post-training static quantization calibrated on batches,
+        encoder and decoder are traced and quantized separately, the segmentation head and activation stay fp32,
+        requires torch 1.13 or later
+    """
+    # qconfig mappings and example inputs of prepare_fx were added in torch 1.13
+    try:
+        from torch.ao.quantization import get_default_qconfig_mapping
+    except ImportError:
+        raise RuntimeError(f'quantization requires torch 1.13 or later, found {torch.__version__}, '
+                           f'install a later torch in a separate environment to quantize') from None
+
+    from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+    engine = set_engine(engine)
+    qconfig_mapping = get_default_qconfig_mapping(engine)
+
+    model = copy.deepcopy(model).cpu().eval()
+
+    with torch.no_grad():
+        features = model.encoder(batches[0])
+
+    if len(features) != N_FEATURES:
+        raise ValueError(f'only encoders of depth {N_FEATURES - 1} are supported, got {len(features) - 1}')
+
+    # multi-task models have a decoder per task
+    decoders = model.decoders if hasattr(model, 'decoders') else [model.decoder]
+    prepared = {}
+
+    # the model forward itself is not traceable, it checks input shapes in python
+    if 'encoder' in parts:
+        prepared['encoder'] = prepare_fx(model.encoder, qconfig_mapping, example_inputs=(batches[0],))
+    if 'decoder' in parts:
+        prepared['decoder'] = [prepare_fx(FeaturesDecoder(decoder), qconfig_mapping, example_inputs=tuple(features))
+                               for decoder in decoders]
+
+    with torch.no_grad():
+        for x in batches:
+            features = prepared.get('encoder', model.encoder)(x)
+
+            for decoder in prepared.get('decoder', []):
+                decoder(*features)
+
+    if 'encoder' in prepared:
+        encoder = convert_fx(prepared['encoder'])
+
+        # attributes the model reads from its encoder, e.g. to check input shapes
+        for name in ['out_channels', 'output_stride']:
+            if hasattr(model.encoder, name):
+                setattr(encoder, name, getattr(model.encoder, name))
+
+        model.encoder = encoder
+
+    if 'decoder' in prepared:
+        decoders = [QuantizedDecoder(convert_fx(decoder)) for decoder in prepared['decoder']]
+
+        if hasattr(model, 'decoders'):
+            model.decoders = nn.ModuleList(decoders)
+        else:
+            model.decoder = decoders[0]
+
+    return model
+
+
+def model_size(model):
+    """ size of the serialized state dict in bytes
+    """
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+
+    return buffer.tell()
@@ -0,0 +1,146 @@
+import os
+import cv2
+
+import numpy as np
+
+
+LAYOUTS = ['overlay', 'side']
+
+# overlay colour (rgb) and opacity of masked pixels
+COLOR = (255, 0, 0)
+ALPHA = .5
+
+# background and foreground of side-by-side masks, the default matplotlib colormap ends
+MASK_COLORS = np.array([[68, 1, 84], [253, 231, 37]], dtype='uint8')
+
+# contact sheets
+COLUMNS = 4
+ROWS = 4
+THUMBNAIL_WIDTH = 512
+LABEL_HEIGHT = 20
+
+
+def to_uint8(img, max_value=1.):
+    """ rgb uint8 image of uint8 images and float images in [0, max_value], the range is stated rather than taken
+        from the pixels, which would saturate dark [0, 255] images, matplotlib reads png as [0, 1]
+    """
+    img = np.asarray(img)
+
+    if img.dtype == np.uint8:
+        return img[..., :3]
+
+    return np.clip(img[..., :3] * (255 / max_value), 0, 255).astype('uint8')
+
+
+def overlay(img, mask, color=COLOR, alpha=ALPHA, max_value=1.):
+    """ image with the masked pixels blended with a colour
+    """
+    out = to_uint8(img, max_value).copy()
+    mask = np.asarray(mask, dtype=bool)
+
+    out[mask] = (out[mask] * (1 - alpha) + np.array(color) * alpha).astype('uint8')
+
+    return out
+
+
+def side_by_side(img, mask, max_value=1.):
+    """ image and colour mapped mask next to each other
+    """
+    return np.concatenate([to_uint8(img, max_value), MASK_COLORS[np.asarray(mask, dtype='uint8')]], axis=1)
+
+
+def render(img, mask, layout='overlay', max_value=1.):
+    """ rendering of an image and its mask, max_value is the maximum of float images
+    """
+    if layout == 'overlay':
+        return overlay(img, mask, max_value=max_value)
+
+    if layout == 'side':
+        return side_by_side(img, mask, max_value)
+
+    raise ValueError(f'unknown layout {layout}, choose from {LAYOUTS}')
+
+
+def thumbnail(img, width=THUMBNAIL_WIDTH):
+    """"""
+    height = round(img.shape[0] * width / img.shape[1])
+
+    return cv2.resize(img, (width, height), interpolation=cv2.INTER_AREA)
+
+
+def write(fpath, img):
+    """ write an rgb uint8 image, the format follows the extension
+    """
+    if not cv2.imwrite(fpath, img[..., ::-1]):
+        raise OSError(f'could not write {fpath}')
+
+
+def render_file(job, layout='overlay', width=THUMBNAIL_WIDTH, max_value=1.):
+    """ render and write an (fpath, img, mask) job, returns the fpath and a thumbnail for contact sheets
+    """
+    fpath, img, mask = job
+    out = render(img, mask, layout, max_value)
+
+    write(fpath, out)
+
+    return fpath, thumbnail(out, width) if width else None
+
+
+def contact_sheet(thumbnails, labels=None, columns=COLUMNS, label_height=LABEL_HEIGHT):
+    """ mosaic of equally sized thumbnails, row by row, with an optional label under each
+    """
+    height, width = thumbnails[0].shape[:2]
+    rows = -(-len(thumbnails) // columns)
+    cell = height + (label_height if labels else 0)
+
+    sheet = np.zeros((rows * cell, columns * width, 3), dtype='uint8')
+
+    for k, img in enumerate(thumbnails):
+        row, column = divmod(k, columns)
+        y, x = row * cell, column * width
+
+        sheet[y:y + height, x:x + width] = img[:height, :width]
+
+        if labels:
+            cv2.putText(sheet, str(labels[k]), (x + 4, y + cell - 6), cv2.FONT_HERSHEY_SIMPLEX, .4,
+                        (255, 255, 255), 1, cv2.LINE_AA)
+
+    return sheet
+
+
+class SheetWriter():
+    """ collects thumbnails and writes a contact sheet for every columns x rows of them
+    """
+
+    def __init__(self, save, columns=COLUMNS, rows=ROWS, extension='jpg'):
+        self.save = save
+        self.columns = columns
+        self.size = columns * rows
+        self.extension = extension
+
+        self.thumbnails, self.labels = [], []
+        self.n = 0
+
+        os.makedirs(save, exist_ok=True)
+
+
+    def add(self, img, label=''):
+        """"""
+        self.thumbnails.append(img)
+        self.labels.append(label)
+
+        if len(self.thumbnails) == self.size:
+            self.flush()
+
+
+    def flush(self):
+        """ write the collected thumbnails, also when the sheet is not full
+        """
+        if not self.thumbnails:
+            return
+
+        write(os.path.join(self.save, f'sheet-{self.n:05d}.{self.extension}'),
+              contact_sheet(self.thumbnails, self.labels, self.columns))
+
+        self.thumbnails, self.labels = [], []
+        self.n += 1
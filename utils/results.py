@@ -0,0 +1,100 @@
+import json
+import time
+import sqlite3
+import hashlib
+
+from . import rle
+
+
+CHUNK_SIZE = 2 ** 20
+
+
+def file_hash(fpath):
+    """ sha1 of the file contents
+    """
+    digest = hashlib.sha1()
+
+    with open(fpath, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def fingerprint(*fpaths, **settings):
+    """ hash of model checkpoints and the inference settings that change their results
+    """
+    source = json.dumps({'checkpoints': [file_hash(fpath) if fpath else None for fpath in fpaths],
+                         'settings': settings}, sort_keys=True, default=str)
+
+    return hashlib.sha1(source.encode()).hexdigest()
+
+
+class ResultCache():
+    """ per-image inference results and masks in sqlite, keyed by the content hash of the image and a fingerprint
+        of the models and settings, a new checkpoint or changed settings miss the cache, a changed image too
+    """
+
+    def __init__(self, fpath, model):
+        self.model = model
+        self.hits, self.misses = 0, 0
+
+        self.db = sqlite3.connect(fpath)
+        self.db.execute('PRAGMA journal_mode=WAL')
+
+        with self.db:
+            self.db.execute('CREATE TABLE IF NOT EXISTS results (image TEXT, model TEXT, fname TEXT, result TEXT, '
+                            'mask TEXT, created REAL, PRIMARY KEY (image, model))')
+            self.db.execute('CREATE INDEX IF NOT EXISTS results_fname ON results (fname, model)')
+
+
+    def get(self, image):
+        """ cached result of an image hash, None on a miss
+        """
+        row = self.db.execute('SELECT result FROM results WHERE image = ? AND model = ?', (image, self.model)).fetchone()
+
+        if row is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+
+        return json.loads(row[0])
+
+
+    def mask(self, image):
+        """ cached binary mask of an image hash, None without one
+        """
+        row = self.db.execute('SELECT mask FROM results WHERE image = ? AND model = ?', (image, self.model)).fetchone()
+
+        return rle.decode(json.loads(row[0])) if row and row[0] else None
+
+
+    def put(self, image, fname, result, mask=None):
+        """ store a result, replacing the result of an earlier version of the same file
+        """
+        mask = json.dumps(rle.encode(mask.astype('uint8'), compressed=True)) if mask is not None else None
+
+        with self.db:
+            self.db.execute('DELETE FROM results WHERE fname = ? AND model = ? AND image != ?', (fname, self.model, image))
+            self.db.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)',
+                            (image, self.model, fname, json.dumps(result), mask, time.time()))
+
+
+    def prune(self):
+        """ remove the results of other models and settings, returns the number removed
+        """
+        with self.db:
+            return self.db.execute('DELETE FROM results WHERE model != ?', (self.model,)).rowcount
+
+
+    def summary(self):
+        """"""
+        total = self.db.execute('SELECT COUNT(*) FROM results WHERE model = ?', (self.model,)).fetchone()[0]
+
+        return f'{self.hits} cached, {self.misses} computed, {total} results of this model in the cache'
+
+
+    def close(self):
+        """"""
+        self.db.close()
@@ -0,0 +1,121 @@
+import numpy as np
+
+from pycocotools import mask as cmask
+
+
+def is_compressed(rle):
+    """ compressed RLE stores counts as a string
+    """
+    return isinstance(rle['counts'], (str, bytes))
+
+
+def to_pycocotools(rle):
+    """ compressed RLE with bytes counts, as expected by pycocotools
+    """
+    counts = rle['counts']
+
+    return {'counts': counts.encode('ascii') if isinstance(counts, str) else counts,
+            'size': list(rle['size'])}
+
+
+def compress(rle):
+    """ compressed COCO RLE with json serializable (ascii) counts
+    """
+    if is_compressed(rle):
+        counts = rle['counts']
+    else:
+        counts = cmask.frPyObjects(rle, *rle['size'])['counts']
+
+    return {'counts': counts.decode('ascii') if isinstance(counts, bytes) else counts,
+            'size': list(rle['size'])}
+
+
+def decompress(rle):
+    """ uncompressed COCO RLE of a compressed one
+    """
+    if not is_compressed(rle):
+        return rle
+
+    return encode(decode(rle))
+
+
+def encode(binary_mask, compressed=False):
+    """ column-major COCO RLE of a binary mask, uncompressed unless specified
+    """
+    return encode_batch(np.asarray(binary_mask)[None], compressed=compressed)[0]
+
+
+def encode_batch(binary_masks, compressed=False):
+    """ RLE of a (N, H, W) batch of binary masks, run lengths are found in one vectorized pass
+    """
+    binary_masks = np.asarray(binary_masks)
+    n, height, width = binary_masks.shape
+    size = height * width
+
+    if n == 0 or size == 0:
+        rles = [{'counts': [], 'size': [height, width]} for _ in range(n)]
+        return [compress(rle) for rle in rles] if compressed else rles
+
+    # change points in column-major order are computed on the row-major layout,
+    # which avoids a transposed copy of the whole batch
+    k, i, j = np.nonzero(binary_masks[:, 1:, :] != binary_masks[:, :-1, :])
+    within_columns = k * size + j * height + i + 1
+
+    k, j = np.nonzero(binary_masks[:, 0, 1:] != binary_masks[:, -1, :-1])
+    between_columns = k * size + (j + 1) * height
+
+    # every mask starts a new run
+    boundaries = np.arange(n + 1) * size
+
+    edges = np.sort(np.concatenate((within_columns, between_columns, boundaries)))
+    runs = np.diff(edges)
+
+    # group runs per mask
+    splits = np.searchsorted(edges[:-1], boundaries[1:-1])
+    starts = binary_masks[:, 0, 0] == 1
+
+    rles = []
+    for i, counts in enumerate(np.split(runs, splits)):
+        counts = counts.tolist()
+
+        # counts always start with a run of zeros
+        if starts[i]:
+            counts = [0] + counts
+
+        rles.append({'counts': counts, 'size': [height, width]})
+
+    if compressed:
+        return [compress(rle) for rle in rles]
+
+    return rles
+
+
+def decode(rle):
+    """ binary mask of a compressed or uncompressed column-major COCO RLE
+    """
+    if is_compressed(rle):
+        return cmask.decode(to_pycocotools(rle))
+
+    counts = np.asarray(rle['counts'], dtype=np.int64)
+    height, width = rle['size']
+
+    # runs alternate between zeros and ones, starting with zeros
+    values = np.arange(len(counts), dtype=np.uint8) % 2
+    flat = np.repeat(values, counts)
+
+    return flat.reshape((height, width), order='F')
+
+
+def decode_batch(rles):
+    """ (N, H, W) batch of binary masks of equally sized RLEs
+    """
+    return np.stack([decode(rle) for rle in rles])
+
+
+def area(rle):
+    """ number of positive pixels, without decoding
+    """
+    if is_compressed(rle):
+        return int(cmask.area(to_pycocotools(rle)))
+
+    return int(sum(rle['counts'][1::2]))
@@ -0,0 +1,253 @@
+import cv2
+
+import numpy as np
+
+from .inference import crop_centers, PANORAMA_WIDTH
+
+
+# panorama and crop details, matching scripts/split_pan.py
+PANORAMA_HEIGHT = 4000
+
+WIDTH = 1024
+HEIGHT = 512
+HORIZON = 2000
+
+# width of of polyline polygon-like mask, matching scripts/cvat2coco.py
+PIXELS = 11
+
+# capture routes, consecutive panoramas are a few metres apart
+ROUTE_LENGTH = 50
+STEP_METRES = 5.
+ORIGIN = (4.8952, 52.3702) # lng, lat of amsterdam city center
+EXTENT = .03 # degrees around origin
+
+# number of neighbourhoods per axis, used to generate buurtcodes
+GRID = 8
+
+SIDES = ['l', 'r']
+
+
+def get_rng(seed, *keys):
+    """ independent deterministic random generator per (seed, key) pair
+    """
+    return np.random.default_rng([seed, *keys])
+
+
+def make_metadata(seed, index):
+    """ panorama metadata along a synthetic capture route
+    """
+    route, step = divmod(index, ROUTE_LENGTH)
+    rng = get_rng(seed, route)
+
+    # route start and driving direction
+    lng, lat = ORIGIN + rng.uniform(-EXTENT, EXTENT, size=2)
+    heading = rng.uniform(0, 360)
+
+    # walk along the route in metres
+    metres = step * STEP_METRES + get_rng(seed, route, step).normal(0, .5)
+    dx = np.sin(np.radians(heading)) * metres
+    dy = np.cos(np.radians(heading)) * metres
+
+    lng += dx / (111320 * np.cos(np.radians(lat)))
+    lat += dy / 110540
+
+    # neighbourhood code from a coarse grid over the extent
+    gx = int(np.clip((lng - ORIGIN[0] + EXTENT) / (2 * EXTENT) * GRID, 0, GRID - 1))
+    gy = int(np.clip((lat - ORIGIN[1] + EXTENT) / (2 * EXTENT) * GRID, 0, GRID - 1))
+
+    return {
+        'filename_dump': f'SYN{seed:04d}-{index:07d}-equirectangular-panorama_8000.jpg',
+        'heading': round(float(heading), 3),
+        'lng': round(float(lng), 7),
+        'lat': round(float(lat), 7),
+        'timestamp': int(1600000000 + route * 3600 + step * 2),
+        'surface_type': 'water',
+        'Buurtcode': f'{chr(65 + gx)}{gy:02d}a',
+    }
+
+
+def make_background(rng, rows, cols, width=PANORAMA_WIDTH):
+    """ sky, facades and water for panorama rows and columns
+    """
+    rows = np.asarray(rows, dtype=np.float32)[:, None]
+    cols = np.asarray(cols, dtype=np.float32)[None, :]
+
+    # vertical profile relative to the horizon
+    sky = (rows < HORIZON - 260) * (.6 + .4 * np.clip((HORIZON - 260 - rows) / 1500, 0, 1))
+    facade = ((rows >= HORIZON - 260) & (rows < HORIZON + 20)).astype(np.float32)
+    water = np.clip((rows - HORIZON - 20) / 2000, 0, 1) + (rows >= HORIZON + 20)
+
+    # facades vary along the horizontal panorama angle
+    angle = 2 * np.pi * cols / width
+    phase = rng.uniform(0, 2 * np.pi, size=3)
+    pattern = .5 + .25 * np.sin(24 * angle + phase[0]) + .25 * np.sin(61 * angle + phase[1])
+
+    image = np.zeros((rows.shape[0], cols.shape[1], 3), dtype=np.float32)
+    image += sky[..., None] * np.array([120, 170, 230], dtype=np.float32)
+    image += facade[..., None] * pattern[..., None] * np.array([150, 90, 70], dtype=np.float32)
+    image += (water > 0)[..., None] * np.array([40, 70, 80], dtype=np.float32) * (1 + .2 * np.sin(5 * angle + phase[2]))[..., None]
+
+    return image
+
+
+def add_noise(rng, image, sigma=4, tile=256):
+    """ add tiled gaussian sensor noise and convert to uint8
+    """
+    noise = rng.normal(0, sigma, size=(tile, tile, 1)).astype(np.float32)
+    reps = (-(-image.shape[0] // tile), -(-image.shape[1] // tile), 1)
+
+    image += np.tile(noise, reps)[:image.shape[0], :image.shape[1]]
+
+    return np.ascontiguousarray(np.clip(image, 0, 255), dtype=np.uint8)
+
+
+def make_geometry(rng, width=WIDTH, height=HEIGHT, density=.5):
+    """ quay polygon and fence polylines in crop coordinates
+    """
+    fences, quays = [], []
+
+    # quay top line with a slight slope
+    y0 = rng.uniform(.5, .65) * height
+    slope = rng.uniform(-.05, .05)
+    depth = rng.uniform(40, 80)
+
+    x0, x1 = sorted(rng.uniform(0, width, size=2))
+    if x1 - x0 < width / 4:
+        x0, x1 = 0, width
+
+    quay_y = lambda x: y0 + slope * (x - width / 2)
+
+    quays.append(np.array([[x0, quay_y(x0)], [x1, quay_y(x1)],
+                           [x1, quay_y(x1) + depth], [x0, quay_y(x0) + depth]]))
+
+    # fences along the quay, at most three segments
+    if rng.uniform() < density:
+        n = rng.integers(1, 4)
+        edges = np.sort(rng.uniform(x0, x1, size=2 * n))
+
+        for start, stop in zip(edges[::2], edges[1::2]):
+            if stop - start < 30:
+                continue
+
+            xs = np.linspace(start, stop, rng.integers(2, 6))
+            ys = np.array([quay_y(x) for x in xs]) - rng.uniform(20, 60) + rng.normal(0, 2, size=len(xs))
+
+            fences.append(np.stack([xs, ys], axis=1))
+
+    return fences, quays
+
+
+def make_mask(rng, height=HEIGHT, width=WIDTH, density=.05, pixels=PIXELS):
+    """ binary mask of thick random polylines covering roughly a fraction of the pixels
+    """
+    canvas = np.zeros((height, width), dtype=np.uint8)
+    target = density * height * width
+
+    while cv2.countNonZero(canvas) < target:
+        n = rng.integers(2, 6)
+        x0 = rng.uniform(0, width)
+        xs = x0 + np.sort(rng.uniform(0, width / 8, size=n))
+        ys = rng.uniform(0, height) + np.cumsum(rng.normal(0, height / 50, size=n))
+
+        thickness = int(rng.integers(pixels // 2, 2 * pixels))
+        cv2.polylines(canvas, [np.stack([xs, ys], axis=1).astype(np.int32)], False, 1, thickness)
+
+    return canvas
+
+
+def draw_geometry(image, fences, quays, rng):
+    """ draw quay walls and fences (rails and posts) in place
+    """
+    for quay in quays:
+        cv2.fillPoly(image, [quay.astype(np.int32)], (110, 95, 85))
+
+    for fence in fences:
+        color = tuple(float(c) for c in rng.uniform(10, 60, size=3))
+        points = fence.astype(np.int32)
+
+        # top rail, bottom rail and posts around the annotated polyline
+        cv2.polylines(image, [points - [0, 5]], False, color, 3)
+        cv2.polylines(image, [points + [0, 5]], False, color, 2)
+
+        for x in np.arange(points[0, 0], points[-1, 0], 40):
+            y = int(np.interp(x, points[:, 0], points[:, 1]))
+            cv2.line(image, (int(x), y - 8), (int(x), y + 8), color, 3)
+
+    return image
+
+
+def fence_mask(fences, width=WIDTH, height=HEIGHT, pixels=PIXELS):
+    """ polygon-like (blob) binary mask of fence polylines
+    """
+    canvas = np.zeros((height, width), dtype=np.uint8)
+
+    for fence in fences:
+        line = np.zeros((height, width), dtype=np.uint8)
+        line = cv2.polylines(line, [fence.astype(np.int32)], False, 1, pixels)
+
+        # convex hull of each thickened polyline, as done by to_blobs
+        coords = cv2.findNonZero(line)
+        if coords is not None:
+            cv2.fillConvexPoly(canvas, cv2.convexHull(coords), 1)
+
+    return canvas
+
+
+def quay_mask(quays, width=WIDTH, height=HEIGHT):
+    """ binary mask of quay polygons
+    """
+    canvas = np.zeros((height, width), dtype=np.uint8)
+
+    for quay in quays:
+        cv2.fillPoly(canvas, [quay.astype(np.int32)], 1)
+
+    return canvas
+
+
+def make_panorama(seed, index, metadata=None, width=PANORAMA_WIDTH, height=PANORAMA_HEIGHT, density=.5):
+    """ full equirectangular panorama with both crops drawn in
+    """
+    metadata = metadata or make_metadata(seed, index)
+    rng = get_rng(seed, index, 0)
+
+    # render at a quarter of the resolution, the crops are drawn at full resolution
+    panorama = make_background(rng, np.arange(0, height, 4), np.arange(0, width, 4), width=width)
+    panorama = cv2.resize(add_noise(rng, panorama), (width, height), interpolation=cv2.INTER_LINEAR)
+
+    crops = []
+    for i, center in enumerate(crop_centers(metadata['heading'], width=width)):
+        cols = np.arange(center - WIDTH // 2, center + WIDTH // 2) % width
+        rows = np.arange(HORIZON - HEIGHT // 2, HORIZON + HEIGHT // 2)
+
+        crop, fences, quays = make_crop(seed, index, i, image=panorama[rows][:, cols], density=density)
+
+        # write the crop back, wrapping around the 0/360 degree seam
+        panorama[np.ix_(rows, cols)] = crop
+        crops.append((crop, fences, quays))
+
+    return panorama, crops
+
+
+def make_crop(seed, index, side, image=None, density=.5, render=True):
+    """ crop image, fence polylines and quay polygons for one side
+    """
+    # geometry and texture use separate streams, so annotations do not depend on rendering
+    fences, quays = make_geometry(get_rng(seed, index, side + 1), density=density)
+
+    if not render:
+        return None, fences, quays
+
+    rng = get_rng(seed, index, side + 1, 0)
+
+    if image is None:
+        center = crop_centers(make_metadata(seed, index)['heading'])[side]
+        cols = np.arange(center - WIDTH // 2, center + WIDTH // 2) % PANORAMA_WIDTH
+        rows = np.arange(HORIZON - HEIGHT // 2, HORIZON + HEIGHT // 2)
+
+        image = add_noise(rng, make_background(rng, rows, cols))
+    else:
+        image = add_noise(rng, image.astype(np.float32))
+
+    image = draw_geometry(image, fences, quays, rng)
+
+    return image, fences, quays
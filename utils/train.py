@@ -1,16 +1,21 @@
 import sys
+import time
 import torch
+import warnings
 
-from torch.cuda.amp import autocast, GradScaler
+from contextlib import nullcontext
+from torch.cuda.amp import GradScaler
 from tqdm import tqdm as tqdm
 from .metrics import AverageValueMeter
+from .distributed import wrap, is_distributed, all_reduce_sum, all_reduce_meters
 
 
 # everything below sourced from: segmentation-models-pytorch, customised to enable mixed precision training
 # github.com/qubvel/segmentation_models.pytorch/blob/master/segmentation_models_pytorch/utils/train.py
 
 class Epoch:
-    def __init__(self, model, loss, metrics, stage_name, device="cpu", precision='single', verbose=True):
+    def __init__(self, model, loss, metrics, stage_name, device="cpu", precision='single', verbose=True, profiler=None,
+                 channels_last=False, compile=False, distributed=False, preprocessing=None):
         self.model = model
         self.loss = loss
         self.metrics = metrics
@@ -19,13 +24,39 @@ class Epoch:
         self.device = device
         self.precision = precision
 
+        # mixed precision uses float16 on gpu and bfloat16 on cpu
+        self.device_type = torch.device(device).type
+        self.mixed_precision = precision == 'mixed'
+
         self.predictions = []
         self.targets = []
 
+        # wall time, throughput and data loading time of the last run
+        self.timings = {}
+
+        # optional utils.profile.PhaseProfiler
+        self.profiler = profiler
+
+        # performance modes
+        self.memory_format = torch.channels_last if channels_last else torch.contiguous_format
+        self.compile = compile
+
+        # float conversion and encoder preprocessing of uint8 batches on the device, e.g. BatchPreprocessing
+        self.preprocessing = preprocessing
+
         self._to_device()
 
+        # data parallel over all processes, the wrapped model is only used for the forward pass
+        self.distributed = distributed
+
+        if distributed:
+            self.model = wrap(self.model, self.device)
+
+        # compiled forward, the model itself is kept for saving
+        self.forward = self._compile() if compile else self.model.forward
+
     def _to_device(self):
-        self.model.to(self.device)
+        self.model.to(self.device, memory_format=self.memory_format)
         self.loss.to(self.device)
         for metric in self.metrics:
             metric.to(self.device)
@@ -35,13 +66,39 @@ class Epoch:
         s = ", ".join(str_logs)
         return s
 
+    def _compile(self):
+        if not hasattr(torch, 'compile'):
+            warnings.warn(f'torch.compile requires torch 2.0 or later, found {torch.__version__}, running eagerly')
+            return self.model.forward
+
+        return torch.compile(self.model)
+
+    def to_device(self, x, y):
+        # asynchronous copies from pinned memory, see config.PIN_MEMORY
+        x = x.to(self.device, memory_format=self.memory_format, non_blocking=True)
+        y = y.to(self.device, non_blocking=True)
+
+        x = self.preprocessing(x) if self.preprocessing else x.float()
+
+        return x, y.float()
+
+    def phase(self, name):
+        return self.profiler.phase(name) if self.profiler else nullcontext()
+
+    def autocast(self):
+        dtype = torch.float16 if self.device_type == 'cuda' else torch.bfloat16
+        return torch.autocast(self.device_type, dtype=dtype, enabled=self.mixed_precision)
+
     def batch_update(self, x, y):
         raise NotImplementedError
 
+    def get_lr(self):
+        return None
+
     def on_epoch_start(self):
         pass
 
-    def run(self, dataloader, save=False):
+    def run(self, dataloader, save=False, log=None, epoch=None):
 
         self.on_epoch_start()
 
@@ -52,42 +109,100 @@ class Epoch:
         loss_meter = AverageValueMeter()
         metrics_meters = {metric.__name__: AverageValueMeter() for metric in self.metrics}
 
+        n_images, data_wait = 0, 0.
+        start = end = time.perf_counter()
+
+        if self.profiler:
+            self.profiler.reset()
+
         with tqdm(
             dataloader,
             desc=self.stage_name,
             file=sys.stdout,
             disable=not (self.verbose),
         ) as iterator:
-            for x, y in iterator:
-                x, y = x.to(self.device), y.to(self.device)
+            for step, (x, y) in enumerate(iterator):
+                loaded = time.perf_counter()
+
+                if self.profiler:
+                    self.profiler.record('data', loaded - end)
+                    self.profiler.count('images', len(x))
+                    self.profiler.on_step_start()
+
+                with self.phase('to_device'):
+                    x, y = self.to_device(x, y)
+
                 loss, y_pred = self.batch_update(x, y)
 
-                if save:
-                    self.predictions.append(y_pred.cpu().detach())
-                    self.targets.append(y.cpu().detach())
+                with self.phase('metrics'):
+                    if save:
+                        self.predictions.append(y_pred.cpu().detach())
+                        self.targets.append(y.cpu().detach())
+
+                    # update loss logs
+                    loss_value = loss.cpu().detach().numpy()
+                    loss_meter.add(loss_value)
+                    loss_logs = {self.loss.__name__: loss_meter.mean}
+                    logs.update(loss_logs)
 
-                # update loss logs
-                loss_value = loss.cpu().detach().numpy()
-                loss_meter.add(loss_value)
-                loss_logs = {self.loss.__name__: loss_meter.mean}
-                logs.update(loss_logs)
+                    # update metrics logs
+                    for metric_fn in self.metrics:
+                        metric_value = metric_fn(y_pred, y).cpu().detach().numpy()
+                        metrics_meters[metric_fn.__name__].add(metric_value)
+                    metrics_logs = {k: v.mean for k, v in metrics_meters.items()}
+                    logs.update(metrics_logs)
 
-                # update metrics logs
-                for metric_fn in self.metrics:
-                    metric_value = metric_fn(y_pred, y).cpu().detach().numpy()
-                    metrics_meters[metric_fn.__name__].add(metric_value)
-                metrics_logs = {k: v.mean for k, v in metrics_meters.items()}
-                logs.update(metrics_logs)
+                if self.profiler:
+                    self.profiler.on_step_end()
 
                 if self.verbose:
                     s = self._format_logs(logs)
                     iterator.set_postfix_str(s)
 
+                # the loss is on the cpu at this point, so the step has finished
+                wait, step_time = loaded - end, time.perf_counter() - loaded
+                end = time.perf_counter()
+
+                n_images += len(x)
+                data_wait += wait
+
+                if log is not None:
+                    log.add_step(self.stage_name,
+                                 epoch=epoch,
+                                 step=step,
+                                 batch_size=len(x),
+                                 loss=float(loss_value),
+                                 lr=self.get_lr(),
+                                 data_wait=wait,
+                                 step_time=step_time,
+                                 images_per_sec=len(x) / (wait + step_time))
+
+        # losses and metrics averaged over the batches of all processes, images counted over all processes
+        if is_distributed():
+            logs = all_reduce_meters({self.loss.__name__: loss_meter, **metrics_meters})
+            n_images, data_wait = all_reduce_sum([n_images, data_wait])
+
+        wall_time = end - start
+        self.timings = {
+            'wall_time': wall_time,
+            'images_per_sec': n_images / wall_time if wall_time else 0.,
+            'data_wait': data_wait,
+        }
+
+        if self.profiler:
+            # a trace window extending past the epoch is closed here
+            self.profiler.stop_trace()
+            self.timings['profile'] = self.profiler.summary()
+
+            if self.verbose:
+                print(self.profiler.format_summary(self.timings['profile']))
+
         return logs
 
 
 class TrainEpoch(Epoch):
-    def __init__(self, model, loss, metrics, optimizer, device="cpu", precision='single', verbose=True):
+    def __init__(self, model, loss, metrics, optimizer, device="cpu", precision='single', verbose=True, profiler=None,
+                 channels_last=False, compile=False, accumulation_steps=1, distributed=False, preprocessing=None):
         super().__init__(
             model=model,
             loss=loss,
@@ -96,13 +211,23 @@ class TrainEpoch(Epoch):
             device=device,
             precision=precision,
             verbose=verbose,
+            profiler=profiler,
+            channels_last=channels_last,
+            compile=compile,
+            distributed=distributed,
+            preprocessing=preprocessing,
         )
 
         self.optimizer = optimizer
-        self.mixed_precision = precision == 'mixed'
 
-        # add gradient scaler
-        self.scaler = GradScaler(enabled=self.mixed_precision)
+        # every batch is split into micro-batches, gradients are accumulated before a single step
+        self.accumulation_steps = accumulation_steps
+
+        # add gradient scaler, only needed for float16
+        self.scaler = GradScaler(enabled=self.mixed_precision and self.device_type == 'cuda')
+
+    def get_lr(self):
+        return self.optimizer.param_groups[0]['lr']
 
     def on_epoch_start(self):
         self.model.train()
@@ -110,38 +235,76 @@ class TrainEpoch(Epoch):
     def batch_update(self, x, y):
         self.optimizer.zero_grad()
 
+        if self.accumulation_steps > 1:
+            return self._accumulate(x, y)
+
         # autocast for mixed precision training
-        with autocast(enabled=self.mixed_precision):
-            prediction = self.model.forward(x)
+        with self.phase('forward'), self.autocast():
+            prediction = self.forward(x)
             loss = self.loss(prediction, y)
 
         # backward prop loss with scaled gradients
-        self.scaler.scale(loss).backward()
-        self.scaler.step(self.optimizer)
-        self.scaler.update()
+        with self.phase('backward'):
+            self.scaler.scale(loss).backward()
+
+        with self.phase('optimizer'):
+            self.scaler.step(self.optimizer)
+            self.scaler.update()
 
         return loss, prediction
 
+    def _accumulate(self, x, y):
+        losses, predictions = [], []
+        chunks = list(zip(x.chunk(self.accumulation_steps), y.chunk(self.accumulation_steps)))
+
+        for i, (x_micro, y_micro) in enumerate(chunks):
+            # weight by micro-batch size, so the gradient matches the mean over the batch
+            weight = len(x_micro) / len(x)
+
+            # gradients are only all-reduced after the last micro-batch
+            sync = not self.distributed or i == len(chunks) - 1
+
+            with nullcontext() if sync else self.model.no_sync():
+                with self.phase('forward'), self.autocast():
+                    prediction = self.forward(x_micro)
+                    loss = self.loss(prediction, y_micro)
+
+                with self.phase('backward'):
+                    self.scaler.scale(loss * weight).backward()
+
+            losses.append(loss.detach() * weight)
+            predictions.append(prediction.detach())
+
+        with self.phase('optimizer'):
+            self.scaler.step(self.optimizer)
+            self.scaler.update()
+
+        return torch.stack(losses).sum(), torch.cat(predictions)
+
 
 class ValidEpoch(Epoch):
-    def __init__(self, model, loss, metrics, device="cpu", precision='single', verbose=True):
+    def __init__(self, model, loss, metrics, device="cpu", precision='single', verbose=True, profiler=None,
+                 channels_last=False, compile=False, preprocessing=None):
         super().__init__(
             model=model,
             loss=loss,
             metrics=metrics,
             stage_name="valid",
             device=device,
+            precision=precision,
             verbose=verbose,
+            profiler=profiler,
+            channels_last=channels_last,
+            compile=compile,
+            preprocessing=preprocessing,
         )
 
-        self.mixed_precision = precision == 'mixed'
-
     def on_epoch_start(self):
         self.model.eval()
 
     def batch_update(self, x, y):
-        with torch.no_grad():
-            with autocast(enabled=self.mixed_precision):
-                prediction = self.model.forward(x)
+        with torch.no_grad(), self.phase('forward'):
+            with self.autocast():
+                prediction = self.forward(x)
                 loss = self.loss(prediction, y)
         return loss, prediction
\ No newline at end of file